@@ -0,0 +1,85 @@
+"""Time get_multi_track_data on large playlists, paging sequentially vs pipelined.
+
+Each playlist is resolved under two sets of API limits:
+  shipped      the defaults a real run uses (MAX_API_CONNECTIONS, API_RATE_LIMIT)
+  unthrottled  a connection per page in flight and no effective rate limit,
+               i.e. what pipelining can do when nothing but latency is in the way
+
+Usage: python bench/bench_pagination.py [--tracks 10000 50000] [--latency 0.05 0.25]
+"""
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"src"))
+
+import spotify_dl
+from stand_in_server import StandInServer
+
+LIMITS = ['shipped', 'unthrottled']
+SHIPPED_API_RATE_LIMIT = spotify_dl.API_RATE_LIMIT
+SHIPPED_MAX_API_CONNECTIONS = spotify_dl.MAX_API_CONNECTIONS
+
+
+def set_limits(limits: str, prefetch_pages: int) -> None:
+    if limits == 'shipped':
+        spotify_dl.API_RATE_LIMIT = SHIPPED_API_RATE_LIMIT
+        spotify_dl.MAX_API_CONNECTIONS = SHIPPED_MAX_API_CONNECTIONS
+    else:
+        spotify_dl.API_RATE_LIMIT = 10_000
+        spotify_dl.MAX_API_CONNECTIONS = prefetch_pages + 1
+
+    # Both are created per host on first use, with the limits at the time
+    spotify_dl._rate_limiters.clear()
+    spotify_dl._host_semaphores.clear()
+
+
+def time_resolution(playlist_id: str, prefetch_pages: int) -> tuple:
+    spotify_dl.TRACK_LIST_PREFETCH_PAGES = prefetch_pages
+    # Even with CACHE_ENABLED off there's an in-memory cache, which would
+    # hand the second run the pages the first one fetched
+    spotify_dl._metadata_cache = None
+
+    start = perf_counter()
+    resp = spotify_dl.get_multi_track_data(playlist_id, "playlist")
+    elapsed = perf_counter() - start
+
+    return elapsed, [track.id for track in resp['trackList']]
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--tracks', type=int, nargs='+', default=[10_000, 50_000])
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.05, 0.25], help="Seconds added to every stand-in response.")
+    parser.add_argument('--prefetch-pages', type=int, default=spotify_dl.TRACK_LIST_PREFETCH_PAGES)
+    parser.add_argument('--limits', nargs='+', choices=LIMITS, default=LIMITS)
+    args = parser.parse_args()
+
+    # Measure paging only: nothing cached from earlier runs
+    spotify_dl.CACHE_ENABLED = False
+
+    print(f"{'latency':>8} {'limits':<12} {'tracks':>8} {'pages':>6} {'sequential':>11} {'pipelined':>10} {'speedup':>8}")
+    for latency in args.latency:
+        with StandInServer(latency=latency) as stand_in:
+            spotify_dl.DOWNLOADER_URL = stand_in.api_url
+
+            for limits in args.limits:
+                set_limits(limits, args.prefetch_pages)
+
+                for num_tracks in args.tracks:
+                    playlist_id = f"pl{num_tracks}"
+
+                    sequential, sequential_ids = time_resolution(playlist_id, 0)
+                    pipelined, pipelined_ids = time_resolution(playlist_id, args.prefetch_pages)
+                    assert sequential_ids == pipelined_ids and len(pipelined_ids) == num_tracks
+
+                    pages = -(-num_tracks // stand_in.page_size)
+                    print(
+                        f"{latency * 1000:>6.0f}ms {limits:<12} {num_tracks:>8} {pages:>6} "
+                        f"{sequential:>10.2f}s {pipelined:>9.2f}s {sequential / pipelined:>7.1f}x"
+                    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""Startup cost of spotify_dl, with budgets to fail on regressions.
+
+Measures, each in a fresh interpreter:
+  import     cumulative `python -X importtime` time of `import spotify_dl`
+  --help     wall time of `spotify_dl.py --help`
+  no-op run  wall time of a CLI run where every track is already downloaded
+             and its metadata cached (what cron runs over an up-to-date library do)
+
+and checks that none of the heavy, lazily imported modules got loaded by the
+import or the no-op run.  Exits non-zero if anything is over budget.
+
+Usage: python bench/bench_startup.py [--repeat 5] [--import-budget-ms 150] [--run-budget-ms 500]
+"""
+import json
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+BENCH_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCH_DIR.parent/"src"
+
+# Only needed once something actually has to be downloaded/tagged
+LAZY_MODULES = ['asyncio', 'cProfile', 'email.utils', 'mutagen', 'pstats', 'requests']
+
+RUN_CLI = """
+import json, sys
+sys.path.insert(0, {src_dir!r})
+import spotify_dl
+spotify_dl.DOWNLOADER_URL = {api_url!r}
+sys.argv = ['spotify_dl', *{cli_args!r}]
+spotify_dl.main()
+print(json.dumps(sorted(name for name in {lazy_modules!r} if name in sys.modules)), file=sys.stderr)
+"""
+
+
+def import_time_ms() -> tuple:
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {str(SRC_DIR)!r}); import spotify_dl"],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    # import time: self [us] | cumulative | imported package
+    rows = []
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'self' not in line:
+            _, cumulative, name = line.split('|')
+            rows.append((name.strip(), int(cumulative) / 1000))
+
+    # Modules spotify_dl pulls in come right before it, indented under it
+    spotify_dl_ms = next(ms for name, ms in rows if name == 'spotify_dl')
+    start = max(idx for idx, (name, _) in enumerate(rows) if name == 'site') + 1
+    imported = [name for name, _ in rows[start:]]
+
+    return spotify_dl_ms, sorted(rows[start:-1], key=lambda row: -row[1]), imported
+
+
+def wall_time_ms(args: list, **kwargs) -> tuple:
+    start = perf_counter()
+    proc = subprocess.run(args, capture_output=True, text=True, **kwargs)
+    elapsed = (perf_counter() - start) * 1000
+
+    if proc.returncode:
+        raise RuntimeError(f"{args} failed:\n{proc.stderr}")
+
+    return elapsed, proc
+
+
+def main():
+    sys.path.insert(0, str(BENCH_DIR))
+    from stand_in_server import StandInServer
+
+    parser = ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per measurement; the fastest counts.")
+    parser.add_argument('--import-budget-ms', type=float, default=150.0)
+    parser.add_argument('--run-budget-ms', type=float, default=500.0)
+    args = parser.parse_args()
+
+    over_budget = []
+
+    runs = [import_time_ms() for _ in range(args.repeat)]
+    spotify_dl_ms, slowest, imported = min(runs, key=lambda run: run[0])
+    eagerly_loaded = sorted({name.split('.')[0] for name in imported} & set(LAZY_MODULES))
+
+    print(f"import spotify_dl: {spotify_dl_ms:.1f}ms (budget {args.import_budget_ms:.0f}ms)")
+    for name, ms in slowest[:8]:
+        print(f"  {ms:>7.1f}ms  {name}")
+    if spotify_dl_ms > args.import_budget_ms:
+        over_budget.append("import")
+    if eagerly_loaded:
+        print(f"  [!] Loaded at import: {', '.join(eagerly_loaded)}")
+        over_budget.append("lazy imports")
+
+    help_ms = min(wall_time_ms([sys.executable, str(SRC_DIR/"spotify_dl.py"), '--help'])[0] for _ in range(args.repeat))
+    print(f"spotify_dl.py --help: {help_ms:.0f}ms")
+
+    with StandInServer() as stand_in, tempfile.TemporaryDirectory(prefix="spotify_dl_bench_startup_") as work_dir:
+        work_dir = Path(work_dir)
+        cli_args = ['-u', "https://open.spotify.com/track/startup0", '-o', str(work_dir/"out"), '-c', '-s']
+        run_cli = [
+            sys.executable,
+            '-c',
+            RUN_CLI.format(src_dir=str(SRC_DIR), api_url=stand_in.api_url, cli_args=cli_args, lazy_modules=LAZY_MODULES)
+        ]
+        env = {'HOME': str(work_dir/"home"), 'PATH': ''}
+
+        # Downloads the track and caches its metadata
+        wall_time_ms(run_cli, env=env)
+        stand_in.reset_counts()
+
+        noop_runs = [wall_time_ms(run_cli, env=env) for _ in range(args.repeat)]
+        noop_ms, noop_proc = min(noop_runs, key=lambda run: run[0])
+        noop_loaded = json.loads(noop_proc.stderr.splitlines()[-1])
+
+        print(f"up-to-date run: {noop_ms:.0f}ms (budget {args.run_budget_ms:.0f}ms), "
+              f"{sum(stand_in.request_counts.values())} requests")
+        if noop_ms > args.run_budget_ms:
+            over_budget.append("up-to-date run")
+        if noop_loaded:
+            print(f"  [!] Loaded during the up-to-date run: {', '.join(noop_loaded)}")
+            over_budget.append("lazy imports")
+
+    if over_budget:
+        print(f"\nOver budget: {', '.join(dict.fromkeys(over_budget))}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
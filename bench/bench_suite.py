@@ -0,0 +1,178 @@
+"""End-to-end benchmark of the CLI against the stand-in API/CDN.
+
+Runs each scenario through spotify_dl.main() in a fresh process (cold caches,
+empty output dirs, its own peak RSS) and reports tracks/sec, p50/p99 per-track
+latency, peak RSS and how many requests of each kind the stand-in served.
+
+Scenarios:
+  single     one track URL
+  playlist   a 1,000-track playlist
+  config     a config file of albums, a playlist and single tracks over several output dirs
+
+By default client-side rate limits are lifted so the numbers reflect the
+downloader itself; pass e.g. `--cli-args="--api-rate 10"` to measure with them.
+
+Usage: python bench/bench_suite.py [--scenarios single playlist config] [--latency 0.02]
+                                   [--bandwidth 2000000] [--rate-429 0.05] [--link-ttl 30]
+                                   [--slow-transfers 0.01]
+                                   [--json results.json]
+"""
+import json
+import os
+import resource
+import shlex
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from pathlib import Path
+from statistics import quantiles
+from time import perf_counter
+
+BENCH_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCH_DIR.parent/"src"
+
+SCENARIOS = {
+    'single': lambda work_dir: ['-u', "https://open.spotify.com/track/single0", '-o', str(work_dir/"out"), '-c'],
+    'playlist': lambda work_dir: ['-u', "https://open.spotify.com/playlist/pl1000", '-o', str(work_dir/"out"), '-c'],
+    'config': lambda work_dir: ['-k', str(write_config(work_dir))],
+}
+
+DEFAULT_CLI_ARGS = "--api-rate 1000 --cdn-rate 1000 --api-connections 8 --cdn-connections 8 -j 8"
+
+
+def write_config(work_dir: Path) -> Path:
+    entries = [
+        {'url': "https://open.spotify.com/album/alb120", 'output_dir': str(work_dir/"albums"), 'create_dir': True},
+        {'url': "https://open.spotify.com/album/alb80", 'output_dir': str(work_dir/"albums"), 'create_dir': True},
+        {'url': "https://open.spotify.com/playlist/mix300", 'output_dir': str(work_dir/"playlists"), 'create_dir': True},
+        {'url': "https://open.spotify.com/track/single1", 'output_dir': str(work_dir/"singles"), 'create_dir': True},
+        {'url': "https://open.spotify.com/track/single2", 'output_dir': str(work_dir/"singles"), 'create_dir': True},
+    ]
+
+    config_file = work_dir/"config.json"
+    config_file.write_text(json.dumps(entries))
+    return config_file
+
+
+def run_child(api_url: str, cli_args: list) -> dict:
+    # Runs in the benchmark subprocess; HOME already points at a scratch dir
+    sys.path.insert(0, str(SRC_DIR))
+    import spotify_dl
+
+    spotify_dl.DOWNLOADER_URL = api_url
+
+    track_latencies = []
+    download_track = spotify_dl.download_track
+
+    def timed_download_track(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return download_track(*args, **kwargs)
+        finally:
+            track_latencies.append(perf_counter() - start)
+
+    spotify_dl.download_track = timed_download_track
+
+    sys.argv = ['spotify_dl', *cli_args]
+    start = perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        spotify_dl.main()
+    elapsed = perf_counter() - start
+
+    return {
+        'elapsed': elapsed,
+        'track_latencies': track_latencies,
+        # Retries, link refreshes, track outcomes etc. as the downloader saw them
+        'counters': spotify_dl._run_metrics.summary()['counters'],
+        # Kilobytes on Linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def run_scenario(stand_in, scenario: str, cli_args: list) -> dict:
+    with tempfile.TemporaryDirectory(prefix=f"spotify_dl_bench_{scenario}_") as work_dir:
+        work_dir = Path(work_dir)
+        args = [*SCENARIOS[scenario](work_dir), *cli_args]
+
+        stand_in.reset_counts()
+        proc = subprocess.run(
+            [sys.executable, __file__, '--child', stand_in.api_url, '--', *args],
+            env={**os.environ, 'HOME': str(work_dir/"home")},
+            capture_output=True,
+            text=True
+        )
+        if proc.returncode:
+            raise RuntimeError(f"Scenario '{scenario}' failed:\n{proc.stderr}")
+
+        result = json.loads(proc.stdout.splitlines()[-1])
+        latencies = sorted(result.pop('track_latencies'))
+        tracks = len(latencies)
+
+        if tracks > 1:
+            cut_points = quantiles(latencies, n=100, method='inclusive')
+            p50, p99 = cut_points[49], cut_points[98]
+        else:
+            p50 = p99 = latencies[0] if latencies else 0.0
+
+        return {
+            'scenario': scenario,
+            'tracks': tracks,
+            'tracks_per_sec': tracks / result['elapsed'] if result['elapsed'] else 0.0,
+            'p50_ms': p50 * 1000,
+            'p99_ms': p99 * 1000,
+            'requests': dict(stand_in.reset_counts()),
+            **result
+        }
+
+
+def main():
+    if '--child' in sys.argv:
+        api_url, cli_args = sys.argv[2], sys.argv[4:]
+        print(json.dumps(run_child(api_url, cli_args)))
+        return
+
+    sys.path.insert(0, str(BENCH_DIR))
+    from stand_in_server import StandInServer
+
+    parser = ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added to every stand-in response.")
+    parser.add_argument('--bandwidth', type=float, help="Bytes/sec per CDN transfer.")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Chance an API request is throttled.")
+    parser.add_argument('--link-ttl', type=float, help="Seconds before a download link stops working.")
+    parser.add_argument('--slow-transfers', type=float, default=0.0, help="Chance a CDN transfer crawls at 32 KiB/s.")
+    parser.add_argument('--audio-size', type=int, default=256 * 1024)
+    parser.add_argument('--cli-args', default=DEFAULT_CLI_ARGS, help="Extra spotify_dl arguments for every scenario.")
+    parser.add_argument('--json', type=Path, help="Also write the results here, e.g. to diff against a baseline.")
+    args = parser.parse_args()
+
+    stand_in = StandInServer(
+        latency=args.latency,
+        audio_size=args.audio_size,
+        bandwidth=args.bandwidth,
+        rate_429=args.rate_429,
+        link_ttl=args.link_ttl,
+        slow_transfers=args.slow_transfers
+    )
+
+    results = []
+    with stand_in:
+        print(f"{'scenario':<10} {'tracks':>7} {'tracks/s':>9} {'p50':>9} {'p99':>9} {'peak RSS':>9}  requests")
+        for scenario in args.scenarios:
+            result = run_scenario(stand_in, scenario, shlex.split(args.cli_args))
+            results.append(result)
+
+            requests = ', '.join(f"{kind}={count}" for kind, count in sorted(result['requests'].items()))
+            print(
+                f"{scenario:<10} {result['tracks']:>7} {result['tracks_per_sec']:>9.1f} "
+                f"{result['p50_ms']:>7.0f}ms {result['p99_ms']:>7.0f}ms {result['peak_rss_mb']:>7.1f}MB  {requests}"
+            )
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
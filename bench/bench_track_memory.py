@@ -0,0 +1,130 @@
+"""Peak memory of resolving very large playlists into SpotifySongs.
+
+Each mode runs in a fresh process against the stand-in API and reports how far
+resolving the playlist pushed its peak RSS above where it was after warming up,
+scaled to 100k tracks:
+  legacy    the previous get_multi_track_data: every raw track list page kept,
+            then converted all at once into __dict__-backed SpotifySongs
+  fresh     get_multi_track_data, paging through the API (cold metadata cache)
+  cached    get_multi_track_data again, from the metadata cache
+  streamed  what a --stream run does: tracks handed over page by page
+
+Usage: python bench/bench_track_memory.py [--tracks 100000 250000] [--modes legacy fresh cached streamed]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from itertools import chain
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+SRC_DIR = BENCH_DIR.parent/"src"
+
+# In this order: 'cached' reads what 'fresh' left in the cache
+MODES = ['legacy', 'fresh', 'cached', 'streamed']
+
+
+@dataclass(frozen=True, eq=True)
+class LegacySpotifySong:
+    title: str
+    artist: str
+    album: str
+    id: str
+
+
+def legacy_multi_track_data(spotify_dl, entity_id: str, entity_type: str) -> dict:
+    with ThreadPoolExecutor(max_workers=1 + spotify_dl.TRACK_LIST_PREFETCH_PAGES) as executor:
+        metadata_resp = spotify_dl._get_entity_metadata(entity_id, entity_type)
+        track_list = list(chain.from_iterable(spotify_dl._iter_track_list_pages(entity_id, entity_type, executor)))
+
+    return {
+        **metadata_resp,
+        'trackList': [
+            LegacySpotifySong(title=track['title'], artist=track['artists'], album=track['album'], id=track['id'])
+            for track in track_list
+        ]
+    }
+
+
+def peak_rss_kb() -> int:
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_child(mode: str, api_url: str, num_tracks: int) -> dict:
+    # Runs in the benchmark subprocess; HOME already points at a scratch dir
+    sys.path.insert(0, str(SRC_DIR))
+    import spotify_dl
+
+    spotify_dl.DOWNLOADER_URL = api_url
+    spotify_dl.API_RATE_LIMIT = 1000.0
+
+    # Imports, connection pools, the cache's SQLite etc. aren't what's being measured
+    spotify_dl.get_multi_track_data("warmup100", "playlist")
+    baseline = peak_rss_kb()
+
+    entity_id = f"mem{num_tracks}"
+    if mode == 'legacy':
+        tracks = legacy_multi_track_data(spotify_dl, entity_id, "playlist")['trackList']
+        resolved = len(tracks)
+    elif mode in ('fresh', 'cached'):
+        tracks = spotify_dl.get_multi_track_data(entity_id, "playlist")['trackList']
+        resolved = len(tracks)
+    else:
+        resolved = sum(
+            1 for _ in spotify_dl.iter_input_url(
+                f"https://open.spotify.com/playlist/{entity_id}",
+                r"{title} - {artist}",
+                interactive=False,
+                stream=True,
+                quiet=True
+            )
+        )
+
+    return {'tracks': resolved, 'rss_growth_kb': peak_rss_kb() - baseline}
+
+
+def main():
+    if '--child' in sys.argv:
+        mode, api_url, num_tracks = sys.argv[2:5]
+        print(json.dumps(run_child(mode, api_url, int(num_tracks))))
+        return
+
+    sys.path.insert(0, str(BENCH_DIR))
+    from stand_in_server import StandInServer
+
+    parser = ArgumentParser()
+    parser.add_argument('--tracks', type=int, nargs='+', default=[100_000])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    args = parser.parse_args()
+
+    print(f"{'tracks':>8} {'mode':<9} {'peak RSS growth':>16} {'per 100k tracks':>16}")
+    with StandInServer() as stand_in:
+        for num_tracks in args.tracks:
+            with tempfile.TemporaryDirectory(prefix="spotify_dl_bench_memory_") as home_dir:
+                for mode in sorted(args.modes, key=MODES.index):
+                    proc = subprocess.run(
+                        [sys.executable, __file__, '--child', mode, stand_in.api_url, str(num_tracks)],
+                        env={**os.environ, 'HOME': home_dir},
+                        capture_output=True,
+                        text=True
+                    )
+                    if proc.returncode:
+                        raise RuntimeError(f"Mode '{mode}' failed:\n{proc.stderr}")
+
+                    result = json.loads(proc.stdout.splitlines()[-1])
+                    growth_mb = result['rss_growth_kb'] / 1024
+                    print(
+                        f"{result['tracks']:>8} {mode:<9} {growth_mb:>14.1f}MB "
+                        f"{growth_mb * 100_000 / max(1, result['tracks']):>14.1f}MB"
+                    )
+
+
+if __name__ == '__main__':
+    main()
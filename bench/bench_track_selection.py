@@ -0,0 +1,84 @@
+"""Micro-benchmark of applying '|1,4,15-'-style track selections to long playlists.
+
+Compares TrackSelection against the previous approach (eval'd slices, then
+sorted(key=list.index) and list.index per track), which is quadratic, so it's
+only run up to --legacy-max tracks.
+
+Usage: python bench/bench_track_selection.py [--tracks 1000 5000 50000]
+"""
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"src"))
+
+from spotify_dl import SpotifySong, TrackSelection
+
+SPECS = ['*', '1,4,15-', '-100,200-300,-100-']
+
+
+def legacy_select(spec: str, tracks: list) -> list:
+    indexes_or_slices = []
+
+    for item in spec.split(','):
+        if item.isnumeric():
+            indexes_or_slices.append(str(int(item) - 1))
+        elif item == '*':
+            indexes_or_slices.append(':')
+        elif item.startswith('-') and item.endswith('-'):
+            # Never supported; closest equivalent so the comparison stays fair
+            indexes_or_slices.append(f"{item[:-1]}:")
+        elif '-' in item:
+            start, end = item.split('-')
+            if not start:
+                indexes_or_slices.append(f":{end}")
+            elif not end:
+                indexes_or_slices.append(f"{int(start) - 1}:")
+            else:
+                indexes_or_slices.append(f"{int(start) - 1}:{end}")
+
+    selected = []
+    for index_or_slice in indexes_or_slices:
+        if index_or_slice.isnumeric():
+            selected.append(tracks[int(index_or_slice)])
+        else:
+            selected.extend(eval(f"tracks[{index_or_slice}]"))
+
+    return [(tracks.index(track) + 1, track) for track in sorted(selected, key=tracks.index)]
+
+
+def time_it(func, *args) -> tuple:
+    start = perf_counter()
+    result = func(*args)
+    return perf_counter() - start, result
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--tracks', type=int, nargs='+', default=[1_000, 5_000, 50_000])
+    parser.add_argument('--legacy-max', type=int, default=5_000)
+    args = parser.parse_args()
+
+    print(f"{'tracks':>8} {'spec':<22} {'selected':>9} {'legacy':>10} {'selection':>10}")
+    for num_tracks in args.tracks:
+        tracks = [
+            SpotifySong(title=f"Song {num}", artist="Artist", album="Album", id=f"id{num}")
+            for num in range(num_tracks)
+        ]
+
+        for spec in SPECS:
+            elapsed, selected = time_it(lambda: list(TrackSelection.parse(spec, len(tracks)).apply(tracks)))
+
+            if num_tracks <= args.legacy_max:
+                legacy_elapsed, legacy_selected = time_it(legacy_select, spec, tracks)
+                assert [track for _, track in legacy_selected] == [track for _, track in selected]
+                legacy = f"{legacy_elapsed * 1000:>8.1f}ms"
+            else:
+                legacy = f"{'skipped':>10}"
+
+            print(f"{num_tracks:>8} {spec:<22} {len(selected):>9} {legacy} {elapsed * 1000:>8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
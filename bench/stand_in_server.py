@@ -0,0 +1,292 @@
+"""Local stand-in for the spotifydown API and its CDN, for benchmarks.
+
+Serves on two host names so the downloader keeps API and CDN limits apart:
+  http://127.0.0.1:<port>   /download/{id}, /metadata/{type}/{id}, /trackList/{type}/{id}?offset=
+  http://localhost:<port>   /cdn/{id}.mp3, /cover/{album}.jpg
+
+Playlists/albums hold as many tracks as the trailing number of their id,
+e.g. 'pl10000' has 10,000 tracks.  Track ids starting with 'bad' are unknown.
+
+Optionally misbehaves like the real thing: `bandwidth` caps each CDN/cover
+transfer in bytes/sec, `rate_429` is the chance an API request gets a 429
+with a Retry-After, links handed out by /download stop working (403)
+`link_ttl` seconds later, and `slow_transfers` is the chance a CDN audio
+transfer crawls along at `slow_bandwidth` bytes/sec instead.  Without
+`range_requests`, the CDN ignores Range headers and always sends it all.
+
+Run standalone with `python bench/stand_in_server.py [port] [--latency ...]`.
+"""
+import json
+import random
+import re
+import threading
+from argparse import ArgumentParser
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep, time
+from urllib.parse import parse_qs, urlparse
+
+
+class StandInServer:
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        page_size: int = 100,
+        audio_size: int = 256 * 1024,
+        cover_size: int = 32 * 1024,
+        bandwidth: float = None,
+        rate_429: float = 0.0,
+        retry_after: float = 1.0,
+        link_ttl: float = None,
+        slow_transfers: float = 0.0,
+        slow_bandwidth: float = 32 * 1024,
+        range_requests: bool = True
+    ):
+        self.latency = latency
+        self.page_size = page_size
+        self.audio_size = audio_size
+        self.cover_size = cover_size
+        self.bandwidth = bandwidth
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.link_ttl = link_ttl
+        self.slow_transfers = slow_transfers
+        self.slow_bandwidth = slow_bandwidth
+        self.range_requests = range_requests
+
+        self.request_counts = Counter()
+        self._counts_lock = threading.Lock()
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def api_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def cdn_url(self) -> str:
+        return f"http://localhost:{self.port}"
+
+    def count(self, kind: str) -> None:
+        with self._counts_lock:
+            self.request_counts[kind] += 1
+
+    def reset_counts(self) -> Counter:
+        # Returns the counts so far and starts over, e.g. between benchmark scenarios
+        with self._counts_lock:
+            counts, self.request_counts = self.request_counts, Counter()
+        return counts
+
+    def throttled(self) -> bool:
+        return bool(self.rate_429) and random.random() < self.rate_429
+
+    def transfer_bandwidth(self) -> float:
+        if self.slow_transfers and random.random() < self.slow_transfers:
+            self.count('slow')
+            return self.slow_bandwidth
+
+        return self.bandwidth
+
+    def start(self) -> 'StandInServer':
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> 'StandInServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    # Responses
+
+    def track_metadata(self, track_id: str) -> dict:
+        return {
+            'id': track_id,
+            'title': f"Title {track_id}",
+            'artists': "Stand-in Artist",
+            'album': "Stand-in Album",
+            'cover': f"{self.cdn_url}/cover/stand-in-album.jpg",
+            'releaseDate': "2020-01-01"
+        }
+
+    def download(self, track_id: str) -> dict:
+        if track_id.startswith('bad'):
+            return {'success': False}
+
+        link = f"{self.cdn_url}/cdn/{track_id}.mp3"
+        if self.link_ttl is not None:
+            link += f"?expires={time() + self.link_ttl:.3f}"
+
+        return {
+            'success': True,
+            'metadata': self.track_metadata(track_id),
+            'link': link
+        }
+
+    def link_expired(self, query: str) -> bool:
+        expires = parse_qs(query).get('expires')
+        return bool(expires) and float(expires[0]) < time()
+
+    def metadata(self, entity_type: str, entity_id: str) -> dict:
+        return {
+            'success': True,
+            'title': f"Stand-in {entity_type} {entity_id}",
+            'artists': "Stand-in Owner",
+            'cover': f"{self.cdn_url}/cover/stand-in-album.jpg",
+            'releaseDate': "2020-01-01"
+        }
+
+    def track_list(self, entity_type: str, entity_id: str, offset: int) -> dict:
+        num_tracks = int(match.group(1)) if (match := re.search(r'(\d+)$', entity_id)) else 10
+        end = min(num_tracks, offset + self.page_size)
+
+        return {
+            'trackList': [
+                {
+                    'id': f"{entity_id}t{num}",
+                    'title': f"Song {num}",
+                    'artists': "Stand-in Artist",
+                    'album': "Stand-in Album",
+                    'cover': f"{self.cdn_url}/cover/stand-in-album.jpg",
+                    'releaseDate': "2020-01-01"
+                }
+                for num in range(offset, end)
+            ],
+            'nextOffset': end if end < num_tracks else None
+        }
+
+    def audio(self, track_id: str) -> bytes:
+        # MPEG frame sync followed by filler unique to the track
+        frame = b'\xff\xfb\x90\x00' + track_id.encode() * 8
+        return (frame * (self.audio_size // len(frame) + 1))[:self.audio_size]
+
+    def cover(self) -> bytes:
+        return b'\xff\xd8\xff\xe0' + b'\x00' * (self.cover_size - 4)
+
+
+def _make_handler(server: StandInServer):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def send_body(
+            self,
+            body: bytes,
+            status: int = 200,
+            content_type: str = 'application/json',
+            headers: dict = None,
+            bandwidth: float = None
+        ):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            bandwidth = bandwidth or server.bandwidth
+            if not bandwidth or content_type == 'application/json':
+                self.wfile.write(body)
+                return
+
+            # Trickle it out at the configured rate
+            chunk_size = 16 * 1024
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start + chunk_size]
+                self.wfile.write(chunk)
+                sleep(len(chunk) / bandwidth)
+
+        def send_json(self, obj: dict, status: int = 200) -> None:
+            self.send_body(json.dumps(obj).encode(), status)
+
+        def send_audio(self, track_id: str) -> None:
+            body = server.audio(track_id)
+            bandwidth = server.transfer_bandwidth()
+
+            range_hdr = server.range_requests and self.headers.get('Range')
+            if range_hdr and (match := re.match(r'bytes=(\d+)-', range_hdr)):
+                start = int(match.group(1))
+                if start >= len(body):
+                    return self.send_body(b'', 416, 'audio/mpeg', {'Content-Range': f"bytes */{len(body)}"})
+
+                return self.send_body(
+                    body[start:],
+                    206,
+                    'audio/mpeg',
+                    {'Accept-Ranges': 'bytes', 'Content-Range': f"bytes {start}-{len(body) - 1}/{len(body)}"},
+                    bandwidth
+                )
+
+            self.send_body(body, 200, 'audio/mpeg', {'Accept-Ranges': 'bytes'}, bandwidth)
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+            kind = parts[0]
+
+            server.count(kind)
+            if server.latency:
+                sleep(server.latency)
+
+            if kind in ('download', 'metadata', 'trackList') and server.throttled():
+                server.count('429')
+                self.send_body(b'', 429, headers={'Retry-After': f"{server.retry_after:g}"})
+            elif kind == 'download' and len(parts) == 2:
+                self.send_json(server.download(parts[1]))
+            elif kind == 'metadata' and len(parts) == 3:
+                self.send_json(server.metadata(parts[1], parts[2]))
+            elif kind == 'trackList' and len(parts) == 3:
+                offset = int(parse_qs(url.query).get('offset', ['0'])[0])
+                self.send_json(server.track_list(parts[1], parts[2], offset))
+            elif kind == 'cdn' and len(parts) == 2 and server.link_expired(url.query):
+                server.count('expired')
+                self.send_body(b'', 403, 'text/plain')
+            elif kind == 'cdn' and len(parts) == 2:
+                self.send_audio(parts[1].removesuffix('.mp3'))
+            elif kind == 'cover':
+                self.send_body(server.cover(), content_type='image/jpeg')
+            else:
+                self.send_json({'success': False}, 404)
+
+    return Handler
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('port', type=int, nargs='?', default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--bandwidth', type=float, help="Bytes/sec per CDN transfer.")
+    parser.add_argument('--rate-429', type=float, default=0.0)
+    parser.add_argument('--link-ttl', type=float)
+    parser.add_argument('--slow-transfers', type=float, default=0.0)
+    args = parser.parse_args()
+
+    with StandInServer(
+        port=args.port,
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        rate_429=args.rate_429,
+        link_ttl=args.link_ttl,
+        slow_transfers=args.slow_transfers
+    ) as stand_in:
+        print(f"API at {stand_in.api_url}, CDN at {stand_in.cdn_url}.  Ctrl+C to stop.")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
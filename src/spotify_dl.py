@@ -1,113 +1,2102 @@
+import hashlib
+import heapq
 import json
+import os
+import random
 import re
-import requests
+import shutil
 import signal
+import sqlite3
 import sys
+import threading
 import traceback
 from argparse import ArgumentParser
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from configparser import ConfigParser
-from dataclasses import dataclass
-from datetime import datetime
+from contextlib import contextmanager, nullcontext
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+from io import BytesIO
+from itertools import chain, count
 from pathlib import Path
-from time import sleep
+from time import monotonic, perf_counter, sleep, time
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Iterable, Iterator, Sequence
 
-# Want to figure out how to do this without a third party module
-import eyed3
-from eyed3.id3 import ID3_V2_3
-from eyed3.id3.frames import ImageFrame
+# requests, mutagen, asyncio (and the like) are imported where they're used:
+# they take longer to load than everything else put together, and runs where
+# every track is already downloaded (or just --help) never need them
+if TYPE_CHECKING:
+    import asyncio
+    import requests
 
-# Suppress warnings about CRC fail for cover art
-import logging
-logging.getLogger('eyed3.mp3.headers').warning = logging.debug
 
+DOWNLOADER_URL = "https://api.spotifydown.com"
+# Clean browser heads for API
+DOWNLOADER_HEADERS = {
+    'Host': 'api.spotifydown.com',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip',
+    'Referer': 'https://spotifydown.com/',
+    'Origin': 'https://spotifydown.com',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'same-site',
+    'Sec-GPC': '1',
+    'TE': 'trailers'
+}
+
+# Clean browser heads for CDN (audio and cover art).  Host is filled in per host
+CDN_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Accept': '*/*',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip',
+    'Referer': 'https://spotifydown.com/',
+    'Origin': 'https://spotifydown.com',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Sec-Fetch-Dest': 'empty',
+    'Sec-Fetch-Mode': 'cors',
+    'Sec-Fetch-Site': 'cross-site',
+    'Sec-GPC': '1'
+}
+
+# Headers each pooled session starts with, by kind of host it talks to
+HEADER_PROFILES = {
+    'api': DOWNLOADER_HEADERS,
+    'cdn': CDN_HEADERS,
+    'plain': {}
+}
+
+MULTI_TRACK_INPUT_URL_TRACK_NUMS_RE = re.compile(r'^https?:\/\/open\.spotify\.com\/(album|playlist)\/[\w]+(?:\?[\w=%-]*|)\|(?P<track_nums>.*)$')
+# '4-9', '15-', '-3' (first three), '-3-' (last three), '-5--2' (fifth to second from last)
+TRACK_NUMS_RANGE_RE = re.compile(r'^(?P<start>-?\d*)-(?P<end>-?\d*)$')
+
+# In interactive mode, user is prompted upon first duplicate encountered
+# Otherwise, set via CLI arg
+skip_duplicate_downloads = True
+skip_duplicate_downloads_prompted = True
+# Guards the two above so only one download worker prompts/updates them at a time
+skip_duplicate_downloads_lock = threading.RLock()
+
+# Track file path -> [lock, holders] (see _track_path_lock)
+_track_path_locks = {}
+_track_path_locks_lock = threading.Lock()
+
+# Upper bound on simultaneous connections per host.  Set via CLI args
+MAX_API_CONNECTIONS = 2
+MAX_CDN_CONNECTIONS_PER_HOST = 4
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# Starting requests/sec allowed per host.  Adapted at runtime to how the host responds
+API_RATE_LIMIT = 10.0
+CDN_RATE_LIMIT = 20.0
+# Times a request answered with 429/503 is retried after backing off
+MAX_THROTTLED_RETRIES = 5
+# Exponential backoff bounds in seconds for throttled requests without Retry-After
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+# (connect, read) timeouts in seconds applied to every request.  Set via CLI args
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+
+# Audio is streamed to disk in chunks of this many bytes
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Times an interrupted audio transfer is resumed before the track is failed
+MAX_RESUME_ATTEMPTS = 3
+
+# A transfer averaging under this many bytes/sec over STALL_WINDOW seconds is
+# dropped and resumed (connections that send nothing at all hit READ_TIMEOUT)
+STALL_MIN_BYTES_PER_SEC = 16 * 1024
+STALL_WINDOW = 15.0
+# A transfer this many times slower than the median of recent ones, once it's
+# been going HEDGE_AFTER seconds, is raced by a second request with a fresh
+# link (which may well be on another CDN host); 0 turns hedging off
+HEDGE_SLOWDOWN = 4.0
+HEDGE_AFTER = 5.0
+# Cap in bytes/sec on all audio transfers together; set via --max-bandwidth
+MAX_BANDWIDTH = None
+
+_transfer_supervisor = None
+_bandwidth_limiter = None
+_transfer_lock = threading.Lock()
+
+# Persistent cache of API responses.  Disabled with --no-cache, bypassed for reads with --refresh
+CACHE_ENABLED = True
+CACHE_REFRESH = False
+CACHE_PATH = Path.home()/".cache"/"spotify_dl"/"cache.sqlite3"
+# Seconds entries stay fresh, by kind of data
+CACHE_METADATA_TTL = 30 * 24 * 60 * 60  # title, artists, album, cover, releaseDate
+CACHE_TRACK_LIST_TTL = 60 * 60  # playlists change, albums practically never do
+CACHE_LINK_TTL = 10 * 60  # download links expire on the CDN
+# Least recently used entries beyond this are evicted
+CACHE_MAX_ENTRIES = 250_000
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+# Why the persistent cache couldn't be opened, if it couldn't; the CLI reports it
+metadata_cache_error = None
+
+# Playlist/album track list pages requested ahead of the one being read
+TRACK_LIST_PREFETCH_PAGES = 4
+
+# Tracks ahead of the download workers whose download links are already being fetched
+LINK_PREFETCH_AHEAD = 8
+
+# track id -> Future of (/download response, when its link was issued)
+_link_prefetches = {}
+_link_prefetches_lock = threading.Lock()
+_link_prefetch_executor = None
+
+# Bytes of cover art kept in memory, least recently used evicted first
+COVER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Cover art is also kept here across runs if set.  Set via CLI args
+COVER_CACHE_DIR = None
+# Bytes of cover art kept in COVER_CACHE_DIR; least recently used removed first
+COVER_CACHE_DISK_MAX_BYTES = 512 * 1024 * 1024
+
+_cover_art_cache = None
+_cover_art_cache_lock = threading.Lock()
+
+# Per output directory record of which Spotify track ids were downloaded to which file
+MANIFEST_FILENAME = ".spotify_dl_manifest.jsonl"
+# ID3 TXXX description the Spotify track id is stored under
+TRACK_ID_TAG_DESC = "SPOTIFY_TRACK_ID"
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+# Per output directory record of the tracks each --sync'ed album/playlist had when last synced
+SYNC_STATE_FILENAME = ".spotify_dl_sync.json"
+
+_sync_states = {}
+_sync_states_lock = threading.Lock()
+
+# Content-addressed store every downloaded track is also kept in, and
+# hardlinked from into output directories (see TrackStore).  Off unless set
+# via --store; best on the same filesystem as the output directories
+STORE_DIR = None
+
+_track_store = None
+_track_store_lock = threading.Lock()
+# How old a store's leftover .tmp file has to be before gc removes it, in
+# seconds; younger ones may be adds still being written by another host
+STORE_TMP_GRACE = 24 * 3600
+
+# Per-track retry backoff bounds in seconds; doubled each attempt, with jitter
+RETRY_BACKOFF_BASE = 2.0
+RETRY_BACKOFF_MAX = 60.0
+# Retries per track in interactive mode; set via --retry-failed-downloads otherwise
+INTERACTIVE_RETRIES = 5
+
+# Where config file runs journal their progress, to be picked up by --resume
+JOURNAL_DIR = CACHE_PATH.parent/"journals"
+# Journal records are written and fsynced in batches of this many, or when this many seconds have passed
+JOURNAL_BATCH_SIZE = 64
+JOURNAL_FLUSH_INTERVAL = 1.0
+
+# Given as the first argument: spotify_dl enqueue/worker/gc ...
+COMMANDS = ('enqueue', 'worker', 'gc')
+
+# Shared job queue of the 'enqueue' and 'worker' commands; put it on storage
+# every worker host can reach (--queue).  A claimed job is leased to its worker,
+# which renews the lease every QUEUE_HEARTBEAT seconds while it's alive;
+# jobs whose lease runs out go back in the queue
+JOB_QUEUE_PATH = CACHE_PATH.parent/"queue.sqlite3"
+QUEUE_LEASE = 120.0
+QUEUE_HEARTBEAT = 30.0
+# How often an idle worker checks for new (or re-queued) jobs
+QUEUE_POLL_INTERVAL = 5.0
+# Leases a job may lose (its worker died or hung) before it's marked failed
+QUEUE_MAX_LEASES = 3
+
+# --serve: where the daemon's job API listens unless told otherwise (only
+# locally), how many finished jobs it remembers for status queries, and how
+# often a download's progress is recorded while it's running
+SERVE_ADDRESS = "127.0.0.1:8731"
+SERVE_FINISHED_JOBS = 200
+SERVE_PROGRESS_INTERVAL = 0.5
+# Per-track metrics the daemon keeps, most recent first; the totals cover every job
+SERVE_METRICS_TRACKS = 1000
+
+# Where each run writes its per-phase timings (JSON), and optionally a
+# node_exporter textfile collector file; set via --metrics-json/--metrics-prometheus
+METRICS_PATH = CACHE_PATH.parent/"last_run.json"
+METRICS_PROMETHEUS_PATH = None
+
+# One pooled session per (header profile, host), created on first use
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Keeps lines from concurrent download workers from interleaving
+_print_lock = threading.Lock()
+
+
+@dataclass(frozen=True, eq=True)
+class SpotifySong:
+    # Libraries run to 100k+ of these, so no per-instance __dict__, and the
+    # artist/album strings that every track of an album repeats are shared
+    __slots__ = ('title', 'artist', 'album', 'id')
+
+    title: str
+    artist: str
+    album: str
+    id: str
+
+    def __post_init__(self):
+        object.__setattr__(self, 'artist', sys.intern(self.artist))
+        object.__setattr__(self, 'album', sys.intern(self.album))
+
+    @property
+    def url(self) -> str:
+        return f"https://open.spotify.com/track/{self.id}"
+
+
+class TransientDownloadError(RuntimeError):
+    # Worth another go later: timeouts, 5xx, expired download links
+    pass
+
+
+class PermanentDownloadError(RuntimeError):
+    # Retrying won't help, e.g. the API answered 'success: false', a 404, or
+    # the disk is full
+    pass
+
+
+class LinkExpiredError(TransientDownloadError):
+    # The CDN turned the download link down (403/410); a fresh one will do
+    pass
+
+
+class TransferStalledError(TransientDownloadError):
+    # Still connected, but hardly anything is coming through
+    pass
+
+
+class TransferCancelledError(Exception):
+    # A hedged request for the same track got there first
+    pass
+
+
+class DelayQueue:
+    # Runs callbacks once their delay is up, on one background thread
+
+    def __init__(self):
+        self._heap = []
+        self._order = count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="spotify_dl-delay-queue", daemon=True)
+        self._thread.start()
+
+    def put(self, delay: float, callback) -> None:
+        with self._cond:
+            heapq.heappush(self._heap, (monotonic() + delay, next(self._order), callback))
+            self._cond.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and (not self._heap or self._heap[0][0] > monotonic()):
+                    self._cond.wait(timeout=self._heap[0][0] - monotonic() if self._heap else None)
+
+                if self._closed:
+                    return
+
+                _, _, callback = heapq.heappop(self._heap)
+
+            callback()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+
+class MetadataCache:
+    # Entries are JSON blobs keyed by (kind, key), e.g. ('track', '<track id>')
+
+    # Puts between LRU eviction passes
+    _EVICT_EVERY = 1000
+
+    def __init__(self, path: Path = None, max_entries: int = CACHE_MAX_ENTRIES, refresh: bool = False):
+        # No path keeps the cache in memory, for this run only
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.max_entries = max_entries
+        # Entries stored before this are ignored with refresh
+        self.fresh_after = time() if refresh else 0.0
+
+        self._lock = threading.Lock()
+        self._puts = 0
+        self._conn = sqlite3.connect(path or ':memory:', check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "kind TEXT, key TEXT, value TEXT, stored_at REAL, accessed_at REAL, "
+            "PRIMARY KEY (kind, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    def get(self, kind: str, key: str, ttl: float):
+        if stored := self.get_stored(kind, key, ttl):
+            return stored[0]
+
+        return None
+
+    def get_stored(self, kind: str, key: str, ttl: float):
+        # (value, when it was stored), or None
+        now = time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM entries WHERE kind = ? AND key = ? AND stored_at > ?",
+                (kind, key, max(now - ttl, self.fresh_after))
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE kind = ? AND key = ?",
+                (now, kind, key)
+            )
+
+        return json.loads(row[0]), row[1]
+
+    def put(self, kind: str, key: str, value) -> None:
+        now = time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (kind, key, json.dumps(value), now, now)
+            )
+
+            self._puts += 1
+            if self._puts % self._EVICT_EVERY == 0:
+                self._evict()
+
+    def delete(self, kind: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE kind = ? AND key = ?", (kind, key))
+
+    def _evict(self) -> None:
+        self._conn.execute(
+            "DELETE FROM entries WHERE rowid IN "
+            "(SELECT rowid FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._evict()
+            self._conn.close()
+
+
+class RateLimiter:
+    # Token bucket whose rate backs off multiplicatively on throttling/server
+    # errors and creeps back up additively while requests succeed
+
+    def __init__(self, rate: float, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+
+        self._lock = threading.Lock()
+        self._tokens = max(1.0, rate)
+        self._updated = monotonic()
+        # Nothing goes out before this (set by Retry-After/backoff)
+        self._blocked_until = 0.0
+
+        self.requests = 0
+        self.throttled = 0
+        self.wait_time = 0.0
+
+    def acquire(self, tokens: float = 1) -> float:
+        # Returns how long it had to wait
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(max(1.0, self.rate), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # Reserve the tokens even if they aren't there yet; the debt is the wait
+            self._tokens -= tokens
+            wait = max(-self._tokens / self.rate, self._blocked_until - now, 0.0)
+
+            self.requests += 1
+            self.wait_time += wait
+
+        if wait:
+            sleep(wait)
+
+        return wait
+
+    def record_response(self, status_code: int, retry_after: float = None) -> None:
+        with self._lock:
+            if status_code == 429 or status_code >= 500:
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                self._tokens = min(self._tokens, 0.0)
+
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, monotonic() + retry_after)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class TransferSupervisor:
+    # Throughput of recently finished audio transfers, to tell how slow is
+    # too slow for the one at hand
+
+    def __init__(self, history: int = 50, min_samples: int = 5):
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._rates = deque(maxlen=history)
+
+    def record(self, bytes_per_sec: float) -> None:
+        with self._lock:
+            self._rates.append(bytes_per_sec)
+
+    def median(self):
+        with self._lock:
+            if len(self._rates) < self.min_samples:
+                return None
+
+            return sorted(self._rates)[len(self._rates) // 2]
+
+
+class TransferWatch:
+    # One audio transfer, checked as each chunk comes in: stalls raise
+    # TransferStalledError, a set cancelled Event raises TransferCancelledError,
+    # and on_slow is called (once) if it's far behind the others
+
+    def __init__(self, cancelled: threading.Event = None, on_slow: Callable = None):
+        self.cancelled = cancelled
+        self.on_slow = on_slow
+
+        self.started = monotonic()
+        self.received = 0
+        self.connected()
+
+    def connected(self) -> None:
+        # New connection (first or resumed), new stall window
+        self._window_start = monotonic()
+        self._window_bytes = 0
+
+    def chunk(self, size: int) -> None:
+        if self.cancelled and self.cancelled.is_set():
+            raise TransferCancelledError("Another request for this track finished first")
+
+        if limiter := _get_bandwidth_limiter():
+            if wait := limiter.acquire(size):
+                _run_metrics.add_time('bandwidth_cap', wait)
+                # Held back by --max-bandwidth, not by the network: that time
+                # counts neither towards a stall nor towards being slow
+                self._window_start += wait
+                self.started += wait
+
+        now = monotonic()
+        self.received += size
+        self._window_bytes += size
+
+        if (window := now - self._window_start) >= STALL_WINDOW:
+            if self._window_bytes / window < STALL_MIN_BYTES_PER_SEC:
+                _run_metrics.add('stalled_transfers')
+                raise TransferStalledError(f"Transfer stalled at {self._window_bytes / window / 1024:.1f} KiB/s")
+
+            self._window_start, self._window_bytes = now, 0
+
+        if self.on_slow and HEDGE_SLOWDOWN and (elapsed := now - self.started) >= HEDGE_AFTER:
+            if (median := _get_transfer_supervisor().median()) and self.received / elapsed * HEDGE_SLOWDOWN < median:
+                on_slow, self.on_slow = self.on_slow, None
+                on_slow()
+
+    def finished(self) -> None:
+        if (elapsed := monotonic() - self.started) > 0 and self.received:
+            _get_transfer_supervisor().record(self.received / elapsed)
+
+
+class CoverArtCache:
+    # Cover art by URL.  Tracks of the same album share one fetch, even when
+    # they ask for it at the same time
+
+    def __init__(
+        self,
+        max_bytes: int = COVER_CACHE_MAX_BYTES,
+        cache_dir: Path = None,
+        max_disk_bytes: int = COVER_CACHE_DISK_MAX_BYTES
+    ):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        if cache_dir:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._in_flight = {}
+        # Bytes in cache_dir, counted on the first write rather than at startup
+        self._disk_size = None
+
+    def get(self, url: str, fetch) -> bytes:
+        with self._lock:
+            if url in self._entries:
+                self._entries.move_to_end(url)
+                return self._entries[url]
+
+            if fetching := self._in_flight.get(url):
+                is_fetcher = False
+            else:
+                fetching = self._in_flight[url] = Future()
+                is_fetcher = True
+
+        if not is_fetcher:
+            return fetching.result()
+
+        try:
+            if (cover_art := self._read_disk(url)) is None:
+                cover_art = fetch(url)
+                self._write_disk(url, cover_art)
+        except BaseException as exc:
+            fetching.set_exception(exc)
+            raise
+        else:
+            fetching.set_result(cover_art)
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+
+                if fetching.exception() is None:
+                    self._store(url, cover_art)
+
+        return cover_art
+
+    def _store(self, url: str, cover_art: bytes) -> None:
+        if len(cover_art) > self.max_bytes:
+            return
+
+        self._entries[url] = cover_art
+        self._size += len(cover_art)
+
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+
+    def _disk_path(self, url: str) -> Path:
+        return self.cache_dir/f"{hashlib.sha1(url.encode()).hexdigest()}.jpg"
+
+    def _read_disk(self, url: str):
+        if not self.cache_dir:
+            return None
+
+        try:
+            cover_art = self._disk_path(url).read_bytes()
+            # Its mtime is when it was last used, which is what eviction goes by
+            os.utime(self._disk_path(url))
+        except OSError:
+            return None
+
+        return cover_art
+
+    def _write_disk(self, url: str, cover_art: bytes) -> None:
+        if not self.cache_dir:
+            return
+
+        # Written aside then renamed so a concurrent reader never sees half a file
+        tmp_path = self._disk_path(url).with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_bytes(cover_art)
+            os.replace(tmp_path, self._disk_path(url))
+        except OSError:
+            tmp_path.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_size += len(cover_art)
+
+            if self._disk_size > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self) -> list:
+        # (mtime, size, path) of each cached cover
+        entries = []
+        for disk_path in self.cache_dir.glob('*.jpg'):
+            try:
+                disk_stat = disk_path.stat()
+            except FileNotFoundError:
+                continue
+
+            entries.append((disk_stat.st_mtime, disk_stat.st_size, disk_path))
+
+        return entries
+
+    def _evict_disk(self) -> None:
+        # Recounted rather than trusted, as other runs may share the directory.
+        # Down to 3/4 of the budget, so it isn't rescanned on every write after
+        entries = sorted(self._disk_entries())
+        self._disk_size = sum(size for _, size, _ in entries)
+
+        for _, size, disk_path in entries:
+            if self._disk_size <= self.max_disk_bytes * 3 // 4:
+                break
+
+            disk_path.unlink(missing_ok=True)
+            self._disk_size -= size
+
+
+class TrackManifest:
+    # Append-only JSONL of {"id", "path", "size", "sha256"} records, newest
+    # record per track id wins ({"id", "path": null} once it's been removed).
+    # Loaded once, then looked up in memory
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.path = output_dir/MANIFEST_FILENAME
+
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        if self.path.is_file():
+            with open(self.path, encoding='utf-8') as manifest_fp:
+                for line in manifest_fp:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn final line from a crash mid-append
+                        continue
+
+                    if entry['path'] is None:
+                        self._entries.pop(entry['id'], None)
+                    else:
+                        self._entries[entry['id']] = entry
+
+    def get(self, track_id: str):
+        return self._entries.get(track_id)
+
+    def record(self, track_id: str, track_path: Path, sha256: str) -> None:
+        self._append({
+            'id': track_id,
+            'path': track_path.name,
+            'size': track_path.stat().st_size,
+            'sha256': sha256
+        })
+
+    def forget(self, track_id: str) -> None:
+        # The track's file was deleted or moved elsewhere
+        self._append({'id': track_id, 'path': None})
+
+    def _append(self, entry: dict) -> None:
+        with self._lock:
+            # One write of one line to an O_APPEND file, so a crash can at worst
+            # leave a torn last line, which loading skips
+            with open(self.path, 'a', encoding='utf-8') as manifest_fp:
+                manifest_fp.write(json.dumps(entry) + '\n')
+                manifest_fp.flush()
+                os.fsync(manifest_fp.fileno())
+
+            if entry['path'] is None:
+                self._entries.pop(entry['id'], None)
+            else:
+                self._entries[entry['id']] = entry
+
+    def replace_all(self, entries: Iterable) -> None:
+        entries = {entry['id']: entry for entry in entries}
+
+        with self._lock:
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as manifest_fp:
+                manifest_fp.writelines(json.dumps(entry) + '\n' for entry in entries.values())
+                manifest_fp.flush()
+                os.fsync(manifest_fp.fileno())
+
+            os.replace(tmp_path, self.path)
+            self._entries = entries
+
+
+class TrackStore:
+    # Finished (tagged) tracks kept once each, as objects/<ab>/<sha256>.mp3
+    # blobs, with an index of track id -> sha256.  Output directories get
+    # hardlinks to the blobs (copies across filesystems), so a track that's
+    # in the store is never fetched again.  A blob is referenced for as long
+    # as a file somewhere still links to it, or a copy the index recorded is
+    # still there; gc() removes the rest
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.objects_dir = root/"objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Rollback journal, like the job queue, so the store can be shared by workers on several hosts
+        self._conn = sqlite3.connect(root/"index.sqlite3", timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tracks (track_id TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, stored_at REAL)")
+        # Copies don't show up in a blob's link count, so they're references gc() has to be told about
+        self._conn.execute("CREATE TABLE IF NOT EXISTS copies (sha256 TEXT, path TEXT, PRIMARY KEY (sha256, path))")
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.objects_dir/sha256[:2]/f"{sha256}.mp3"
+
+    def _sha256(self, track_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT sha256 FROM tracks WHERE track_id = ?", (track_id,)).fetchone()
+
+        return row and row[0]
+
+    def has(self, track_id: str) -> bool:
+        # Going by the database alone; get() checks the blob is still there
+        return bool(self._sha256(track_id))
+
+    def get(self, track_id: str):
+        # (sha256, blob path) of the stored track, or None
+        sha256 = self._sha256(track_id)
+
+        if sha256 and (blob_path := self.blob_path(sha256)).is_file():
+            return sha256, blob_path
+
+        return None
+
+    def _record_copy(self, sha256: str, track_path: Path) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO copies VALUES (?, ?)", (sha256, str(track_path.resolve())))
+
+    def add(self, track_id: str, track_path: Path, sha256: str) -> None:
+        if not (blob_path := self.blob_path(sha256)).is_file():
+            blob_path.parent.mkdir(exist_ok=True)
+            tmp_path = blob_path.with_name(f"{blob_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+
+            linked = _link_or_copy(track_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+            if not linked:
+                self._record_copy(sha256, track_path)
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?)",
+                (track_id, sha256, blob_path.stat().st_size, time())
+            )
+
+    def place(self, track_id: str, track_path: Path):
+        # Puts the stored track at track_path and returns its sha256, or None if it isn't stored
+        if not (stored := self.get(track_id)):
+            return None
+
+        sha256, blob_path = stored
+        part_path = track_path.with_name(track_path.name + '.part')
+        part_path.unlink(missing_ok=True)
+
+        try:
+            linked = _link_or_copy(blob_path, part_path)
+        except FileNotFoundError:
+            # Collected by a gc() in the meantime
+            return None
+
+        os.replace(part_path, track_path)
+        if not linked:
+            self._record_copy(sha256, track_path)
+
+        return sha256
+
+    def _has_copies(self, blob_path: Path, blob_size: int) -> bool:
+        # Whether a recorded copy of the blob is still there (forgetting the ones that aren't)
+        sha256 = blob_path.stem
+        with self._lock:
+            copy_paths = [Path(row[0]) for row in self._conn.execute("SELECT path FROM copies WHERE sha256 = ?", (sha256,))]
+
+        gone = []
+        for copy_path in copy_paths:
+            try:
+                # Overwritten by something else if the size changed
+                if copy_path.stat().st_size == blob_size:
+                    continue
+            except FileNotFoundError:
+                pass
+
+            gone.append((sha256, str(copy_path)))
+
+        with self._lock:
+            self._conn.executemany("DELETE FROM copies WHERE sha256 = ? AND path = ?", gone)
+
+        return len(gone) < len(copy_paths)
+
+    def gc(self) -> tuple:
+        # Removes blobs no file links to or is a copy of any more (and
+        # leftovers of interrupted adds).  Returns how many were removed and
+        # how many bytes that freed
+        removed = freed = 0
+
+        for blob_path in self.objects_dir.glob('*/*'):
+            try:
+                blob_stat = blob_path.stat()
+                if blob_path.suffix == '.tmp':
+                    unreferenced = time() - blob_stat.st_mtime > STORE_TMP_GRACE
+                else:
+                    unreferenced = blob_stat.st_nlink <= 1 and not self._has_copies(blob_path, blob_stat.st_size)
+
+                if unreferenced:
+                    blob_path.unlink()
+                    removed += 1
+                    freed += blob_stat.st_size
+            except FileNotFoundError:
+                continue
+
+        with self._lock:
+            stored = self._conn.execute("SELECT track_id, sha256 FROM tracks").fetchall()
+            self._conn.executemany(
+                "DELETE FROM tracks WHERE track_id = ?",
+                [(track_id,) for track_id, sha256 in stored if not self.blob_path(sha256).is_file()]
+            )
+
+        return removed, freed
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SyncState:
+    # The ordered track ids each --sync'ed album/playlist had when it was last
+    # synced to an output directory, and which of them are still to be
+    # downloaded (failed last time), keyed by '{type}/{id}'
+
+    def __init__(self, output_dir: Path):
+        self.path = output_dir/SYNC_STATE_FILENAME
+
+        self._lock = threading.Lock()
+        self._entities = {}
+
+        if self.path.is_file():
+            with open(self.path, encoding='utf-8') as state_fp:
+                self._entities = json.load(state_fp)
+
+    def get(self, key: str):
+        return self._entities.get(key)
+
+    def set(self, key: str, track_ids: list, pending: list) -> None:
+        with self._lock:
+            self._entities[key] = {'tracks': track_ids, 'pending': pending, 'synced_at': time()}
+
+    def all_track_ids(self) -> set:
+        # Tracks some synced album/playlist still has in this directory
+        with self._lock:
+            return {track_id for entity in self._entities.values() for track_id in entity['tracks']}
+
+    def save(self) -> None:
+        with self._lock:
+            _write_atomic(self.path, json.dumps(self._entities))
+
+
+class JobJournal:
+    # Write-ahead log of a config file run.  Each line is a state change of a
+    # track in an output directory (resolved, downloading, skipped, tagged,
+    # failed) or of a config entry (done, failed)
+
+    # Track states that count as finished on resume.  'skipped' is a track
+    # that was already on disk, 'tagged' one this run wrote out in full
+    # ('downloaded' is what older journals called 'skipped')
+    COMPLETE_STATES = ('skipped', 'tagged', 'downloaded')
+
+    def __init__(self, path: Path, resume: bool = False):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._track_states = {}
+        self._entry_states = {}
+        self._pending = []
+        self._last_flush = monotonic()
+
+        if resume and path.is_file():
+            with open(path, encoding='utf-8') as journal_fp:
+                for line in journal_fp:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn final line from a crash mid-write
+                        continue
+
+                    self._apply(record)
+
+        self._journal_fp = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    @classmethod
+    def for_config_file(cls, config_file: Path, resume: bool = False) -> 'JobJournal':
+        config_hash = hashlib.sha1(str(config_file.resolve()).encode()).hexdigest()[:16]
+        return cls(JOURNAL_DIR/f"{config_file.stem}-{config_hash}.jsonl", resume)
+
+    def _apply(self, record: dict) -> None:
+        if 'track' in record:
+            self._track_states[(record['track'], record['output_dir'])] = record['state']
+        elif isinstance(record['entry'], list):
+            self._entry_states[tuple(record['entry'])] = record['state']
+
+    def _append(self, record: dict) -> None:
+        with self._lock:
+            self._apply(record)
+            self._pending.append(json.dumps(record) + '\n')
+
+            if len(self._pending) >= JOURNAL_BATCH_SIZE or monotonic() - self._last_flush >= JOURNAL_FLUSH_INTERVAL:
+                self._flush()
+
+    def record_track(self, track_id: str, output_dir: Path, state: str, title: str = None) -> None:
+        record = {'track': track_id, 'output_dir': str(output_dir.resolve()), 'state': state}
+        if title:
+            record['title'] = title
+
+        self._append(record)
+
+    @staticmethod
+    def _entry_key(entry: dict) -> tuple:
+        # What an entry downloads, rather than where it is in the config file,
+        # which changes as soon as an entry is added or removed before it.
+        # Older journals' entry numbers are ignored, so those entries run again
+        output_dir = Path(entry['output_dir']) if 'output_dir' in entry else Path.home()/"Downloads"
+        return entry['url'], str(output_dir.resolve()), entry.get('filename_template')
+
+    def record_entry(self, entry: dict, state: str) -> None:
+        self._append({'entry': list(self._entry_key(entry)), 'state': state})
+
+    def track_complete(self, track_id: str, output_dir: Path) -> bool:
+        return self._track_states.get((track_id, str(output_dir.resolve()))) in self.COMPLETE_STATES
+
+    def entry_complete(self, entry: dict) -> bool:
+        return self._entry_states.get(self._entry_key(entry)) == 'done'
+
+    def _flush(self) -> None:
+        # Downloads still winding down after Ctrl+C can outlive the journal
+        if self._journal_fp.closed:
+            return
+
+        if self._pending:
+            self._journal_fp.writelines(self._pending)
+            self._journal_fp.flush()
+            os.fsync(self._journal_fp.fileno())
+            self._pending.clear()
+
+        self._last_flush = monotonic()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._journal_fp.close()
+
+
+class JobQueue:
+    # Tracks to download as (track_id, title, output_dir) jobs, drained together
+    # by any number of 'worker' processes on any number of hosts.  A job is
+    # queued, leased (to one worker, until its lease runs out), done or failed
+
+    def __init__(self, path: Path = None):
+        # No path keeps the queue in memory, for workers in this process only
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # Rollback journal rather than WAL, which needs shared memory network
+        # filesystems don't have.  The timeout waits out other workers' transactions
+        self._conn = sqlite3.connect(path or ':memory:', timeout=60, check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, track_id TEXT, title TEXT, output_dir TEXT, "
+            "state TEXT, worker TEXT, lease_until REAL, leases INTEGER, updated_at REAL, "
+            "UNIQUE (track_id, output_dir))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until)")
+
+    @contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so two workers can't claim the same jobs
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, tracks: Iterable) -> int:
+        # Jobs already queued, leased or done are left alone; failed ones get
+        # another go.  Returns how many were (re)queued
+        now = time()
+        rows = [(track_id, track_title, str(Path(output_dir).resolve()), now) for track_id, track_title, output_dir in tracks]
+
+        with self._transaction() as conn:
+            changes = conn.total_changes
+            conn.executemany(
+                "INSERT INTO jobs (track_id, title, output_dir, state, leases, updated_at) VALUES (?, ?, ?, 'queued', 0, ?) "
+                "ON CONFLICT (track_id, output_dir) DO UPDATE SET "
+                "state = 'queued', title = excluded.title, worker = NULL, leases = 0, updated_at = excluded.updated_at "
+                "WHERE state = 'failed'",
+                rows
+            )
+            return conn.total_changes - changes
+
+    def _requeue_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            "UPDATE jobs SET state = CASE WHEN leases >= ? THEN 'failed' ELSE 'queued' END, worker = NULL, updated_at = ? "
+            "WHERE state = 'leased' AND lease_until < ?",
+            (QUEUE_MAX_LEASES, now, now)
+        )
+
+    def claim(self, worker: str, max_tracks: int) -> list:
+        # Leases the queued jobs of up to max_tracks tracks, oldest first, and
+        # returns them as (job id, track_id, title, output_dir).  All of a
+        # track's jobs go to the same worker, so it's only fetched once
+        now = time()
+
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+
+            jobs = conn.execute(
+                "SELECT id, track_id, title, output_dir FROM jobs WHERE state = 'queued' AND track_id IN "
+                "(SELECT track_id FROM jobs WHERE state = 'queued' GROUP BY track_id ORDER BY MIN(id) LIMIT ?) ORDER BY id",
+                (max_tracks,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, leases = leases + 1, updated_at = ? WHERE id = ?",
+                [(worker, now + QUEUE_LEASE, now, job_id) for job_id, _, _, _ in jobs]
+            )
+
+        return [(job_id, track_id, track_title, Path(output_dir)) for job_id, track_id, track_title, output_dir in jobs]
+
+    def heartbeat(self, worker: str) -> None:
+        # Renews the leases of everything worker holds
+        now = time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE state = 'leased' AND worker = ?",
+                (now + QUEUE_LEASE, now, worker)
+            )
+
+    def finish(self, job_ids: Iterable, state: str) -> None:
+        # state is 'done' or 'failed'
+        now = time()
+        if not (rows := [(state, now, job_id) for job_id in job_ids]):
+            return
+
+        with self._transaction() as conn:
+            conn.executemany("UPDATE jobs SET state = ?, worker = NULL, updated_at = ? WHERE id = ?", rows)
+
+    def release(self, worker: str) -> None:
+        # Hands back what worker still holds (e.g. stopped with Ctrl+C) without
+        # counting it as a lost lease
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', worker = NULL, leases = leases - 1, updated_at = ? "
+                "WHERE state = 'leased' AND worker = ?",
+                (time(), worker)
+            )
+
+    def leased_elsewhere(self, worker: str) -> int:
+        # Jobs other workers hold, which come back if their worker dies
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = 'leased' AND worker != ?", (worker,)
+            ).fetchone()[0]
+
+    def counts(self) -> Counter:
+        with self._lock:
+            return Counter(dict(self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")))
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RunMetrics:
+    # Where a run's time went: seconds and calls per phase, overall and per
+    # track, plus bytes and retries.  Phases nest (e.g. 'throttle' happens
+    # inside 'track_data'), so they don't add up to the run time.  Work done
+    # inside track() on a thread is put down to that track.
+
+    def __init__(self, max_tracks: int = None):
+        self.started = time()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # phase -> [calls, seconds]
+        self.phases = {}
+        self.counters = Counter()
+        self.tracks = {}
+        # Tracks beyond this many are forgotten, oldest first (e.g. for --serve)
+        self.max_tracks = max_tracks
+
+    def _track_metrics(self, track_id: str) -> dict:
+        if track_id not in self.tracks:
+            self.tracks[track_id] = {'status': None, 'phases': {}, 'bytes': 0, 'retries': 0}
+
+            if self.max_tracks and len(self.tracks) > self.max_tracks:
+                del self.tracks[next(iter(self.tracks))]
+
+        return self.tracks[track_id]
+
+    @contextmanager
+    def track(self, track_id: str):
+        previous, self._local.track_id = getattr(self._local, 'track_id', None), track_id
+        try:
+            yield
+        finally:
+            self._local.track_id = previous
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        track_id = getattr(self._local, 'track_id', None)
+
+        with self._lock:
+            phase = self.phases.setdefault(name, [0, 0.0])
+            phase[0] += 1
+            phase[1] += seconds
+
+            if track_id:
+                track_phases = self._track_metrics(track_id)['phases']
+                track_phases[name] = track_phases.get(name, 0.0) + seconds
+
+    def add(self, counter: str, amount: int = 1, track_id: str = None) -> None:
+        # 'bytes' and 'retries' are also kept per track
+        track_id = track_id or getattr(self._local, 'track_id', None)
+
+        with self._lock:
+            self.counters[counter] += amount
+
+            if track_id and counter in ('bytes', 'retries'):
+                self._track_metrics(track_id)[counter] += amount
+
+    def track_status(self, track_id: str, status: str) -> None:
+        with self._lock:
+            self._track_metrics(track_id)['status'] = status
+            self.counters[f"tracks_{status}"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                'started': datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+                'elapsed': time() - self.started,
+                'phases': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.phases.items()},
+                'counters': dict(self.counters),
+                'tracks': {track_id: dict(track_metrics) for track_id, track_metrics in self.tracks.items()}
+            }
+
+    def summary_lines(self) -> list:
+        with self._lock:
+            return [
+                f"{name}: {seconds:.1f}s over {calls} calls"
+                for name, (calls, seconds) in sorted(self.phases.items(), key=lambda phase: -phase[1][1])
+            ]
+
+    def write_json(self, path: Path) -> None:
+        _write_atomic(path, json.dumps(self.summary(), indent=1))
+
+    def write_prometheus(self, path: Path) -> None:
+        summary = self.summary()
+
+        lines = [
+            "# HELP spotify_dl_run_duration_seconds Wall time of the last run.",
+            "# TYPE spotify_dl_run_duration_seconds gauge",
+            f"spotify_dl_run_duration_seconds {summary['elapsed']:.3f}",
+            "# HELP spotify_dl_run_timestamp_seconds When the last run finished.",
+            "# TYPE spotify_dl_run_timestamp_seconds gauge",
+            f"spotify_dl_run_timestamp_seconds {time():.0f}",
+            "# HELP spotify_dl_phase_seconds Time spent in each phase of the last run.",
+            "# TYPE spotify_dl_phase_seconds gauge",
+            *(f'spotify_dl_phase_seconds{{phase="{name}"}} {phase["seconds"]:.3f}' for name, phase in summary['phases'].items()),
+            "# HELP spotify_dl_phase_calls Times each phase was entered in the last run.",
+            "# TYPE spotify_dl_phase_calls gauge",
+            *(f'spotify_dl_phase_calls{{phase="{name}"}} {phase["calls"]}' for name, phase in summary['phases'].items()),
+            "# HELP spotify_dl_events Counts of bytes, retries and track outcomes in the last run.",
+            "# TYPE spotify_dl_events gauge",
+            *(f'spotify_dl_events{{event="{name}"}} {value}' for name, value in sorted(summary['counters'].items())),
+        ]
+
+        _write_atomic(path, '\n'.join(lines) + '\n')
+
+
+_run_metrics = RunMetrics()
+
+
+@dataclass(frozen=True)
+class TrackResolved:
+    track_id: str
+    title: str
+
+
+@dataclass(frozen=True)
+class TrackStarted:
+    track_id: str
+    title: str
+    attempt: int
+
+
+@dataclass(frozen=True)
+class TrackProgress:
+    track_id: str
+    bytes_done: int
+    # None when the CDN doesn't send a Content-Length
+    bytes_total: int = None
+
+
+@dataclass(frozen=True)
+class TrackDone:
+    track_id: str
+    title: str
+    path: Path
+    # Already in the output directory, nothing was downloaded
+    skipped: bool = False
+
+
+@dataclass(frozen=True)
+class TrackFailed:
+    track_id: str
+    title: str
+    error: str
+    will_retry: bool
+
+
+@dataclass(frozen=True)
+class UrlFailed:
+    url: str
+    error: str
+
+
+class ServeJob:
+    # A download submitted to the --serve daemon: what to download, its state
+    # (queued, running, done, failed) and the events it has produced so far
+
+    def __init__(
+        self,
+        job_id: str,
+        urls: list,
+        output_dir: Path,
+        filename_template: str = r"{title} - {artist}",
+        skip_duplicates: bool = True,
+        max_retries: int = 0
+    ):
+        self.id = job_id
+        self.urls = urls
+        self.output_dir = output_dir
+        self.filename_template = filename_template
+        self.skip_duplicates = skip_duplicates
+        self.max_retries = max_retries
+
+        self.state = 'queued'
+        self.error = None
+        self.submitted_at = time()
+        self.finished_at = None
+        self.counts = Counter()
+
+        # Event dicts in the order they happened.  Progress only makes it in
+        # every SERVE_PROGRESS_INTERVAL per track (and when a track completes)
+        self.events = []
+        self.changed = threading.Condition()
+        self._last_progress = {}
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ('done', 'failed')
+
+    def record(self, event) -> None:
+        if isinstance(event, TrackProgress):
+            now = monotonic()
+            if event.bytes_done != event.bytes_total and now - self._last_progress.get(event.track_id, 0.0) < SERVE_PROGRESS_INTERVAL:
+                return
+            self._last_progress[event.track_id] = now
+        elif isinstance(event, TrackResolved):
+            self.counts['resolved'] += 1
+        elif isinstance(event, TrackDone):
+            self._last_progress.pop(event.track_id, None)
+            self.counts['skipped' if event.skipped else 'downloaded'] += 1
+        elif isinstance(event, TrackFailed) and not event.will_retry:
+            self._last_progress.pop(event.track_id, None)
+            self.counts['failed'] += 1
+        elif isinstance(event, UrlFailed):
+            self.counts['failed_urls'] += 1
+
+        with self.changed:
+            self.events.append({'event': type(event).__name__, **asdict(event)})
+            self.changed.notify_all()
+
+    def set_state(self, state: str, error: str = None) -> None:
+        with self.changed:
+            self.state = state
+            self.error = error
+            if self.finished:
+                self.finished_at = time()
+            self.changed.notify_all()
+
+    def status(self) -> dict:
+        return {
+            'id': self.id,
+            'state': self.state,
+            'urls': self.urls,
+            'output_dir': str(self.output_dir),
+            'counts': dict(self.counts),
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'finished_at': self.finished_at,
+            'events': len(self.events)
+        }
+
+    def iter_events(self, start: int = 0) -> Iterator[dict]:
+        # Events from number start on, waiting for new ones until the job has finished
+        idx = start
+        while True:
+            with self.changed:
+                while idx >= len(self.events) and not self.finished:
+                    self.changed.wait()
+
+                new_events = self.events[idx:]
+                finished = self.finished
+
+            idx += len(new_events)
+            yield from new_events
+
+            if finished and idx >= len(self.events):
+                return
+
+
+class DownloadDaemon:
+    # Runs --serve jobs side by side on one event loop in this one process, so
+    # connection pools, the metadata and cover art caches and prefetched links
+    # stay warm from one job to the next.  No more than max_transfers tracks
+    # download at a time, across all jobs
+
+    def __init__(self, max_transfers: int = 4):
+        import asyncio
+
+        self.max_transfers = max(1, max_transfers)
+
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._job_ids = count(1)
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="spotify_dl_serve", daemon=True)
+        self._thread.start()
+
+        async def make_transfer_slots():
+            # Made on the loop that uses it
+            return asyncio.Semaphore(self.max_transfers)
+
+        self._transfer_slots = asyncio.run_coroutine_threadsafe(make_transfer_slots(), self._loop).result()
+
+    def submit(self, urls: list, output_dir: Path, **kwargs) -> ServeJob:
+        import asyncio
+
+        with self._lock:
+            job = ServeJob(str(next(self._job_ids)), urls, output_dir, **kwargs)
+            self._jobs[job.id] = job
+
+            # Forget the oldest finished jobs
+            finished = [job_id for job_id, other_job in self._jobs.items() if other_job.finished]
+            for job_id in finished[:max(0, len(finished) - SERVE_FINISHED_JOBS)]:
+                del self._jobs[job_id]
+
+        asyncio.run_coroutine_threadsafe(self._run(job), self._loop)
+        return job
+
+    async def _run(self, job: ServeJob) -> None:
+        _print(f"Job {job.id}: {len(job.urls)} URLs to '{job.output_dir}'.")
+        job.set_state('running')
+
+        try:
+            async for event in download(
+                job.urls,
+                job.output_dir,
+                job.filename_template,
+                jobs=self.max_transfers,
+                skip_duplicates=job.skip_duplicates,
+                max_retries=job.max_retries,
+                transfer_slots=self._transfer_slots
+            ):
+                job.record(event)
+        except Exception as exc:
+            job.set_state('failed', str(exc))
+        else:
+            job.set_state('done')
+
+        _print(f"Job {job.id}: {job.state} ({', '.join(f'{count} {name}' for name, count in sorted(job.counts.items())) or 'nothing found'}).")
+
+    def job(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def close(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def parse_cfg(cfg_path: Path) -> ConfigParser:
+    parser = ConfigParser()
+    parser.read(cfg_path)
+
+    return parser
+
+
+def assemble_track_custom_title(
+    title: str,
+    template: str,
+    artist: str = "",
+    track_num: int = 1
+) -> str:
+    if not template:
+        template = r"{title} - {artist}"
+    else:
+        # validate given template
+        allowed_vars = ["title", "artist", "track_num"]
+        for detected_var in re.findall(r"{(\w+)}", template):
+            if detected_var not in allowed_vars:
+                raise ValueError(
+                    "Variable in filename template of not one of "
+                    f"{', '.join(map(repr, allowed_vars))}. Found: '{detected_var}'"
+                )
+
+    template = template.replace(r"{track_num}", str(track_num)) \
+        .replace(r"{title}", title) \
+        .replace(r"{artist}", artist)
+
+    return template
+
+
+def _print(*args, **kwargs) -> None:
+    with _print_lock:
+        print(*args, **kwargs)
+
+
+def _host_key(url: str) -> tuple:
+    # API and CDN limits are kept apart even if both happen to live on one host
+    return ('api' if url.startswith(DOWNLOADER_URL) else 'cdn', url.split('/')[2])
+
+
+def _host_slot(url: str) -> threading.BoundedSemaphore:
+    host_key = _host_key(url)
+
+    with _host_semaphores_lock:
+        if host_key not in _host_semaphores:
+            if host_key[0] == 'api':
+                limit = MAX_API_CONNECTIONS
+            else:
+                limit = MAX_CDN_CONNECTIONS_PER_HOST
+
+            _host_semaphores[host_key] = threading.BoundedSemaphore(max(1, limit))
+
+        return _host_semaphores[host_key]
+
+
+def _get_session(url: str, profile: str) -> 'requests.Session':
+    import requests
+
+    host = url.split('/')[2]
+
+    with _sessions_lock:
+        if (profile, host) not in _sessions:
+            if url.startswith(DOWNLOADER_URL):
+                pool_size = MAX_API_CONNECTIONS
+            else:
+                pool_size = MAX_CDN_CONNECTIONS_PER_HOST
+
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+
+            session.headers.update(HEADER_PROFILES[profile])
+            if profile == 'cdn':
+                session.headers['Host'] = host
+
+            _sessions[(profile, host)] = session
+
+        return _sessions[(profile, host)]
+
+
+def _rate_limiter(url: str) -> RateLimiter:
+    host_key = _host_key(url)
+
+    with _rate_limiters_lock:
+        if host_key not in _rate_limiters:
+            if host_key[0] == 'api':
+                rate = API_RATE_LIMIT
+            else:
+                rate = CDN_RATE_LIMIT
+
+            _rate_limiters[host_key] = RateLimiter(rate)
+
+        return _rate_limiters[host_key]
+
+
+def _parse_retry_after(resp: 'requests.Response'):
+    from email.utils import parsedate_to_datetime
+
+    if not (retry_after := resp.headers.get('Retry-After')):
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_request(method: str, url: str, profile: str = 'cdn', **kwargs) -> 'requests.Response':
+    kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    limiter = _rate_limiter(url)
+
+    for attempt in range(MAX_THROTTLED_RETRIES + 1):
+        if wait := limiter.acquire():
+            _run_metrics.add_time('throttle', wait)
+
+        # Streamed bodies are read after this returns, so those callers hold the host slot themselves
+        with nullcontext() if kwargs.get('stream') else _host_slot(url):
+            resp = _get_session(url, profile).request(method, url, **kwargs)
+
+        if resp.status_code not in (429, 503) or attempt == MAX_THROTTLED_RETRIES:
+            limiter.record_response(resp.status_code)
+            return resp
+
+        # Jittered exponential backoff unless the server says how long to wait
+        if (delay := _parse_retry_after(resp)) is None:
+            delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+        limiter.record_response(resp.status_code, retry_after=delay)
+        resp.close()
+        _run_metrics.add('http_retries')
+
+    return resp
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    # Readers (e.g. node_exporter) never see a half-written file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    tmp_path.write_text(text, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def write_run_metrics() -> None:
+    try:
+        if METRICS_PATH:
+            _run_metrics.write_json(METRICS_PATH)
+        if METRICS_PROMETHEUS_PATH:
+            _run_metrics.write_prometheus(METRICS_PROMETHEUS_PATH)
+    except OSError as exc:
+        print(f"[!] Couldn't write run metrics: {exc}")
+
+
+def _start_profiling() -> list:
+    import cProfile
+
+    profilers = [cProfile.Profile()]
+
+    if sys.version_info >= (3, 12):
+        # cProfile is built on sys.monitoring from 3.12: one profiler sees
+        # every thread, and a second can't be enabled at all
+        profilers[0].enable()
+        return profilers
+
+    # Before that it only sees the thread it's enabled on, so every thread started
+    # from here on (download workers, page prefetchers) gets its own profiler
+
+    def profile_thread(*_):
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+
+    threading.setprofile(profile_thread)
+    profilers[0].enable()
+
+    return profilers
+
+
+def _dump_profile(profilers: list, path: Path) -> None:
+    import pstats
+
+    threading.setprofile(None)
+    profilers[0].disable()
+
+    stats = pstats.Stats(profilers[0])
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+
+    stats.dump_stats(path)
+
+
+def rate_limit_summary() -> list:
+    with _rate_limiters_lock:
+        return [
+            f"{host}: {limiter.requests} requests, {limiter.throttled} throttled, "
+            f"{limiter.wait_time:.1f}s waiting on the rate limiter"
+            for (_, host), limiter in _rate_limiters.items()
+            if limiter.requests
+        ]
+
+
+def _id3v2_size(head: bytes) -> int:
+    # Full size of the ID3v2 tag at the start of head (its first 10 bytes), 0 if there isn't one
+    if len(head) < 10 or head[:3] != b'ID3':
+        return 0
+
+    # Syncsafe integer, 7 bits per byte
+    size = 0
+    for byte in head[6:10]:
+        size = (size << 7) | (byte & 0x7f)
+
+    # Header, plus a footer if the flag for one is set
+    return 10 + size + (10 if head[5] & 0x10 else 0)
+
+
+def _check_download_response(resp: 'requests.Response', url: str) -> None:
+    if resp.status_code in (403, 410):
+        raise LinkExpiredError(f"Download link expired ({resp.status_code}): {url}")
+
+    if resp.status_code == 429 or resp.status_code >= 500:
+        raise TransientDownloadError(f"Bad download response ({resp.status_code}): {url}")
+
+    if not resp.ok:
+        raise PermanentDownloadError(f"Bad download response ({resp.status_code}): {url}")
+
+
+def _download_error_type(exc: Exception) -> type:
+    # Network trouble is worth retrying; anything else (a 404, the disk
+    # filling up, a tag mutagen can't write) would only fail again
+    import requests
+    import urllib3
+
+    # requests' exceptions are IOErrors too, so they have to be picked out
+    # before a local OSError is taken to be permanent
+    if isinstance(exc, (
+        TransientDownloadError,
+        requests.RequestException,
+        urllib3.exceptions.HTTPError,
+        TimeoutError,
+        ConnectionError
+    )):
+        return TransientDownloadError
+
+    return PermanentDownloadError
+
+
+def _probe_id3v2_size(url: str) -> int:
+    with _http_request('GET', url, headers={'Accept-Encoding': 'identity', 'Range': 'bytes=0-9'}, stream=True) as resp:
+        _check_download_response(resp, url)
+
+        return _id3v2_size(next(resp.iter_content(chunk_size=10), b''))
+
+
+def _file_sha256(path: Path, length: int = None):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as fp:
+        while chunk := fp.read(DOWNLOAD_CHUNK_SIZE if length is None else min(DOWNLOAD_CHUNK_SIZE, length)):
+            digest.update(chunk)
+            if length is not None:
+                length -= len(chunk)
+
+    return digest
+
+
+def _get_transfer_supervisor() -> TransferSupervisor:
+    global _transfer_supervisor
+
+    with _transfer_lock:
+        if _transfer_supervisor is None:
+            _transfer_supervisor = TransferSupervisor()
+
+        return _transfer_supervisor
+
+
+def _get_bandwidth_limiter():
+    global _bandwidth_limiter
+
+    if not MAX_BANDWIDTH:
+        return None
+
+    with _transfer_lock:
+        if _bandwidth_limiter is None:
+            # Same token bucket as for requests, with a token per byte
+            _bandwidth_limiter = RateLimiter(MAX_BANDWIDTH, min_rate=MAX_BANDWIDTH)
+
+        return _bandwidth_limiter
+
+
+def _stream_to_file(
+    url: str,
+    dest_path: Path,
+    header: bytes = b'',
+    on_progress: Callable = None,
+    watch: TransferWatch = None
+) -> str:
+    import requests
+
+    # header (our ID3 tag) is written first and any ID3v2 tag the audio comes
+    # with is dropped, so the finished file is written in a single pass.
+    # Written next to the destination so the final rename stays on one filesystem
+    part_path = dest_path.with_name(dest_path.name + '.part')
+    # Size of the tag at the start of the source audio, once known
+    source_tag_size = None
+    watch = watch or TransferWatch()
+
+    for attempt in range(MAX_RESUME_ATTEMPTS + 1):
+        part_size = part_path.stat().st_size if part_path.exists() else 0
+
+        # Only pick up a .part that was started with this same tag
+        if part_size:
+            with open(part_path, 'rb') as part_fp:
+                if part_size <= len(header) or part_fp.read(len(header)) != header:
+                    part_size = 0
+
+        audio_written = max(0, part_size - len(header))
+
+        try:
+            if audio_written and source_tag_size is None:
+                source_tag_size = _probe_id3v2_size(url)
+
+            offset = audio_written + source_tag_size if audio_written else 0
+
+            # Byte offsets only line up if the body isn't re-encoded in transit
+            headers = {'Accept-Encoding': 'identity'}
+            if offset:
+                headers['Range'] = f"bytes={offset}-"
+
+            with _host_slot(url), _http_request('GET', url, headers=headers, stream=True) as resp:
+                watch.connected()
+
+                # Already have the whole file from an earlier attempt
+                if offset and resp.status_code == 416:
+                    digest = _file_sha256(part_path)
+                    break
+
+                _check_download_response(resp, url)
+
+                if resp.status_code != 206:
+                    # Server ignored the Range header, start over
+                    offset = 0
+
+                with open(part_path, 'r+b' if offset else 'wb') as part_fp:
+                    if offset:
+                        digest = _file_sha256(part_path, len(header) + audio_written)
+                        part_fp.seek(len(header) + audio_written)
+                        part_fp.truncate()
+                    else:
+                        digest = hashlib.sha256(header)
+                        part_fp.write(header)
+
+                    # Source tag bytes still to drop; None until its header has been read
+                    to_skip = 0 if offset else None
+                    head = b''
+
+                    bytes_done = offset
+                    bytes_total = offset + int(resp.headers['Content-Length']) if 'Content-Length' in resp.headers else None
+
+                    for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        watch.chunk(len(chunk))
+
+                        if on_progress:
+                            bytes_done += len(chunk)
+                            on_progress(bytes_done, bytes_total)
+
+                        if to_skip is None:
+                            head += chunk
+                            if len(head) < 10:
+                                continue
+
+                            source_tag_size = to_skip = _id3v2_size(head)
+                            chunk, head = head, b''
+
+                        if to_skip:
+                            skipped = min(to_skip, len(chunk))
+                            chunk = chunk[skipped:]
+                            to_skip -= skipped
+
+                        digest.update(chunk)
+                        part_fp.write(chunk)
+                        _run_metrics.add('bytes', len(chunk))
+
+                    # Body too short to even hold a tag header
+                    digest.update(head)
+                    part_fp.write(head)
+
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, TransferStalledError):
+            if attempt == MAX_RESUME_ATTEMPTS:
+                raise
+            _run_metrics.add('resume_retries')
+            continue
+
+        break
+
+    watch.finished()
+    os.replace(part_path, dest_path)
+
+    return digest.hexdigest()
+
+
+def _hedged_stream_to_file(track_id: str, url: str, track_path: Path, header: bytes, on_progress: Callable = None) -> str:
+    # _stream_to_file, except that if the transfer falls far behind the others
+    # a second request with a fresh link races it from another thread.
+    # Whichever finishes first is kept
+    hedge_path = track_path.with_name(track_path.name + '.hedge')
+    primary_cancelled = threading.Event()
+    hedge_cancelled = threading.Event()
+    hedge = {}
+
+    def run_hedge() -> None:
+        try:
+            with _run_metrics.track(track_id):
+                _get_metadata_cache().delete('link', track_id)
+                if 'link' not in (resp_json := get_track_data(track_id)):
+                    raise TransientDownloadError(f"No fresh link to hedge with: {resp_json}")
+
+                hedge['sha256'] = _stream_to_file(resp_json['link'], hedge_path, header, watch=TransferWatch(hedge_cancelled))
+                primary_cancelled.set()
+        except Exception as exc:
+            hedge['error'] = exc
+            hedge_path.with_name(hedge_path.name + '.part').unlink(missing_ok=True)
+
+    def start_hedge() -> None:
+        _run_metrics.add('hedged_transfers')
+        hedge['thread'] = threading.Thread(target=run_hedge, name=f"spotify_dl_hedge_{track_id}", daemon=True)
+        hedge['thread'].start()
+
+    try:
+        sha256 = _stream_to_file(url, track_path, header, on_progress, TransferWatch(primary_cancelled, on_slow=start_hedge))
+    except Exception:
+        if 'thread' not in hedge:
+            raise
+
+        hedge['thread'].join()
+        if 'sha256' not in hedge:
+            raise
+
+        _run_metrics.add('hedges_won')
+        os.replace(hedge_path, track_path)
+        track_path.with_name(track_path.name + '.part').unlink(missing_ok=True)
+
+        return hedge['sha256']
+
+    if 'thread' in hedge:
+        hedge_cancelled.set()
+        hedge['thread'].join()
+        hedge_path.unlink(missing_ok=True)
+
+    return sha256
+
+
+def build_id3_tag(metadata: dict, cover_art: bytes = None) -> bytes:
+    from mutagen.id3 import APIC, ID3, PictureType, TALB, TDRC, TIT2, TPE1, TXXX
 
-# Cheeky Ctrl+C handler
-signal.signal(signal.SIGINT, lambda sig, frame : print('\n\nInterrupt received. Exiting.\n') or sys.exit(0))
+    tag = ID3()
 
-DOWNLOADER_URL = "https://api.spotifydown.com"
-# Clean browser heads for API
-DOWNLOADER_HEADERS = {
-    'Host': 'api.spotifydown.com',
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
-    'Accept': '*/*',
-    'Accept-Language': 'en-US,en;q=0.5',
-    'Accept-Encoding': 'gzip',
-    'Referer': 'https://spotifydown.com/',
-    'Origin': 'https://spotifydown.com',
-    'DNT': '1',
-    'Connection': 'keep-alive',
-    'Sec-Fetch-Dest': 'empty',
-    'Sec-Fetch-Mode': 'cors',
-    'Sec-Fetch-Site': 'same-site',
-    'Sec-GPC': '1',
-    'TE': 'trailers'
-}
+    if title := metadata.get('title'):
+        tag.add(TIT2(encoding=3, text=title))
+    if artists := metadata.get('artists'):
+        tag.add(TPE1(encoding=3, text=artists))
+    if album := metadata.get('album'):
+        tag.add(TALB(encoding=3, text=album))
+    if release_date := metadata.get('releaseDate'):
+        tag.add(TDRC(encoding=3, text=release_date))
+    if track_id := metadata.get('id'):
+        # Lets the output directory manifest be rebuilt from the files themselves
+        tag.add(TXXX(encoding=3, desc=TRACK_ID_TAG_DESC, text=track_id))
+    if cover_art:
+        tag.add(APIC(encoding=3, mime='image/jpeg', type=PictureType.COVER_FRONT, desc='', data=cover_art))
 
-MULTI_TRACK_INPUT_URL_TRACK_NUMS_RE = re.compile(r'^https?:\/\/open\.spotify\.com\/(album|playlist)\/[\w]+(?:\?[\w=%-]*|)\|(?P<track_nums>.*)$')
+    # v2.3 fixes FRONT_COVER not showing up in windows explorer, and
+    # lets album art show up in Serato
+    tag.update_to_v23()
 
-# In interactive mode, user is prompted upon first duplicate encountered
-# Otherwise, set via CLI arg
-skip_duplicate_downloads = True
-skip_duplicate_downloads_prompted = True
+    tag_fp = BytesIO()
+    tag.save(tag_fp, v2_version=3, padding=lambda info: 0)
 
+    return tag_fp.getvalue()
 
-@dataclass(frozen=True, eq=True)
-class SpotifySong:
-    title: str
-    artist: str
-    album: str
-    id: str
-    url = f"https://open.spotify.com/track/{id}"
 
+def _get_metadata_cache():
+    global _metadata_cache, CACHE_ENABLED, metadata_cache_error
 
-def parse_cfg(cfg_path: Path) -> ConfigParser:
-    parser = ConfigParser()
-    parser.read(cfg_path)
+    with _metadata_cache_lock:
+        if CACHE_ENABLED and _metadata_cache is None:
+            try:
+                _metadata_cache = MetadataCache(CACHE_PATH, CACHE_MAX_ENTRIES, refresh=CACHE_REFRESH)
+            except (OSError, sqlite3.Error) as exc:
+                # e.g. read-only home directory; carry on uncached
+                metadata_cache_error = exc
+                CACHE_ENABLED = False
 
-    return parser
+        if _metadata_cache is None:
+            # Still only fetch each track's metadata once per run
+            _metadata_cache = MetadataCache(None, CACHE_MAX_ENTRIES)
 
+        return _metadata_cache
 
-def assemble_track_custom_title(
-    title: str,
-    template: str,
-    artist: str = "",
-    track_num: int = 1
-) -> str:
-    if not template:
-        template = r"{title} - {artist}"
-    else:
-        # validate given template
-        allowed_vars = ["title", "artist", "track_num"]
-        for detected_var in re.findall(r"{(\w+)}", template):
-            if detected_var not in allowed_vars:
-                raise ValueError(
-                    "Variable in filename template of not one of "
-                    f"{', '.join(map(repr, allowed_vars))}. Found: '{detected_var}'"
-                )
 
-    template = template.replace(r"{track_num}", str(track_num)) \
-        .replace(r"{title}", title) \
-        .replace(r"{artist}", artist)
+def _fetch_cover_art(url: str) -> bytes:
+    cover_resp = _http_request('GET', url)
 
-    return template
+    if not cover_resp.ok:
+        raise RuntimeError(f"Bad cover art response ({cover_resp.status_code}): {url}")
+
+    return cover_resp.content
+
+
+def get_cover_art(url: str) -> bytes:
+    global _cover_art_cache
+
+    with _cover_art_cache_lock:
+        if _cover_art_cache is None:
+            _cover_art_cache = CoverArtCache(COVER_CACHE_MAX_BYTES, COVER_CACHE_DIR)
+
+    return _cover_art_cache.get(url, _fetch_cover_art)
+
+
+def get_manifest(output_dir: Path) -> TrackManifest:
+    with _manifests_lock:
+        if (manifest := _manifests.get(output_dir)) is None:
+            # Kept under the path as given too, so resolve()'s stat()s are
+            # paid once per directory rather than once per lookup
+            key = output_dir.resolve()
+            manifest = _manifests.get(key) or TrackManifest(output_dir)
+            _manifests[key] = _manifests[output_dir] = manifest
+
+        return manifest
+
+
+def _get_track_store():
+    # None unless --store was given
+    global _track_store
+
+    if STORE_DIR is None:
+        return None
+
+    with _track_store_lock:
+        if _track_store is None:
+            _track_store = TrackStore(STORE_DIR)
+
+        return _track_store
+
+
+def _link_or_copy(source_path: Path, dest_path: Path) -> bool:
+    # True if dest_path was hardlinked, False if it had to be copied
+    try:
+        os.link(source_path, dest_path)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # Different filesystems, or one without hardlinks
+        shutil.copyfile(source_path, dest_path)
+        return False
+
+    return True
+
+
+@contextmanager
+def _track_path_lock(track_path: Path):
+    # Held while a track is checked for and written at track_path.  Different
+    # track ids can have the same filename, and would otherwise write into
+    # the same .part file at once, from any download engine or serve job
+    key = os.path.normcase(os.path.abspath(track_path))
+
+    with _track_path_locks_lock:
+        path_lock = _track_path_locks.setdefault(key, [threading.Lock(), 0])
+        path_lock[1] += 1
+
+    try:
+        with path_lock[0]:
+            yield
+    finally:
+        with _track_path_locks_lock:
+            path_lock[1] -= 1
+            if not path_lock[1]:
+                del _track_path_locks[key]
+
+
+def get_sync_state(output_dir: Path) -> SyncState:
+    key = output_dir.resolve()
+
+    with _sync_states_lock:
+        if key not in _sync_states:
+            _sync_states[key] = SyncState(output_dir)
+
+        return _sync_states[key]
+
+
+def _read_manifest_entry(track_path: Path):
+    from mutagen.id3 import ID3, ID3NoHeaderError
+
+    try:
+        tag = ID3(track_path)
+    except (ID3NoHeaderError, OSError):
+        return None
+
+    if not (track_id_frames := tag.getall(f"TXXX:{TRACK_ID_TAG_DESC}")):
+        return None
+
+    return {
+        'id': str(track_id_frames[0].text[0]),
+        'path': track_path.name,
+        'size': track_path.stat().st_size,
+        'sha256': _file_sha256(track_path).hexdigest()
+    }
+
+
+def rebuild_manifest(output_dir: Path, jobs: int = 4) -> int:
+    # Files without our track id tag (e.g. from before it was added) can't be matched up
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        entries = [
+            entry
+            for entry in executor.map(_read_manifest_entry, sorted(output_dir.glob('*.mp3')))
+            if entry
+        ]
+
+    get_manifest(output_dir).replace_all(entries)
+
+    return len(entries)
 
 
 def _call_downloader_api(
     endpoint: str,
     method: str = 'GET',
-    headers=DOWNLOADER_HEADERS,
+    headers: dict = None,
     **kwargs
-) -> requests.Response:
-    _map = {
-        'GET': requests.get,
-        'POST': requests.post
-    }
-
-    if method not in _map:
+) -> 'requests.Response':
+    if method not in ('GET', 'POST'):
         raise ValueError
 
     try:
-        resp = _map[method](DOWNLOADER_URL + endpoint, headers=headers, **kwargs)
+        resp = _http_request(method, DOWNLOADER_URL + endpoint, profile='api', headers=headers, **kwargs)
     except Exception as exc:
         raise RuntimeError("ERROR: ", exc)
 
@@ -122,49 +2111,211 @@ def validate_config_file(config_file: Path) -> list:
     return loaded_config
 
 
-def get_track_data(track_id: str):
-    resp = _call_downloader_api(f"/download/{track_id}")
+def get_track_data(track_id: str, need_link: bool = True):
+    return _get_track_data(track_id, need_link)[0]
+
 
-    resp_json = resp.json()
+def _get_track_data(track_id: str, need_link: bool = True) -> tuple:
+    # The track's data and when its link was issued: a cached link is as old
+    # as the API response it came from
+    cache = _get_metadata_cache()
+
+    if cache and (metadata := cache.get('track', track_id, CACHE_METADATA_TTL)):
+        if not need_link:
+            return {'success': True, 'metadata': metadata}, time()
+
+        if cached_link := cache.get_stored('link', track_id, CACHE_LINK_TTL):
+            link, issued_at = cached_link
+            return {'success': True, 'metadata': metadata, 'link': link}, issued_at
+
+    issued_at = time()
+    with _run_metrics.phase('track_data'):
+        resp_json = _call_downloader_api(f"/download/{track_id}").json()
 
     if not resp_json['success']:
         # print("[!] Bad URL. No song found.")
         resp_json = {}
 
+    elif cache:
+        if 'metadata' in resp_json:
+            cache.put('track', track_id, resp_json['metadata'])
+        if 'link' in resp_json:
+            cache.put('link', track_id, resp_json['link'])
+
+    return resp_json, issued_at
+
+
+def prefetch_link(track_id: str) -> None:
+    # Starts fetching the track's download link in the background, for fetch_track to pick up
+    global _link_prefetch_executor
+
+    with _link_prefetches_lock:
+        if _link_prefetch_executor is None:
+            _link_prefetch_executor = ThreadPoolExecutor(
+                max_workers=max(1, MAX_API_CONNECTIONS),
+                thread_name_prefix="spotify_dl_links"
+            )
+
+        if track_id not in _link_prefetches:
+            _link_prefetches[track_id] = _link_prefetch_executor.submit(_get_track_data, track_id)
+
+
+def _take_prefetched_link(track_id: str):
+    with _link_prefetches_lock:
+        link_future = _link_prefetches.pop(track_id, None)
+
+    if link_future is None:
+        return None
+
+    try:
+        resp_json, issued_at = link_future.result()
+    except Exception:
+        # Fetched again the usual way, which reports the error properly
+        return None
+
+    if time() - issued_at > CACHE_LINK_TTL:
+        return None
+
+    _run_metrics.add('link_prefetch_hits')
+
     return resp_json
 
 
-def get_multi_track_data(entity_id: str, entity_type: str):
-    metadata_resp = _call_downloader_api(f"/metadata/{entity_type}/{entity_id}").json()
+def _drop_prefetched_link(track_id: str) -> None:
+    # The track turned out not to need its link, e.g. a duplicate found on disk
+    with _link_prefetches_lock:
+        if link_future := _link_prefetches.pop(track_id, None):
+            link_future.cancel()
+
+
+def cancel_link_prefetches() -> None:
+    # Links nobody picked up, e.g. of tracks that turned out to be duplicates
+    with _link_prefetches_lock:
+        for link_future in _link_prefetches.values():
+            link_future.cancel()
+
+        _link_prefetches.clear()
+
+
+def _get_track_list_page(entity_id: str, entity_type: str, offset: int = 0) -> dict:
+    endpoint = f"/trackList/{entity_type}/{entity_id}"
+    if offset:
+        endpoint += f"?offset={offset}"
+
+    with _run_metrics.phase('track_list'):
+        return _call_downloader_api(endpoint).json()
 
-    # For paginated response
-    track_list = []
 
-    tracks_resp = _call_downloader_api(f"/trackList/{entity_type}/{entity_id}").json()
+def _get_entity_metadata(entity_id: str, entity_type: str) -> dict:
+    with _run_metrics.phase('metadata'):
+        return _call_downloader_api(f"/metadata/{entity_type}/{entity_id}").json()
+
+
+def _iter_track_list_pages(entity_id: str, entity_type: str, executor: ThreadPoolExecutor) -> Iterator[list]:
+    tracks_resp = _get_track_list_page(entity_id, entity_type)
 
     if not tracks_resp.get('trackList'):
-        return {}
+        return
 
-    track_list.extend(tracks_resp['trackList'])
+    yield tracks_resp['trackList']
+    page_size = len(tracks_resp['trackList'])
 
-    while next_offset := tracks_resp.get('nextOffset'):
-        tracks_resp = _call_downloader_api(f"/trackList/{entity_type}/{entity_id}?offset={next_offset}").json()
-        track_list.extend(tracks_resp['trackList'])
+    # The API doesn't say how many tracks there are, so a window of offsets past
+    # the next one is requested speculatively.  Pages are still consumed in order.
+    speculative_pages = {}
+    speculate = TRACK_LIST_PREFETCH_PAGES > 0
 
-    if not metadata_resp['success']:
-        return {}
+    try:
+        while next_offset := tracks_resp.get('nextOffset'):
+            if speculate:
+                for offset in range(next_offset, next_offset + page_size * TRACK_LIST_PREFETCH_PAGES, page_size):
+                    if offset not in speculative_pages:
+                        speculative_pages[offset] = executor.submit(_get_track_list_page, entity_id, entity_type, offset)
+
+            if page_future := speculative_pages.pop(next_offset, None):
+                tracks_resp = page_future.result()
+            else:
+                tracks_resp = _get_track_list_page(entity_id, entity_type, next_offset)
 
-    return {
-        **metadata_resp,
-        'trackList': [
+            # Offsets aren't evenly spaced after all; stop guessing
+            if speculate and tracks_resp.get('nextOffset') not in (None, next_offset + page_size):
+                speculate = False
+                for page_future in speculative_pages.values():
+                    page_future.cancel()
+                speculative_pages.clear()
+
+            yield tracks_resp['trackList']
+
+    finally:
+        # Past the last page, or the caller stopped reading
+        for page_future in speculative_pages.values():
+            page_future.cancel()
+
+
+def iter_multi_track_data(entity_id: str, entity_type: str) -> Iterator:
+    # Yields the /metadata response, then the entity's SpotifySongs a page at a time.
+    # Yields nothing if the album/playlist can't be found.
+    cache = _get_metadata_cache()
+    cache_key = f"{entity_type}/{entity_id}"
+    cache_ttl = CACHE_TRACK_LIST_TTL if entity_type == "playlist" else CACHE_METADATA_TTL
+
+    def to_songs(metadata_resp: dict, tracks: list) -> list:
+        return [
             SpotifySong(
                 title=track['title'],
                 artist=track['artists'],
                 album=track['album'] if entity_type == "playlist" else metadata_resp['title'],
                 id=track['id']
             )
-            for track in track_list
+            for track in tracks
         ]
+
+    # The track list is cached as a JSON string of [title, artist, album, id]
+    # rows per page, so it's decoded a page at a time too.  Entries from before
+    # that hold the raw 'trackList' instead
+    if (cached := cache.get('multi_track', cache_key, cache_ttl)) and 'pages' in cached:
+        yield cached['metadata']
+
+        for page in cached['pages']:
+            yield [SpotifySong(*row) for row in json.loads(page)]
+        return
+
+    with ThreadPoolExecutor(max_workers=1 + max(0, TRACK_LIST_PREFETCH_PAGES)) as executor:
+        # Metadata comes in while the track list is being paged through
+        metadata_future = executor.submit(_get_entity_metadata, entity_id, entity_type)
+
+        track_list_pages = _iter_track_list_pages(entity_id, entity_type, executor)
+
+        if (first_page := next(track_list_pages, None)) is None:
+            metadata_future.cancel()
+            return
+
+        metadata_resp = metadata_future.result()
+
+        if not metadata_resp['success']:
+            track_list_pages.close()
+            return
+
+        yield metadata_resp
+
+        cached_pages = []
+        for page in chain([first_page], track_list_pages):
+            page_songs = to_songs(metadata_resp, page)
+            cached_pages.append(json.dumps([(song.title, song.artist, song.album, song.id) for song in page_songs]))
+            yield page_songs
+
+    cache.put('multi_track', cache_key, {'metadata': metadata_resp, 'pages': cached_pages})
+
+
+def get_multi_track_data(entity_id: str, entity_type: str):
+    multi_track_data = iter_multi_track_data(entity_id, entity_type)
+
+    if not (metadata_resp := next(multi_track_data, None)):
+        return {}
+
+    return {
+        **metadata_resp,
+        'trackList': list(chain.from_iterable(multi_track_data))
     }
 
 
@@ -172,8 +2323,10 @@ def get_spotify_playlist(playlist_id: str, token: str):
     # GET to playlist URL can get first 30 songs only
     # soup.find_all('meta', content=re.compile("https://open.spotify.com/track/\w+"))
 
-    playlist_resp = requests.get(
+    playlist_resp = _http_request(
+        'GET',
         f'https://api.spotify.com/v1/playlists/{playlist_id}',
+        profile='plain',
         headers={'Authorization': f"Bearer {token}"}
     )
 
@@ -218,6 +2371,11 @@ def get_tracks_to_download(interactive: bool, filename_template, cli_arg_urls: l
     return tracks_to_dl
 
 
+def iter_tracks_to_download(filename_template, cli_arg_urls: list) -> Iterator[tuple]:
+    for url in cli_arg_urls:
+        yield from iter_input_url(url, filename_template, interactive=False, stream=True)
+
+
 def set_output_dir(interactive: bool, cli_arg_output_dir: Path, cli_arg_create_dir: bool = None) -> None:
     default_output_dir = 'C:/Users/tdv/Desktop/Music'
 
@@ -253,42 +2411,87 @@ def set_output_dir(interactive: bool, cli_arg_output_dir: Path, cli_arg_create_d
     return output_dir
 
 
-def track_num_inp_to_ind(given_inp: str, list_len: int) -> list:
-    indexes_or_slices = []
-    # Remove whitespace
-    no_ws = re.sub(r'\s', '', given_inp)
-
-    for item in no_ws.split(','):
+class TrackSelection:
+    # Which tracks of an album/playlist to download, as sorted, merged,
+    # zero-based half-open (start, end) index ranges, and what was wrong with
+    # the input they were parsed from (for the caller to show, or not)
 
-        # TODO: allow negative to get last n songs?
+    def __init__(self, ranges: Iterable, warnings: Iterable = ()):
+        self.ranges = []
+        self.warnings = list(warnings)
 
-        if item.isnumeric(): # ensure the user inputs a valid number in the playlist range
-            if not (1 <= int(item) <= list_len):
-                print(f"Track number {item} does not exist.  Valid numbers are 1 - {list_len}")
+        for start, end in sorted(ranges):
+            if start >= end:
                 continue
-            # Subtract one for indexing
-            indexes_or_slices.append(str(int(item) - 1))
-
-        elif '-' in item:
-            start, end = item.split('-')
-            if not start:
-                # '-3' --> :3 since that gets the first three tracks, 0, 1, and 2
-                indexes_or_slices.append(f":{end}")
-            elif not end:
-                indexes_or_slices.append(f"{int(start) - 1}:")
+
+            if self.ranges and start <= self.ranges[-1][1]:
+                self.ranges[-1] = (self.ranges[-1][0], max(end, self.ranges[-1][1]))
             else:
-                indexes_or_slices.append(f"{int(start) - 1}:{end}")
+                self.ranges.append((start, end))
 
-        elif item == '*':
-            indexes_or_slices.append(':')
+    @classmethod
+    def parse(cls, given_inp: str, list_len: int) -> 'TrackSelection':
+        ranges = []
+        warnings = []
 
-        else:
-            print(f'    [!] Invalid input: {item}')
+        def to_index(track_num: str) -> int:
+            # Track numbers are 1-based, negative ones count back from the last track
+            return int(track_num) - 1 if int(track_num) > 0 else list_len + int(track_num)
+
+        # Remove whitespace
+        no_ws = re.sub(r'\s', '', given_inp)
+
+        for item in no_ws.split(','):
 
-    if not indexes_or_slices:
-        print(f"    [!] No valid input received: '{given_inp}'. Try again.")
+            if item.isnumeric(): # ensure the user inputs a valid number in the playlist range
+                if not (1 <= int(item) <= list_len):
+                    warnings.append(f"Track number {item} does not exist.  Valid numbers are 1 - {list_len}")
+                    continue
+                ranges.append((int(item) - 1, int(item)))
 
-    return indexes_or_slices
+            elif match := TRACK_NUMS_RANGE_RE.match(item):
+                start, end = match.group('start', 'end')
+
+                # There's no track 0 (nor -0), so it can't bound a range
+                if not (start or end) or '-' in (start, end) or 0 in (int(bound) for bound in (start, end) if bound):
+                    warnings.append(f"[!] Invalid input: {item}")
+                    continue
+
+                # '-3' --> the first three tracks, '15-' --> the fifteenth to the end
+                track_range = (
+                    max(0, to_index(start)) if start else 0,
+                    min(list_len, to_index(end) + 1) if end else list_len
+                )
+
+                # Backwards ('3-1') or entirely past the end ('12-15' of 10)
+                if track_range[0] >= track_range[1]:
+                    warnings.append(f"[!] Invalid input: {item}")
+                    continue
+
+                ranges.append(track_range)
+
+            elif item == '*':
+                ranges.append((0, list_len))
+
+            else:
+                warnings.append(f"[!] Invalid input: {item}")
+
+        if not ranges:
+            warnings.append(f"[!] No valid input received: '{given_inp}'. Try again.")
+
+        return cls(ranges, warnings)
+
+    def __bool__(self) -> bool:
+        return bool(self.ranges)
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def apply(self, tracks: Sequence) -> Iterator[tuple]:
+        # (track number, track) for each selected track, in album/playlist order
+        for start, end in self.ranges:
+            for ind in range(start, min(end, len(tracks))):
+                yield ind + 1, tracks[ind]
 
 
 def get_track_nums_input(tracks: list, entity_type: str) -> str:
@@ -314,14 +2517,30 @@ def get_track_nums_input(tracks: list, entity_type: str) -> str:
 
 
 def process_input_url(url: str, filename_template: str, interactive: bool) -> list:
-    track_id_title_tuples = []
+    with _run_metrics.phase('resolve'):
+        return list(iter_input_url(url, filename_template, interactive))
+
+
+def iter_input_url(
+    url: str,
+    filename_template: str,
+    interactive: bool,
+    stream: bool = False,
+    quiet: bool = False,
+    on_warning: Callable = None
+) -> Iterator[tuple]:
+    # With stream, whole albums/playlists yield their tracks page by page as
+    # they're resolved.  Problems with a '|track_nums' selection go to
+    # on_warning, printed by default even when quiet
+    say = (lambda *args, **kwargs: None) if quiet else _print
+    warn = on_warning or (lambda message: _print(f"    {message}"))
 
     if "/track/" in url:
-        track_resp_json = get_track_data(track_id=url.split('/')[-1].split('?')[0])
+        track_resp_json = get_track_data(track_id=url.split('/')[-1].split('?')[0], need_link=False)
 
         if not track_resp_json:
-            print(f"\t[!] Song not found{f' at {url}' if not interactive else ''}.")
-            return []
+            say(f"\t[!] Song not found{f' at {url}' if not interactive else ''}.")
+            return
 
         track_title = assemble_track_custom_title(
             title=track_resp_json['metadata']['title'],
@@ -330,9 +2549,9 @@ def process_input_url(url: str, filename_template: str, interactive: bool) -> li
             template=filename_template
         )
 
-        print(f"\t{track_title}")
+        say(f"\t{track_title}")
 
-        track_id_title_tuples.append((track_resp_json['metadata']['id'], track_title))
+        yield (track_resp_json['metadata']['id'], track_title)
 
     elif "/playlist/" in url or "/album/" in url:
         entity_id = url.split('/')[-1].split('?')[0].split('|')[0]
@@ -343,204 +2562,705 @@ def process_input_url(url: str, filename_template: str, interactive: bool) -> li
             entity_type = "album"
 
         # playlist_name, playlist_creator, playlist_tracks = get_spotify_playlist(playlist_id, token)
-        multi_track_resp_json = get_multi_track_data(entity_id, entity_type)
+        multi_track_data = iter_multi_track_data(entity_id, entity_type)
 
-        if not multi_track_resp_json:
-            print(
+        if not (multi_track_resp_json := next(multi_track_data, None)):
+            say(
                 f"\t[!] {entity_type.capitalize()} not found{f' at {url}' if not interactive else ''}"
                 f"{' or it is set to Private' if entity_type == 'playlist' else ''}."
             )
-            return []
+            return
 
-        # print(f"\t{playlist_name} - {playlist_creator} ({len(playlist_tracks)} tracks)")
-        print(f"\t{multi_track_resp_json['title']} - {multi_track_resp_json['artists']} ({len(multi_track_resp_json['trackList'])} tracks)")
+        specified_track_nums = MULTI_TRACK_INPUT_URL_TRACK_NUMS_RE.match(url)
+
+        if stream and not interactive and not specified_track_nums:
+            # Whole playlist/album: nothing to select, so hand tracks over as pages arrive
+            say(f"\t{multi_track_resp_json['title']} - {multi_track_resp_json['artists']}")
+
+            for track_num, track in enumerate(chain.from_iterable(multi_track_data), start=1):
+                track_title = assemble_track_custom_title(
+                    title=track.title,
+                    artist=track.artist,
+                    track_num=track_num,
+                    template=filename_template
+                )
+
+                say(f"\t{track_num:>4}| {track_title}")
 
-        album_or_playlist_tracks = multi_track_resp_json['trackList']
+                yield (track.id, track_title)
+
+            return
+
+        album_or_playlist_tracks = list(chain.from_iterable(multi_track_data))
+
+        # print(f"\t{playlist_name} - {playlist_creator} ({len(playlist_tracks)} tracks)")
+        say(f"\t{multi_track_resp_json['title']} - {multi_track_resp_json['artists']} ({len(album_or_playlist_tracks)} tracks)")
 
         if interactive:
             print("Downloading all tracks.")
             track_numbers_inp = '*'
-            indexes_or_slices = track_num_inp_to_ind(track_numbers_inp, list_len=len(album_or_playlist_tracks))
+            track_selection = TrackSelection.parse(track_numbers_inp, list_len=len(album_or_playlist_tracks))
 
         else:
-            if specified_track_nums := MULTI_TRACK_INPUT_URL_TRACK_NUMS_RE.match(url):
+            if specified_track_nums:
                 track_numbers_inp = specified_track_nums.group('track_nums')
             else:
                 # Default to downloading whole playlist/album
                 track_numbers_inp = '*'
 
-            indexes_or_slices = track_num_inp_to_ind(track_numbers_inp, list_len=len(album_or_playlist_tracks))
+            track_selection = TrackSelection.parse(track_numbers_inp, list_len=len(album_or_playlist_tracks))
+            for warning in track_selection.warnings:
+                warn(warning)
 
-            if not indexes_or_slices:
+            if not track_selection:
                 raise ValueError(
-                    f"Invalid track number indentifer(s) given: '{specified_track_nums}'"
+                    f"Invalid track number indentifer(s) given: '{track_numbers_inp}'"
                 )
 
-        # Process input given for which tracks to download
-        tracks_to_dl = []
-        for index_or_slice in indexes_or_slices:
+        for track_num, track in track_selection.apply(album_or_playlist_tracks):
+
+            track_title = assemble_track_custom_title(
+                title=track.title,
+                artist=track.artist,
+                track_num=track_num,
+                template=filename_template
+            )
+
+            say(f"\t{track_num:>4}| {track_title}")
+
+            yield (track.id, track_title)
+
+        if not stream:
+            say("Press Enter to download all tracks.")
+    else:
+        say(f"\t[!] Invalid URL{f' -- {url}' if not interactive else ''}.")
+        return
+
+
+def _track_filename(track_title: str) -> str:
+    return re.sub(r'[<>:"/\|?*]', '_', f"{track_title}.mp3")
+
+
+def fetch_track(track_id: str, track_title: str, dest_dir: Path, on_progress: Callable = None) -> Path:
+    # Downloads and tags one track into dest_dir, no questions asked and nothing printed
+    with _run_metrics.track(track_id), _run_metrics.phase('track'):
+        return _fetch_track(track_id, track_title, dest_dir, on_progress)
+
+
+def _fetch_track(track_id: str, track_title: str, dest_dir: Path, on_progress: Callable = None) -> Path:
+    track_path = dest_dir/_track_filename(track_title)
+
+    # Already downloaded for another output directory, some run or other
+    if (store := _get_track_store()) and (sha256 := _place_from_store(store, track_id, track_path)):
+        get_manifest(dest_dir).record(track_id, track_path, sha256)
+        return track_path
+
+    # Grab a download link: usually prefetched while earlier tracks were
+    # downloading, otherwise a cached one while it's still fresh
+    resp_json = _take_prefetched_link(track_id) or get_track_data(track_id)
+
+    if 'link' not in resp_json or 'metadata' not in resp_json:
+        # An empty response is the API saying 'success: false' for this track
+        raise (TransientDownloadError if resp_json else PermanentDownloadError)(
+            f"Bad response for track '{track_title}' ({track_id}): {resp_json}"
+        )
+
+    # For cover art
+    if cover_art_url := resp_json['metadata'].get('cover'):
+        # Fetched once per album and shared by its tracks
+        with _run_metrics.phase('cover'):
+            cover_art = get_cover_art(cover_art_url)
+    else:
+        cover_art = None
+
+    # For audio, written in one go behind the tag
+    with _run_metrics.phase('tag'):
+        try:
+            id3_tag = build_id3_tag(resp_json['metadata'], cover_art)
+        except Exception as exc:
+            raise PermanentDownloadError(f"Could not build a tag for track '{track_title}' ({track_id}): {exc}") from exc
+
+    try:
+        try:
+            with _run_metrics.phase('audio'):
+                sha256 = _hedged_stream_to_file(track_id, resp_json['link'], track_path, id3_tag, on_progress)
+        except LinkExpiredError:
+            # Expired while it was waiting its turn; swap in a fresh one and carry
+            # on, resuming from whatever already made it into the .part file
+            _get_metadata_cache().delete('link', track_id)
+            _run_metrics.add('link_refreshes')
+
+            if 'link' not in (resp_json := get_track_data(track_id)):
+                raise
+
+            with _run_metrics.phase('audio'):
+                sha256 = _hedged_stream_to_file(track_id, resp_json['link'], track_path, id3_tag, on_progress)
+    except Exception as exc:
+        # Possibly an expired link, so don't hand the same one out again
+        _get_metadata_cache().delete('link', track_id)
+
+        raise _download_error_type(exc)(
+            f"Bad download response for track '{track_title}' ({track_id}): {exc}"
+        ) from exc
+
+    get_manifest(dest_dir).record(track_id, track_path, sha256)
+
+    if store:
+        try:
+            store.add(track_id, track_path, sha256)
+        except (OSError, sqlite3.Error):
+            # The track itself is fine, it'll just be fetched again next time
+            _run_metrics.add('store_errors')
+
+    return track_path
+
+
+def _place_from_store(store: TrackStore, track_id: str, track_path: Path):
+    with _run_metrics.phase('store'):
+        try:
+            sha256 = store.place(track_id, track_path)
+        except (OSError, sqlite3.Error):
+            _run_metrics.add('store_errors')
+            return None
+
+    if sha256:
+        _run_metrics.add('store_hits')
+
+    return sha256
+
+
+def _existing_track_path(track_id: str, track_title: str, dest_dir: Path):
+    # Where the track already is in dest_dir, or None, for a single stat():
+    # the manifest's file for it, else the one its title would get (tracks
+    # downloaded before the manifest existed).  A manifest file deleted by
+    # hand since doesn't count
+    manifest_entry = get_manifest(dest_dir).get(track_id)
+    track_path = dest_dir/(manifest_entry['path'] if manifest_entry else _track_filename(track_title))
+
+    return track_path if track_path.exists() else None
+
+
+def _record_skipped(track_id: str, track_path: Path) -> None:
+    # A duplicate that was only found by its filename (from before the
+    # manifest, or another track's with the same title) is recorded as this
+    # track's file too, so --sync knows what it's using
+    manifest = get_manifest(track_path.parent)
+    if not (manifest_entry := manifest.get(track_id)) or manifest_entry['path'] != track_path.name:
+        manifest.record(track_id, track_path, _file_sha256(track_path).hexdigest())
+
+
+def copy_track(track_id: str, source_path: Path, track_title: str, dest_dir: Path) -> Path:
+    # Another destination of a track that's already on disk, so it's copied
+    # (or linked from the store) rather than fetched again
+    track_path = dest_dir/_track_filename(track_title)
+    part_path = track_path.with_name(track_path.name + '.part')
+
+    with _run_metrics.track(track_id):
+        if (store := _get_track_store()) and (sha256 := _place_from_store(store, track_id, track_path)):
+            get_manifest(dest_dir).record(track_id, track_path, sha256)
+            return track_path
+
+        with _run_metrics.phase('copy'):
+            shutil.copyfile(source_path, part_path)
+            os.replace(part_path, track_path)
+
+    get_manifest(dest_dir).record(track_id, track_path, get_manifest(source_path.parent).get(track_id)['sha256'])
+
+    return track_path
+
+
+def download_track(
+    track_id,
+    track_title,
+    dest_dir: Path,
+    interactive: bool = False,
+    skip_duplicates: bool = False,
+    progress: str = "",
+    source_path: Path = None
+):
+    global skip_duplicate_downloads
+    global skip_duplicate_downloads_prompted
+
+    with _track_path_lock(dest_dir/_track_filename(track_title)):
+        if existing_path := _existing_track_path(track_id, track_title, dest_dir):
+            # Held through the prompt so concurrent workers wait for the user's answer
+            with skip_duplicate_downloads_lock:
+                if skip_duplicates or skip_duplicate_downloads:
+                    _print(f"{progress}Skipping download for '{track_title}'...")
+                    _record_skipped(track_id, existing_path)
+                    _drop_prefetched_link(track_id)
+                    return False
+
+                if interactive and not skip_duplicate_downloads_prompted:
+                    dup_song_inp = input(
+                        f"The song '{track_title}' was already downloaded to {dest_dir.absolute()}.\n"
+                        "  Would you like to download it again? [y/N]: "
+                    )
+
+                    if skip_this_dl := (not dup_song_inp or dup_song_inp.lower().startswith('n')):
+                        print("\nSkipping download.\n")
+                        # Prompt user if we haven't yet before skipping this one
+
+                    if not skip_duplicate_downloads_prompted:
+                        dup_all_inp = input(
+                            "  Would you like to re-download songs that have already been downloaded? [y/N]: "
+                        )
+
+                        if not dup_all_inp or dup_all_inp.lower().startswith('n'):
+                            skip_duplicate_downloads = True
+                            print("\nSkipping duplicate downloads.\n")
+                        else:
+                            skip_duplicate_downloads = False
+                            print("\nRe-downloading all tracks.\n")
+
+                        skip_duplicate_downloads_prompted = True
+
+                    if skip_this_dl:
+                        _record_skipped(track_id, existing_path)
+                        _drop_prefetched_link(track_id)
+                        return False
 
-            if index_or_slice.isnumeric():
-                tracks_to_dl.append(album_or_playlist_tracks[int(index_or_slice)])
+        try:
+            if source_path:
+                _print(f"{progress}Copying: '{track_title}' from '{source_path.parent}'...")
+                copy_track(track_id, source_path, track_title, dest_dir)
             else:
-                tracks_to_dl.extend(
-                    eval(f"album_or_playlist_tracks[{index_or_slice}]")
-                )
+                _print(f"{progress}Downloading: '{track_title}'...")
+                fetch_track(track_id, track_title, dest_dir)
+        except Exception:
+            _print(f"\t{progress}Download failed.")
+            raise
 
-        for track in sorted(tracks_to_dl, key=album_or_playlist_tracks.index):
+        _print(f"\t{progress}Done.")
 
-            track_num = album_or_playlist_tracks.index(track) + 1
+        return True
 
-            track_title = assemble_track_custom_title(
-                title=track.title,
-                artist=track.artist,
-                track_num=track_num,
-                template=filename_template
-            )
 
-            print(f"\t{track_num:>4}| {track_title}")
+def _iter_unique(items: Iterable) -> Iterator:
+    # dict.fromkeys() for iterables that can't be consumed up front
+    seen = set()
 
-            track_id_title_tuples.append((track.id, track_title))
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
 
-        print("Press Enter to download all tracks.")
-    else:
-        print(f"\t[!] Invalid URL{f' -- {url}' if not interactive else ''}.")
-        return []
 
-    return track_id_title_tuples
+def _needs_fetch(track_id: str, destinations: Iterable) -> bool:
+    # Whether a download link will probably be wanted: neither the store nor
+    # any destination's manifest knows the track.  In memory only; the worker
+    # checks the disk once it gets to the track
+    return (
+        not ((store := _get_track_store()) and store.has(track_id))
+        and not any(get_manifest(output_dir).get(track_id) for output_dir, _, _ in destinations)
+    )
 
 
-def download_track(track_id, track_title, dest_dir: Path, interactive: bool = False, skip_duplicates: bool = False):
-    track_filename = re.sub(r'[<>:"/\|?*]', '_', f"{track_title}.mp3")
+def _download_tracks(
+    work: Iterable,
+    total: str,
+    interactive: bool,
+    debug_mode: bool = False,
+    jobs: int = 1,
+    journal: JobJournal = None,
+    max_retries: int = 0,
+    on_track_done: Callable = None,
+    prefetch_links: bool = True
+) -> list:
+    # work is (track_id, destinations) pairs, a destination being an
+    # (output_dir, track_title, skip_duplicates) the track should end up at.
+    # Each track is fetched once; its other destinations get a copy.
+    # on_track_done(track_id, destinations, broken_tracks) is called from the
+    # worker as each track finishes for good.  Without prefetch_links, fetching
+    # download links ahead of time is left to whatever produces work
+    debug_lock = threading.Lock()
+
+    jobs = max(1, jobs or 1)
+    executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="spotify_dl")
+    # Failed tracks wait out their backoff here, then go back to the workers
+    retry_queue = DelayQueue()
+
+    def _submit(idx: int, track_id: str, destinations: tuple, attempt: int, track_done: Future) -> Future:
+        try:
+            return executor.submit(_download, idx, track_id, destinations, attempt, track_done)
+        except RuntimeError as exc:
+            # Shut down for Ctrl+C while a retry was waiting
+            track_done.set_exception(exc)
 
-    global skip_duplicate_downloads
-    global skip_duplicate_downloads_prompted
+    def _download(idx: int, track_id: str, destinations: tuple, attempt: int, track_done: Future):
+        try:
+            _deliver(idx, track_id, destinations, attempt, track_done)
+        except BaseException as exc:
+            # Anything unexpected (e.g. the journal failing to fsync) still has
+            # to finish the track, or the main thread waits on it forever
+            if not track_done.done():
+                track_done.set_exception(exc)
+
+    def _deliver(idx: int, track_id: str, destinations: tuple, attempt: int, track_done: Future):
+        progress = f"[{idx:>3}/{total}] "
+        # Not delivered yet; a retry picks up from these
+        pending = list(destinations)
+        downloaded_any = False
+
+        if journal and not attempt:
+            for destination in destinations:
+                output_dir, track_title, _ = destination
+
+                if journal.track_complete(track_id, output_dir):
+                    _print(f"{progress}Already done in an earlier run: '{track_title}'")
+                    pending.remove(destination)
+
+        # Destinations the manifest knows go first, so if the file is still
+        # there the others get a copy of it rather than a fetch
+        ordered = sorted(pending, key=lambda destination: get_manifest(destination[0]).get(track_id) is None)
+        # output_dir -> the track's file there, once delivered
+        delivered = {}
+
+        for destination in ordered:
+            output_dir, track_title, skip_duplicates = destination
+
+            if journal:
+                journal.record_track(track_id, output_dir, 'downloading')
+
+            try:
+                downloaded = download_track(
+                    track_id,
+                    track_title,
+                    output_dir,
+                    interactive,
+                    skip_duplicates,
+                    progress=progress,
+                    source_path=next((path for other_dir, path in delivered.items() if other_dir != output_dir), None)
+                )
+            except Exception as exc:
+                if debug_mode:
+                    with debug_lock, open('.spotify_dl_err.txt', 'a') as debug_fp:
+                        debug_fp.write(f"{datetime.now()} | {exc} :: {traceback.format_exc()}\n\n")
 
-    if (dest_dir/track_filename).exists():
-        if skip_duplicates or skip_duplicate_downloads:
-            print(f"Skipping download for '{track_title}'...")
-            return
+                if attempt < max_retries and not isinstance(exc, PermanentDownloadError):
+                    delay = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    _print(f"\t{progress}Retrying '{track_title}' in {delay:.1f}s (retry {attempt + 1} of {max_retries}).")
+                    _run_metrics.add('retries', track_id=track_id)
 
-        if interactive and not skip_duplicate_downloads_prompted:
-            dup_song_inp = input(
-                f"The song '{track_title}' was already downloaded to {dest_dir.absolute()}.\n"
-                "  Would you like to download it again? [y/N]: "
-            )
+                    retry_queue.put(delay, lambda: _submit(idx, track_id, tuple(pending), attempt + 1, track_done))
+                    return
 
-            if skip_this_dl := (not dup_song_inp or dup_song_inp.lower().startswith('n')):
-                print("\nSkipping download.\n")
-                # Prompt user if we haven't yet before skipping this one
+                if journal:
+                    for output_dir, _, _ in pending:
+                        journal.record_track(track_id, output_dir, 'failed')
 
-            if not skip_duplicate_downloads_prompted:
-                dup_all_inp = input(
-                    "  Would you like to re-download songs that have already been downloaded? [y/N]: "
-                )
+                _run_metrics.track_status(track_id, 'failed')
+                track_done.set_result([(track_id, track_title, output_dir) for output_dir, track_title, _ in pending])
+                return
 
-                if not dup_all_inp or dup_all_inp.lower().startswith('n'):
-                    skip_duplicate_downloads = True
-                    print("\nSkipping duplicate downloads.\n")
-                else:
-                    skip_duplicate_downloads = False
-                    print("\nRe-downloading all tracks.\n")
+            if journal:
+                journal.record_track(track_id, output_dir, 'tagged' if downloaded else 'skipped')
 
-                skip_duplicate_downloads_prompted = True
+            downloaded_any = downloaded_any or downloaded
+            pending.remove(destination)
 
-            if skip_this_dl:
-                return
+            if manifest_entry := get_manifest(output_dir).get(track_id):
+                delivered[output_dir] = output_dir/manifest_entry['path']
 
-    print(f"Downloading: '{track_title}'...")
-
-    # Grab a fresh download link since the one was got may have expired
-    resp_json = get_track_data(track_id)
-
-    # Clean browser heads for API
-    hdrs = {
-        #'Host': 'cdn[#].tik.live', # <-- set this below
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
-        'Accept': '*/*',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip',
-        'Referer': 'https://spotifydown.com/',
-        'Origin': 'https://spotifydown.com',
-        'DNT': '1',
-        'Connection': 'keep-alive',
-        'Sec-Fetch-Dest': 'empty',
-        'Sec-Fetch-Mode': 'cors',
-        'Sec-Fetch-Site': 'cross-site',
-        'Sec-GPC': '1'
-    }
+        _run_metrics.track_status(track_id, 'downloaded' if downloaded_any else 'skipped')
+        track_done.set_result([])
 
-    if 'link' not in resp_json or 'metadata' not in resp_json:
-        print("\tDownload failed.")
-        raise RuntimeError(
-            f"Bad response for track '{track_title}' ({track_id}): {resp_json}"
-        )
+    def _prefetching_links(work: Iterable) -> Iterator:
+        # Hands work on LINK_PREFETCH_AHEAD tracks behind fetching their
+        # download links, so the API round trip is out of the way by the time
+        # a worker gets to the track
+        lookahead = deque()
 
-    # For audio
-    hdrs['Host'] = resp_json['link'].split('/')[2]
-    audio_dl_resp = requests.get(resp_json['link'], headers=hdrs)
+        for track_id, destinations in work:
+            if journal:
+                to_deliver = [destination for destination in destinations if not journal.track_complete(track_id, destination[0])]
+            else:
+                to_deliver = destinations
 
-    if not audio_dl_resp.ok:
-        raise RuntimeError(
-            f"Bad download response for track '{track_title}' ({track_id}): {audio_dl_resp.content}"
-        )
+            if to_deliver and _needs_fetch(track_id, to_deliver):
+                prefetch_link(track_id)
 
-    with open(dest_dir/track_filename, 'wb') as track_mp3_fp:
-        track_mp3_fp.write(audio_dl_resp.content)
+            lookahead.append((track_id, destinations))
+            if len(lookahead) > LINK_PREFETCH_AHEAD:
+                yield lookahead.popleft()
 
-    # For cover art
-    if cover_art_url := resp_json['metadata'].get('cover'):
-        hdrs['Host'] = cover_art_url.split('/')[2]
-        cover_resp = requests.get(cover_art_url,headers=hdrs)
+        yield from lookahead
 
-        mp3_file = eyed3.load(dest_dir/track_filename)
-        if (mp3_file.tag == None):
-            mp3_file.initTag()
+    if prefetch_links and LINK_PREFETCH_AHEAD > 0:
+        work = _prefetching_links(work)
 
-        mp3_file.tag.images.set(ImageFrame.FRONT_COVER, cover_resp.content, 'image/jpeg')
-        mp3_file.tag.album = resp_json['metadata']['album']
-        mp3_file.tag.recording_date = resp_json['metadata']['releaseDate']
+    # Bounds how far resolution can run ahead of the download workers.  Only
+    # first attempts count; retries are already admitted
+    queue_slots = threading.BoundedSemaphore(jobs * 2)
+    # One per track, resolved with its broken_tracks entries once it's finished for good
+    tracks_done = []
 
-        # default version lets album art show up in Serato
-        #mp3_file.tag.save()
-        # version fixes FRONT_COVER not showing up in windows explorer
-        mp3_file.tag.save(version=ID3_V2_3)
+    try:
+        for idx, (track_id, destinations) in enumerate(work, start=1):
+            if journal:
+                for output_dir, track_title, _ in destinations:
+                    if not journal.track_complete(track_id, output_dir):
+                        journal.record_track(track_id, output_dir, 'resolved', title=track_title)
+
+            queue_slots.acquire()
+            track_done = Future()
+            if on_track_done:
+                track_done.add_done_callback(
+                    lambda done, track=(track_id, destinations): done.exception() or on_track_done(*track, done.result())
+                )
+            _submit(idx, track_id, destinations, 0, track_done).add_done_callback(lambda _: queue_slots.release())
+            tracks_done.append(track_done)
+
+        # Collected in submission order, so broken_tracks keeps the playlist order
+        results = [track_done.result() for track_done in tracks_done]
+    except BaseException:
+        # Ctrl+C: don't start anything new, let in-flight downloads wind down
+        retry_queue.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+        cancel_link_prefetches()
+        raise
+    retry_queue.close()
+    executor.shutdown()
+    cancel_link_prefetches()
+
+    broken_tracks = list(chain.from_iterable(results))
 
-    # prevent API throttling
-    sleep(0.1)
+    print("\nAll done.\n")
+    if broken_tracks:
+        print("[!] Some tracks failed to download.")
 
-    print("\tDone.")
+    return broken_tracks
 
 
 def download_all_tracks(
-    tracks_to_dl: list,
+    tracks_to_dl: Iterable,
     output_dir: Path,
     interactive: bool,
     skip_duplicate_downloads: bool,
-    debug_mode: bool = False
+    debug_mode: bool = False,
+    jobs: int = 1,
+    journal: JobJournal = None,
+    max_retries: int = 0
 ) -> list:
     print(f"\nDownloading to '{output_dir.absolute()}'.\n")
 
     print('-' * 32)
 
-    tracks = list(dict.fromkeys(tracks_to_dl))
-    broken_tracks = []
+    if isinstance(tracks_to_dl, list):
+        tracks = list(dict.fromkeys(tracks_to_dl))
+        total = f"{len(tracks):>3}"
+    else:
+        # Still being resolved, so how many there'll be isn't known yet
+        tracks = _iter_unique(tracks_to_dl)
+        total = "  ?"
+
+    return _download_tracks(
+        ((track_id, ((output_dir, track_title, skip_duplicate_downloads),)) for track_id, track_title in tracks),
+        total,
+        interactive,
+        debug_mode,
+        jobs,
+        journal,
+        max_retries
+    )
 
-    for idx, (track_id, track_title) in enumerate(tracks, start=1):
-        print(f"[{idx:>3}/{len(tracks):>3}]", end=' ')
-        try:
-            download_track(track_id, track_title, output_dir, interactive, skip_duplicate_downloads)
-        except Exception as exc:
-            broken_tracks.append((track_id, track_title, output_dir))
-            if debug_mode:
-                with open('.spotify_dl_err.txt', 'a') as debug_fp:
-                    debug_fp.write(f"{datetime.now()} | {exc} :: {traceback.format_exc()}\n\n")
 
-    print("\nAll done.\n")
-    if broken_tracks:
-        print("[!] Some tracks failed to download.")
+def resolve_sync(url: str, output_dir: Path, filename_template: str):
+    # Pages through the album/playlist afresh (nothing but track list requests)
+    # and compares it with what its last sync to output_dir saw.  Returns the
+    # tracks to download, the sync state key, all of its (track id, title)s now
+    # and the ids no longer in it, in their old order; or None if it can't be found
+    entity_type = "playlist" if "/playlist/" in url else "album"
+    entity_id = url.split('/')[-1].split('?')[0]
+
+    tracks = []
+    with ThreadPoolExecutor(max_workers=1 + max(0, TRACK_LIST_PREFETCH_PAGES)) as executor:
+        for page in _iter_track_list_pages(entity_id, entity_type, executor):
+            for track in page:
+                track_title = assemble_track_custom_title(
+                    title=track['title'],
+                    artist=track['artists'],
+                    track_num=len(tracks) + 1,
+                    template=filename_template
+                )
+                tracks.append((track['id'], track_title))
+
+    if not tracks:
+        return None
+
+    sync_key = f"{entity_type}/{entity_id}"
+    track_ids = {track_id for track_id, _ in tracks}
+
+    if previous := get_sync_state(output_dir).get(sync_key):
+        # Anything that failed last time is due again
+        already_synced = set(previous['tracks']).difference(previous['pending'])
+        removed = [track_id for track_id in dict.fromkeys(previous['tracks']) if track_id not in track_ids]
+    else:
+        already_synced = set()
+        removed = []
+
+    return [track for track in tracks if track[0] not in already_synced], sync_key, tracks, removed
+
+
+def plan_config_entries(loaded_config: list, jobs: int = 4, journal: JobJournal = None, sync: bool = False) -> tuple:
+    # Resolves all entries' URLs at once and merges them into one work graph of
+    # track id -> destinations (see _download_tracks), so a track wanted by
+    # several entries is fetched once.  Also returns, per entry number, the
+    # (track_id, output_dir) pairs it's waiting on, or None if it couldn't be
+    # resolved; and with sync, per synced entry, what finish_sync() needs
+    entries = {}
+    for entry_num, entry in enumerate(loaded_config):
+        if journal and journal.entry_complete(entry):
+            print(f"Already done in an earlier run: {entry['url']}")
+            continue
+
+        output_dir = set_output_dir(
+            interactive=False,
+            cli_arg_output_dir=Path(entry['output_dir']) if 'output_dir' in entry else Path.home()/"Downloads",
+            cli_arg_create_dir=entry.get('create_dir')
+        )
+        entries[entry_num] = (entry, output_dir)
+
+    def resolve(url: str, filename_template: str) -> list:
+        with _run_metrics.phase('resolve'):
+            return list(iter_input_url(url, filename_template, interactive=False, quiet=True))
+
+    def syncs_entry(entry: dict) -> bool:
+        # Whole albums/playlists only; picking track numbers out of them isn't a mirror
+        url = entry['url']
+        return sync and ("/playlist/" in url or "/album/" in url) and not MULTI_TRACK_INPUT_URL_TRACK_NUMS_RE.match(url)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs), thread_name_prefix="spotify_dl_plan") as executor:
+        # Entries with the same URL and template share one resolution (synced
+        # ones also need the same output directory)
+        resolutions = {}
+        resolution_keys = {}
+        for entry_num, (entry, output_dir) in entries.items():
+            if syncs_entry(entry):
+                resolution_key = (entry['url'], entry.get('filename_template'), output_dir.resolve())
+                resolve_args = (resolve_sync, entry['url'], output_dir, entry.get('filename_template'))
+            else:
+                resolution_key = (entry['url'], entry.get('filename_template'))
+                resolve_args = (resolve, *resolution_key)
+
+            if resolution_key not in resolutions:
+                resolutions[resolution_key] = executor.submit(*resolve_args)
+
+            resolution_keys[entry_num] = resolution_key
+
+        plan = {}
+        entry_tracks = {}
+        syncs = {}
+        for entry_num, (entry, output_dir) in entries.items():
+            try:
+                resolved = resolutions[resolution_keys[entry_num]].result()
+            except Exception as exc:
+                print(f"\t[!] Could not resolve {entry['url']}: {exc}")
+                entry_tracks[entry_num] = None
+                continue
+
+            if not resolved:
+                print(f"\t[!] Nothing found at {entry['url']}.")
+                tracks = []
+            elif syncs_entry(entry):
+                tracks, sync_key, synced_tracks, removed = resolved
+                syncs[entry_num] = (output_dir, sync_key, synced_tracks, [track_id for track_id, _ in tracks], removed)
+
+                if tracks or removed:
+                    print(f"\t{len(tracks):>4} new, {len(removed)} removed of {len(synced_tracks)} tracks in {entry['url']}")
+                else:
+                    print(f"\t   - no changes to the {len(synced_tracks)} tracks in {entry['url']}")
+            else:
+                tracks = resolved
+                print(f"\t{len(tracks):>4} tracks from {entry['url']}")
+
+            entry_tracks[entry_num] = []
+            for track_id, track_title in tracks:
+                # One copy per output directory, named by the first entry that wants it there
+                plan.setdefault(track_id, {}).setdefault(
+                    output_dir.resolve(),
+                    (output_dir, track_title, entry.get('skip_duplicate_downloads'))
+                )
+                entry_tracks[entry_num].append((track_id, output_dir))
+
+    return {track_id: tuple(destinations.values()) for track_id, destinations in plan.items()}, entry_tracks, syncs
+
+
+def finish_sync(syncs: dict, broken_tracks: list, removed_action: str = None, removed_dir: Path = None) -> None:
+    # Records what each synced album/playlist now has, then deletes ('prune')
+    # or moves ('move', to removed_dir) the files of tracks that were taken out
+    # of it, unless another synced album/playlist in the same directory still
+    # has them, or a track still in one uses the same file
+    broken = {(track_id, output_dir.resolve()) for track_id, _, output_dir in broken_tracks}
+
+    for output_dir, sync_key, synced_tracks, added_ids, _ in syncs.values():
+        pending = [track_id for track_id in added_ids if (track_id, output_dir.resolve()) in broken]
+        get_sync_state(output_dir).set(sync_key, [track_id for track_id, _ in synced_tracks], pending)
+
+    if removed_action:
+        # Filenames synced tracks have in each directory: by the manifest, and
+        # by their titles this run (e.g. a re-release under a new id that was
+        # skipped because the old one's file has the same name)
+        in_use = {}
+        for output_dir, _, synced_tracks, _, _ in syncs.values():
+            in_use.setdefault(output_dir.resolve(), set()).update(
+                _track_filename(track_title) for _, track_title in synced_tracks
+            )
+
+        for output_dir_key, filenames in in_use.items():
+            manifest = get_manifest(output_dir_key)
+            for track_id in get_sync_state(output_dir_key).all_track_ids():
+                if manifest_entry := manifest.get(track_id):
+                    filenames.add(manifest_entry['path'])
+
+        for output_dir, _, _, _, removed in syncs.values():
+            still_synced = get_sync_state(output_dir).all_track_ids()
+            manifest = get_manifest(output_dir)
+
+            for track_id in removed:
+                if track_id in still_synced or not (manifest_entry := manifest.get(track_id)):
+                    continue
+
+                if manifest_entry['path'] in in_use[output_dir.resolve()]:
+                    # The file is another track's now
+                    manifest.forget(track_id)
+                    continue
+
+                if not (track_path := output_dir/manifest_entry['path']).is_file():
+                    manifest.forget(track_id)
+                    continue
+
+                if removed_action == 'move':
+                    removed_dir.mkdir(parents=True, exist_ok=True)
+                    moved_path = Path(shutil.move(track_path, removed_dir/track_path.name))
+                    get_manifest(removed_dir).record(track_id, moved_path, manifest_entry['sha256'])
+                    print(f"Moved '{track_path.name}' to '{removed_dir}'.")
+                else:
+                    track_path.unlink()
+                    print(f"Removed '{track_path.name}'.")
+
+                manifest.forget(track_id)
+
+    for output_dir in dict.fromkeys(output_dir.resolve() for output_dir, *_ in syncs.values()):
+        get_sync_state(output_dir).save()
 
-    return broken_tracks
+
+def download_plan(
+    plan: dict,
+    interactive: bool,
+    debug_mode: bool = False,
+    jobs: int = 1,
+    journal: JobJournal = None,
+    max_retries: int = 0
+) -> list:
+    output_dirs = {output_dir.resolve() for destinations in plan.values() for output_dir, _, _ in destinations}
+    copies = sum(map(len, plan.values()))
+
+    print(f"\nDownloading {len(plan)} tracks ({copies} files) to {len(output_dirs)} directories.\n")
+
+    print('-' * 32)
+
+    return _download_tracks(plan.items(), f"{len(plan):>3}", interactive, debug_mode, jobs, journal, max_retries)
 
 
 def spotify_downloader(
@@ -550,8 +3270,27 @@ def spotify_downloader(
     create_dir: bool = None,
     skip_duplicate_downloads: bool = None,
     debug_mode: bool = None,
-    filename_template: str = r"{title} - {artist}"
+    filename_template: str = r"{title} - {artist}",
+    jobs: int = 1,
+    stream: bool = False,
+    journal: JobJournal = None,
+    max_retries: int = 0
 ):
+    if stream and not interactive:
+        # Downloads start while the URLs are still being resolved
+        output_dir = set_output_dir(interactive, output_dir, create_dir)
+
+        return download_all_tracks(
+            iter_tracks_to_download(filename_template, urls),
+            output_dir,
+            interactive,
+            skip_duplicate_downloads,
+            debug_mode,
+            jobs,
+            journal,
+            max_retries
+        )
+
     loop_prompt = True
     
     broken_tracks = []
@@ -567,7 +3306,10 @@ def spotify_downloader(
                 output_dir,
                 interactive,
                 skip_duplicate_downloads,
-                debug_mode
+                debug_mode,
+                jobs,
+                journal,
+                max_retries
             )
         )
         if not interactive:
@@ -576,8 +3318,401 @@ def spotify_downloader(
     return broken_tracks
 
 
-def parse_args():
-    parser = ArgumentParser()
+def download_config_entries(
+    loaded_config: list,
+    debug_mode: bool = False,
+    jobs: int = 1,
+    journal: JobJournal = None,
+    max_retries: int = 0,
+    sync: bool = False,
+    removed_action: str = None,
+    removed_dir: Path = None
+) -> list:
+    # Every entry is resolved before anything is downloaded, so tracks shared
+    # between entries are only fetched once
+    plan, entry_tracks, syncs = plan_config_entries(loaded_config, jobs, journal, sync)
+
+    broken_tracks = download_plan(
+        plan,
+        interactive=False,
+        debug_mode=debug_mode,
+        jobs=jobs,
+        journal=journal,
+        max_retries=max_retries
+    )
+
+    if journal:
+        broken = {(track_id, output_dir.resolve()) for track_id, _, output_dir in broken_tracks}
+        for entry_num, tracks in entry_tracks.items():
+            entry_failed = tracks is None or any((track_id, output_dir.resolve()) in broken for track_id, output_dir in tracks)
+            journal.record_entry(loaded_config[entry_num], 'failed' if entry_failed else 'done')
+
+    if syncs:
+        finish_sync(syncs, broken_tracks, removed_action, removed_dir)
+
+    return broken_tracks
+
+
+def run_worker(
+    job_queue: JobQueue,
+    skip_duplicate_downloads: bool = False,
+    debug_mode: bool = False,
+    jobs: int = 1,
+    max_retries: int = 0,
+    keep_running: bool = False
+) -> list:
+    # Downloads jobs from job_queue, marking each done or failed as it
+    # finishes, until there's nothing left that could still come its way (or,
+    # with keep_running, forever).  Any number of these can share a queue
+    import socket
+
+    worker = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+    # Job id of each (track_id, output_dir) this worker is on
+    claimed = {}
+    claimed_lock = threading.Lock()
+    stopped = threading.Event()
+
+    def heartbeat() -> None:
+        while not stopped.wait(QUEUE_HEARTBEAT):
+            try:
+                job_queue.heartbeat(worker)
+            except sqlite3.Error as exc:
+                # Shared storage hiccup; the leases have time to spare until the next beat
+                _print(f"[!] Could not renew leases: {exc}")
+
+    def claimed_work() -> Iterator:
+        while True:
+            if not (claimed_jobs := job_queue.claim(worker, max(1, jobs))):
+                if not keep_running and not job_queue.leased_elsewhere(worker):
+                    return
+
+                sleep(QUEUE_POLL_INTERVAL)
+                continue
+
+            track_jobs = {}
+            with claimed_lock:
+                for job_id, track_id, track_title, output_dir in claimed_jobs:
+                    claimed[(track_id, output_dir)] = job_id
+                    track_jobs.setdefault(track_id, []).append((output_dir, track_title, skip_duplicate_downloads))
+
+            for track_id, destinations in track_jobs.items():
+                # Jobs are claimed a batch ahead of the downloads already, so
+                # fetch their links now rather than holding tracks back for it
+                if LINK_PREFETCH_AHEAD > 0 and _needs_fetch(track_id, destinations):
+                    prefetch_link(track_id)
+
+            yield from ((track_id, tuple(destinations)) for track_id, destinations in track_jobs.items())
+
+    def track_done(track_id: str, destinations: tuple, broken_tracks: list) -> None:
+        broken_dirs = {output_dir for _, _, output_dir in broken_tracks}
+
+        with claimed_lock:
+            job_ids = {output_dir: claimed.pop((track_id, output_dir)) for output_dir, _, _ in destinations}
+
+        job_queue.finish([job_id for output_dir, job_id in job_ids.items() if output_dir not in broken_dirs], 'done')
+        job_queue.finish([job_id for output_dir, job_id in job_ids.items() if output_dir in broken_dirs], 'failed')
+
+    print(f"\nWorker '{worker}' taking jobs from the queue.\n")
+
+    print('-' * 32)
+
+    heartbeat_thread = threading.Thread(target=heartbeat, name="spotify_dl_heartbeat", daemon=True)
+    heartbeat_thread.start()
+    try:
+        return _download_tracks(
+            claimed_work(),
+            "  ?",
+            interactive=False,
+            debug_mode=debug_mode,
+            jobs=jobs,
+            max_retries=max_retries,
+            on_track_done=track_done,
+            prefetch_links=False
+        )
+    finally:
+        stopped.set()
+        # Whatever's unfinished (Ctrl+C) goes back for other workers
+        job_queue.release(worker)
+
+
+async def download(
+    urls: list,
+    output_dir: Path,
+    filename_template: str = r"{title} - {artist}",
+    jobs: int = 4,
+    skip_duplicates: bool = True,
+    max_retries: int = 0,
+    transfer_slots: 'asyncio.Semaphore' = None
+) -> AsyncIterator:
+    # Library entry point: downloads urls (same '|track_nums' syntax as the CLI) into
+    # output_dir, yielding TrackResolved/TrackStarted/TrackProgress/TrackDone/TrackFailed/UrlFailed
+    # events as it goes.  Prints nothing and never prompts.
+    #
+    #   async for event in spotify_dl.download(urls, Path("Music")):
+    #       ...
+    #
+    # Pass the same transfer_slots to several download()s on one loop to limit
+    # their downloads together rather than to jobs each
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Blocking HTTP/disk work runs here; everything else happens on the event loop
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs) + 1, thread_name_prefix="spotify_dl")
+    transfer_slots = transfer_slots or asyncio.Semaphore(max(1, jobs))
+    # Tracks waiting on a transfer slot with their download link fetched
+    # already; up to LINK_PREFETCH_AHEAD of them past the ones transferring
+    lookahead_slots = asyncio.Semaphore(max(1, jobs) + LINK_PREFETCH_AHEAD)
+    events = asyncio.Queue()
+    track_tasks = []
+
+    def emit(event) -> None:
+        # Safe from worker threads, and keeps events in the order they happened
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def fetch(track_id: str, track_title: str):
+        # Other jobs may be downloading into output_dir too
+        with _track_path_lock(output_dir/_track_filename(track_title)):
+            if skip_duplicates and (existing_path := _existing_track_path(track_id, track_title, output_dir)):
+                _record_skipped(track_id, existing_path)
+                _drop_prefetched_link(track_id)
+                return existing_path, True
+
+            track_path = fetch_track(
+                track_id,
+                track_title,
+                output_dir,
+                on_progress=lambda bytes_done, bytes_total: emit(TrackProgress(track_id, bytes_done, bytes_total))
+            )
+            return track_path, False
+
+    async def run_track(track_id: str, track_title: str) -> None:
+        async with lookahead_slots:
+            # Without skip_duplicates the manifest having the track doesn't
+            # save fetching it, so only the store is asked
+            destinations = ((output_dir, track_title, True),) if skip_duplicates else ()
+            if LINK_PREFETCH_AHEAD > 0 and _needs_fetch(track_id, destinations):
+                prefetch_link(track_id)
+
+            for attempt in range(max_retries + 1):
+                async with transfer_slots:
+                    emit(TrackStarted(track_id, track_title, attempt))
+                    try:
+                        track_path, skipped = await loop.run_in_executor(executor, fetch, track_id, track_title)
+                    except Exception as exc:
+                        will_retry = attempt < max_retries and not isinstance(exc, PermanentDownloadError)
+                        emit(TrackFailed(track_id, track_title, str(exc), will_retry))
+                        if not will_retry:
+                            _run_metrics.track_status(track_id, 'failed')
+                            return
+                        _run_metrics.add('retries', track_id=track_id)
+                    else:
+                        _run_metrics.track_status(track_id, 'skipped' if skipped else 'downloaded')
+                        emit(TrackDone(track_id, track_title, track_path, skipped))
+                        return
+
+                await asyncio.sleep(min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def start_track(track: tuple) -> None:
+        track_tasks.append(loop.create_task(run_track(*track)))
+
+    def resolve() -> None:
+        # Same dedup and ordering as the CLI; tracks start downloading as they're resolved
+        seen = set()
+        # Loaded here rather than by the first track's link prefetch check on the event loop
+        get_manifest(output_dir)
+        for url in urls:
+            found = False
+            try:
+                for track in iter_input_url(
+                    url,
+                    filename_template,
+                    interactive=False,
+                    stream=True,
+                    quiet=True,
+                    on_warning=lambda message: None
+                ):
+                    found = True
+                    if track not in seen:
+                        seen.add(track)
+                        emit(TrackResolved(*track))
+                        loop.call_soon_threadsafe(start_track, track)
+            except Exception as exc:
+                # e.g. a bad '|track_nums' or the API failing; the other URLs still run
+                emit(UrlFailed(url, str(exc)))
+                continue
+
+            if not found:
+                emit(UrlFailed(url, "Nothing found at URL"))
+
+    async def run() -> None:
+        try:
+            await loop.run_in_executor(executor, resolve)
+            # Everything resolve() scheduled has run by now
+            await asyncio.gather(*track_tasks)
+        finally:
+            emit(None)
+
+    runner = loop.create_task(run())
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+
+        # Raises whatever stopped the run early
+        await runner
+    finally:
+        runner.cancel()
+        for task in track_tasks:
+            task.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _make_serve_handler(daemon: DownloadDaemon):
+    from http.server import BaseHTTPRequestHandler
+    from urllib.parse import parse_qs, urlparse
+
+    class Handler(BaseHTTPRequestHandler):
+        # POST /jobs                  application/json {"urls": [...], "output_dir": ..., "filename_template": ...,
+        #                              "skip_duplicates": ..., "max_retries": ...}; only urls is required
+        # GET  /jobs                  status of every job the daemon remembers
+        # GET  /jobs/{id}             status of one
+        # GET  /jobs/{id}/events      its events as JSON lines, streamed until it finishes (?from=N to skip some)
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def send_json(self, obj, status: int = 200, headers: dict = None) -> None:
+            body = json.dumps(obj, default=str).encode()
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_events(self, job: ServeJob, start: int) -> None:
+            # No Content-Length: the stream ends when the connection closes
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+
+            try:
+                for event in job.iter_events(start):
+                    self.wfile.write(json.dumps(event, default=str).encode() + b'\n')
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # Client stopped watching; the job carries on
+                pass
+
+        def allowed(self) -> bool:
+            # Any web page can get a browser to send requests here.  Ones from a
+            # foreign Origin, or naming a Host other than the daemon's address
+            # (DNS rebinding), are turned away
+            bound_host = self.server.server_address[0]
+            allowed_hosts = {
+                f"{name}:{self.server.server_address[1]}"
+                for name in ('127.0.0.1', 'localhost', '[::1]', bound_host)
+            }
+            host = self.headers.get('Host', '')
+            origin = self.headers.get('Origin')
+
+            if (bound_host not in ('0.0.0.0', '::') and host not in allowed_hosts) or (origin and origin != f"http://{host}"):
+                self.send_json({'error': "Forbidden"}, 403)
+                return False
+
+            return True
+
+        def do_GET(self) -> None:
+            if not self.allowed():
+                return
+
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+
+            if parts == ['jobs']:
+                return self.send_json({'jobs': [job.status() for job in daemon.jobs()]})
+
+            if len(parts) not in (2, 3) or parts[0] != 'jobs' or not (job := daemon.job(parts[1])):
+                return self.send_json({'error': "No such job"}, 404)
+
+            if len(parts) == 2:
+                return self.send_json(job.status())
+
+            if parts[2] == 'events':
+                start = parse_qs(url.query).get('from', ['0'])[0]
+                return self.send_events(job, int(start) if start.isdigit() else 0)
+
+            self.send_json({'error': "Not found"}, 404)
+
+        def do_POST(self) -> None:
+            if not self.allowed():
+                return
+
+            if urlparse(self.path).path.strip('/') != 'jobs':
+                return self.send_json({'error': "Not found"}, 404)
+
+            # Unlike text/plain or form posts, a browser won't send JSON cross-origin without asking first
+            if self.headers.get_content_type() != 'application/json':
+                return self.send_json({'error': "Jobs must be posted as application/json"}, 415)
+
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                urls = request['urls']
+                if isinstance(urls, str):
+                    urls = [urls]
+                if not urls or not all(isinstance(url, str) for url in urls):
+                    raise ValueError("'urls' must be a URL or a list of them")
+
+                job = daemon.submit(
+                    urls,
+                    Path(request.get('output_dir') or Path.home()/"Downloads").absolute(),
+                    filename_template=request.get('filename_template') or r"{title} - {artist}",
+                    skip_duplicates=bool(request.get('skip_duplicates', True)),
+                    max_retries=int(request.get('max_retries', 0))
+                )
+            except (KeyError, TypeError, ValueError) as exc:
+                return self.send_json({'error': f"Invalid job: {exc!r}"}, 400)
+
+            self.send_json(job.status(), 202, {'Location': f"/jobs/{job.id}"})
+
+    return Handler
+
+
+def serve(address: str = SERVE_ADDRESS, jobs: int = 4) -> None:
+    # Runs the --serve daemon until Ctrl+C
+    from http.server import ThreadingHTTPServer
+
+    host, _, port = address.rpartition(':')
+    daemon = DownloadDaemon(max_transfers=jobs)
+    # Runs for days; per-track metrics would otherwise pile up forever
+    _run_metrics.max_tracks = SERVE_METRICS_TRACKS
+
+    httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), _make_serve_handler(daemon))
+    httpd.daemon_threads = True
+
+    print(f"Serving the job API at http://{host or '127.0.0.1'}:{httpd.server_address[1]}/jobs, "
+          f"{daemon.max_transfers} downloads at a time across all jobs.  Ctrl+C to stop.\n")
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        daemon.close()
+
+
+def parse_args(argv: list = None):
+    parser = ArgumentParser(
+        epilog="Commands: 'spotify_dl enqueue [-u URLS -o DIR | -k CONFIG] --queue QUEUE' adds the tracks to a shared "
+               "job queue instead of downloading them (or, without URLs, shows what's in it).  "
+               "'spotify_dl worker --queue QUEUE' downloads tracks from it until it's drained; run as many workers "
+               "as you like, on any host that sees the queue and output directories at the same paths."
+    )
 
     parser.add_argument(
         '-u',
@@ -586,7 +3721,7 @@ def parse_args():
         help="URL(s) of Sptofy songs or playlists to download.  "
             "If a playlist is given, append \"|[TRACK NUMBERS]\" to URL to specify which tracks to download. "
             "Example: 'https://open.spotify.com/playlist/mYpl4YLi5T|1,4,15-' to download the first, fourth, "
-            "and fifteenth to the end. If not specified, all tracks are downloaded."
+            "and fifteenth to the end, or '|-3-' for the last three. If not specified, all tracks are downloaded."
     )
     parser.add_argument(
         '-f',
@@ -621,10 +3756,171 @@ def parse_args():
         type=Path,
         help="Path to JSON containing download instructions."
     )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=4,
+        help="Number of tracks to download at the same time."
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        default=False,
+        help="Start downloading tracks while the given URLs are still being resolved.  "
+             "Config files are always resolved up front, all entries at once."
+    )
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        default=False,
+        help="Mirror whole albums/playlists: only download tracks added since the last --sync to the same "
+             "output directory (where each one's track list is kept).  Unchanged ones cost just their track list requests."
+    )
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        default=False,
+        help="With --sync, delete downloaded tracks that were taken out of their album/playlist."
+    )
+    parser.add_argument(
+        '--move-removed',
+        type=Path,
+        help="With --sync, move downloaded tracks that were taken out of their album/playlist to this directory."
+    )
+    parser.add_argument(
+        '--serve',
+        nargs='?',
+        const=SERVE_ADDRESS,
+        metavar='[HOST:]PORT',
+        help=f"Run as a daemon taking download jobs over a local HTTP/JSON API (default {SERVE_ADDRESS}), "
+             "POST /jobs to submit URLs, GET /jobs/ID for status and /jobs/ID/events to follow along.  "
+             "Caches and connections stay warm between jobs; -j limits downloads across all of them."
+    )
+    parser.add_argument(
+        '--store',
+        type=Path,
+        default=STORE_DIR,
+        help="Also keep every downloaded track once in this content-addressed store, and hardlink (or copy) "
+             "tracks already in it into output directories instead of downloading them.  "
+             "'spotify_dl gc --store DIR' removes tracks no output directory has any more.  "
+             "Hardlinked copies share their tags, so editing one edits them all."
+    )
+    parser.add_argument(
+        '--queue',
+        type=Path,
+        default=JOB_QUEUE_PATH,
+        help="Job queue (an SQLite file) of the 'enqueue' and 'worker' commands."
+    )
+    parser.add_argument(
+        '--keep-running',
+        action='store_true',
+        default=False,
+        help="With 'worker', keep waiting for new jobs once the queue is drained."
+    )
+    parser.add_argument(
+        '--link-prefetch',
+        type=int,
+        default=LINK_PREFETCH_AHEAD,
+        help="How many tracks ahead of the downloads to fetch download links (0 to only fetch them when needed)."
+    )
+    parser.add_argument(
+        '--api-connections',
+        type=int,
+        default=MAX_API_CONNECTIONS,
+        help="Maximum simultaneous (and pooled) connections to the downloader API."
+    )
+    parser.add_argument(
+        '--cdn-connections',
+        type=int,
+        default=MAX_CDN_CONNECTIONS_PER_HOST,
+        help="Maximum simultaneous (and pooled) connections to each CDN host serving audio and cover art."
+    )
+    parser.add_argument(
+        '--api-rate',
+        type=float,
+        default=API_RATE_LIMIT,
+        help="Maximum requests per second to the downloader API.  Lowered automatically when throttled."
+    )
+    parser.add_argument(
+        '--cdn-rate',
+        type=float,
+        default=CDN_RATE_LIMIT,
+        help="Maximum requests per second to each CDN host.  Lowered automatically when throttled."
+    )
+    parser.add_argument(
+        '--max-bandwidth',
+        type=float,
+        default=MAX_BANDWIDTH,
+        help="Cap on the audio download rate in bytes per second, across all downloads (e.g. 2e6 for ~2 MB/s)."
+    )
+    parser.add_argument(
+        '--connect-timeout',
+        type=float,
+        default=CONNECT_TIMEOUT,
+        help="Seconds to wait for a connection to be established before giving up."
+    )
+    parser.add_argument(
+        '--read-timeout',
+        type=float,
+        default=READ_TIMEOUT,
+        help="Seconds to wait between bytes received from the server before giving up."
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        default=False,
+        help=f"Don't read or write the metadata cache at '{CACHE_PATH}' (metadata is still only fetched once per run)."
+    )
+    parser.add_argument(
+        '--refresh',
+        action='store_true',
+        default=False,
+        help="Ignore metadata and download links cached by earlier runs, re-fetching (and re-caching) everything."
+    )
+    parser.add_argument(
+        '--cover-cache-dir',
+        type=Path,
+        help="Directory to keep downloaded cover art in between runs, up to "
+            f"{COVER_CACHE_DISK_MAX_BYTES // 1024 // 1024} MB (least recently used removed first).  "
+            "Only kept in memory if not given."
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        default=False,
+        help="With a config file, pick up where an interrupted run of it left off, "
+            "skipping entries and tracks that already finished."
+    )
+    parser.add_argument(
+        '--rebuild-index',
+        action='store_true',
+        default=False,
+        help=f"Recreate the '{MANIFEST_FILENAME}' duplicate index of each output directory from the "
+            "tags of the MP3s in it before downloading.  URLs are optional with this."
+    )
     parser.add_argument(
         '--retry-failed-downloads',
         type=int,
-        help="Number of times to retry failed downloads."
+        help="Number of times to retry each failed download, backing off exponentially between attempts."
+    )
+    parser.add_argument(
+        '--metrics-json',
+        type=Path,
+        default=METRICS_PATH,
+        help="Where to write per-phase timings, bytes and retries of this run as JSON."
+    )
+    parser.add_argument(
+        '--metrics-prometheus',
+        type=Path,
+        help="Also write the run's metrics to this Prometheus textfile (for node_exporter's textfile collector)."
+    )
+    parser.add_argument(
+        '--profile',
+        type=Path,
+        nargs='?',
+        const=Path("spotify_dl.prof"),
+        help="Profile the run with cProfile and dump the stats here (default 'spotify_dl.prof'), for pstats/snakeviz."
     )
     parser.add_argument(
         '--debug',
@@ -633,10 +3929,13 @@ def parse_args():
         help="Debug mode."
     )
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def main():
+    # Cheeky Ctrl+C handler.  Only for the CLI: embedding code keeps its own
+    signal.signal(signal.SIGINT, lambda sig, frame : print('\n\nInterrupt received. Exiting.\n') or sys.exit(0))
+
     print('', '=' * 48, '||          Spotify Song Downloader           ||', '=' * 48, sep='\n', end='\n\n')
 
     # # Grab token anyway
@@ -654,50 +3953,182 @@ def main():
             output_dir=None,
             urls=None,
             create_dir=None,
-            debug_mode=None
+            debug_mode=None,
+            max_retries=INTERACTIVE_RETRIES
         )
 
     else:
         # CLI mode
         interactive = False
 
-        args = parse_args()
+        # 'enqueue'/'worker'/'gc' come before any options
+        command = sys.argv[1] if sys.argv[1] in COMMANDS else None
+        args = parse_args(sys.argv[2:] if command else None)
+
+        global MAX_API_CONNECTIONS, MAX_CDN_CONNECTIONS_PER_HOST, CONNECT_TIMEOUT, READ_TIMEOUT
+        MAX_API_CONNECTIONS = args.api_connections
+        MAX_CDN_CONNECTIONS_PER_HOST = args.cdn_connections
+        CONNECT_TIMEOUT = args.connect_timeout
+        READ_TIMEOUT = args.read_timeout
+
+        global API_RATE_LIMIT, CDN_RATE_LIMIT, MAX_BANDWIDTH
+        API_RATE_LIMIT = args.api_rate
+        CDN_RATE_LIMIT = args.cdn_rate
+        MAX_BANDWIDTH = args.max_bandwidth
+
+        global CACHE_ENABLED, CACHE_REFRESH
+        CACHE_ENABLED = not args.no_cache
+        CACHE_REFRESH = args.refresh
+
+        global COVER_CACHE_DIR
+        COVER_CACHE_DIR = args.cover_cache_dir
+
+        global LINK_PREFETCH_AHEAD
+        LINK_PREFETCH_AHEAD = args.link_prefetch
+
+        global STORE_DIR
+        STORE_DIR = args.store
+
+        if args.prune and args.move_removed:
+            raise ValueError("Only one of '--prune' and '--move-removed' can be given")
+
+        if args.prune:
+            removed_action = 'prune'
+        elif args.move_removed:
+            removed_action = 'move'
+        else:
+            removed_action = None
+
+        global METRICS_PATH, METRICS_PROMETHEUS_PATH
+        METRICS_PATH = args.metrics_json
+        METRICS_PROMETHEUS_PATH = args.metrics_prometheus
+
+        profilers = args.profile and _start_profiling()
+
+        if args.rebuild_index:
+            if args.config_file:
+                index_dirs = dict.fromkeys(
+                    Path(entry['output_dir']) if 'output_dir' in entry else Path.home()/"Downloads"
+                    for entry in validate_config_file(args.config_file)
+                )
+            else:
+                index_dirs = [args.output]
+
+            for index_dir in index_dirs:
+                if index_dir.is_dir():
+                    print(f"Indexed {rebuild_manifest(index_dir, args.jobs)} tracks in '{index_dir}'.")
+
+        if args.serve:
+            serve(args.serve, args.jobs)
+            broken_tracks = []
+
+        elif command == 'gc':
+            if not (store := _get_track_store()):
+                raise ValueError("'gc' needs the store to collect given with '--store'")
+
+            removed, freed = store.gc()
+            print(f"Removed {removed} unreferenced tracks ({freed / 1024 / 1024:.1f} MB) from '{STORE_DIR}'.")
+            broken_tracks = []
+
+        elif command:
+            job_queue = JobQueue(args.queue)
+            try:
+                if command == 'worker':
+                    broken_tracks = run_worker(
+                        job_queue,
+                        skip_duplicate_downloads=args.skip_duplicate_downloads,
+                        debug_mode=args.debug,
+                        jobs=args.jobs,
+                        max_retries=args.retry_failed_downloads or 0,
+                        keep_running=args.keep_running
+                    )
+                else:
+                    broken_tracks = []
+
+                    if args.config_file:
+                        plan, _, _ = plan_config_entries(validate_config_file(args.config_file), args.jobs)
+                        tracks = [
+                            (track_id, track_title, output_dir)
+                            for track_id, destinations in plan.items()
+                            for output_dir, track_title, _ in destinations
+                        ]
+                    elif args.urls:
+                        output_dir = set_output_dir(interactive, args.output, args.create_dir)
+                        tracks = [
+                            (track_id, track_title, output_dir)
+                            for track_id, track_title in dict.fromkeys(iter_tracks_to_download(args.filename, args.urls))
+                        ]
+                    else:
+                        tracks = []
+
+                    if tracks:
+                        print(f"Queued {job_queue.enqueue(tracks)} of {len(tracks)} tracks in '{args.queue}'.")
 
-        if not (config_file := args.config_file):
+                    print("Jobs:", ', '.join(f"{count} {state}" for state, count in sorted(job_queue.counts().items())) or "none")
+            finally:
+                job_queue.close()
 
-            if not (urls := args.urls):
+        elif not (config_file := args.config_file):
+
+            if not (urls := args.urls) and not args.rebuild_index:
                 raise ValueError(
                     "The '-u'/'--urls' argument must be "
                     "supplied if not using a config file"
                 )
 
-            broken_tracks = spotify_downloader(
-                interactive=interactive,
-                output_dir=args.output,
-                urls=urls,
-                create_dir=args.create_dir,
-                skip_duplicate_downloads=args.skip_duplicate_downloads,
-                debug_mode=args.debug,
-                filename_template=args.filename
-            )
+            if urls and args.sync:
+                print(f"Syncing {len(urls)} URLs...")
+                broken_tracks = download_config_entries(
+                    [
+                        {
+                            'url': url,
+                            'output_dir': args.output,
+                            'create_dir': args.create_dir,
+                            'skip_duplicate_downloads': args.skip_duplicate_downloads,
+                            'filename_template': args.filename
+                        }
+                        for url in urls
+                    ],
+                    debug_mode=args.debug,
+                    jobs=args.jobs,
+                    max_retries=args.retry_failed_downloads or 0,
+                    sync=True,
+                    removed_action=removed_action,
+                    removed_dir=args.move_removed
+                )
+            else:
+                broken_tracks = urls and spotify_downloader(
+                    interactive=interactive,
+                    output_dir=args.output,
+                    urls=urls,
+                    create_dir=args.create_dir,
+                    skip_duplicate_downloads=args.skip_duplicate_downloads,
+                    debug_mode=args.debug,
+                    filename_template=args.filename,
+                    jobs=args.jobs,
+                    stream=args.stream,
+                    max_retries=args.retry_failed_downloads or 0
+                )
 
         else:
             loaded_config = validate_config_file(config_file)
 
-            broken_tracks = []
-
-            for entry in loaded_config:
-                broken_tracks.extend(
-                    spotify_downloader(
-                        interactive=interactive,
-                        output_dir=Path(entry['output_dir']) if 'output_dir' in entry else Path.home()/"Downloads",
-                        urls=[entry['url']],
-                        create_dir=entry.get('create_dir'),
-                        skip_duplicate_downloads=entry.get('skip_duplicate_downloads'),
-                        debug_mode=args.debug,
-                        filename_template=entry.get('filename_template')
-                    )
+            journal = JobJournal.for_config_file(config_file, resume=args.resume)
+            try:
+                print(f"{'Syncing' if args.sync else 'Resolving'} {len(loaded_config)} config entries...")
+                broken_tracks = download_config_entries(
+                    loaded_config,
+                    debug_mode=args.debug,
+                    jobs=args.jobs,
+                    journal=journal,
+                    max_retries=args.retry_failed_downloads or 0,
+                    sync=args.sync,
+                    removed_action=removed_action,
+                    removed_dir=args.move_removed
                 )
+            finally:
+                # Also on Ctrl+C, so --resume knows how far this run got
+                journal.close()
 
     if broken_tracks:
         nl = '\n'
@@ -706,29 +4137,36 @@ def main():
             f"  * {f'{nl}  * '.join(t_title for t_id, t_title, out_dir in broken_tracks)}\n"
         )
 
-        if not interactive:
-            num_retries = args.retry_failed_downloads or 0
-        else:
-            print("Retrying...")
-            num_retries = 5
-            for i in range(num_retries):
-                print(f"Attempt {i + 1} of {num_retries}") 
-                for track_id, track_title, output_dir in broken_tracks.copy():
-                    try:
-                        download_track(track_id, track_title, output_dir)
-                    except Exception:
-                        continue
-                    else:
-                        broken_tracks.remove((track_id, track_title, output_dir))
-                sleep(1)
-
         if interactive:
             input("\nPress [ENTER] to exit.\n")
 
-    # Give a chance to see the messages if running via executable
-    sleep(1)
-    print("\nExiting...\n")
-    sleep(3)
+    if metadata_cache_error:
+        print(f"[!] Metadata cache unavailable, ran without it: {metadata_cache_error}")
+
+    if (rate_limit_lines := rate_limit_summary()) and (interactive or args.debug):
+        print("Rate limiting:", *rate_limit_lines, sep='\n  ')
+
+    if not interactive and args.debug and (phase_lines := _run_metrics.summary_lines()):
+        print("Time by phase:", *phase_lines, sep='\n  ')
+
+    write_run_metrics()
+
+    if not interactive and profilers:
+        _dump_profile(profilers, args.profile)
+        print(f"Profile written to '{args.profile}'.")
+
+    if _metadata_cache:
+        _metadata_cache.close()
+
+    if _track_store:
+        _track_store.close()
+
+    # Give a chance to see the messages if running via executable (e.g.
+    # double-clicked, so the window closes on exit); scripts and cron don't wait
+    if interactive or getattr(sys, 'frozen', False):
+        sleep(1)
+        print("\nExiting...\n")
+        sleep(3)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent/"bench"))
+
+import spotify_dl
+from stand_in_server import StandInServer
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    # The stand-in API and CDN, with nothing left over from other tests:
+    # no on-disk cache, manifests or sync state read from earlier ones
+    with StandInServer() as server:
+        monkeypatch.setattr(spotify_dl, 'DOWNLOADER_URL', server.api_url)
+        monkeypatch.setattr(spotify_dl, 'API_RATE_LIMIT', 1000.0)
+        monkeypatch.setattr(spotify_dl, 'CACHE_ENABLED', False)
+        monkeypatch.setattr(spotify_dl, '_metadata_cache', None)
+        monkeypatch.setattr(spotify_dl, '_cover_art_cache', None)
+        monkeypatch.setattr(spotify_dl, '_manifests', {})
+        monkeypatch.setattr(spotify_dl, '_sync_states', {})
+        monkeypatch.setattr(spotify_dl, '_rate_limiters', {})
+
+        yield server
@@ -0,0 +1,28 @@
+import os
+
+import spotify_dl
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = spotify_dl.CoverArtCache(max_bytes=0, cache_dir=tmp_path, max_disk_bytes=400)
+    fetched = []
+
+    def fetch(url: str) -> bytes:
+        fetched.append(url)
+        return b"x" * 100
+
+    for num in range(4):
+        cache.get(f"https://example.com/{num}.jpg", fetch)
+        # mtimes a second apart, oldest first
+        os.utime(cache._disk_path(f"https://example.com/{num}.jpg"), (num, num))
+
+    # Used again, so no longer the least recently used
+    cache.get("https://example.com/0.jpg", fetch)
+    assert fetched == [f"https://example.com/{num}.jpg" for num in range(4)]
+
+    # Over budget: down to 3/4 of it, oldest first
+    cache.get("https://example.com/4.jpg", fetch)
+    assert sorted(path.name for path in tmp_path.glob('*.jpg')) == sorted(
+        cache._disk_path(f"https://example.com/{num}.jpg").name for num in (0, 4, 3)
+    )
+    assert cache._disk_size == 300
@@ -0,0 +1,37 @@
+import pytest
+import requests
+
+import spotify_dl
+
+
+class FakeResponse:
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+
+@pytest.mark.parametrize("status_code, error_type", [
+    (403, spotify_dl.LinkExpiredError),
+    (410, spotify_dl.LinkExpiredError),
+    (429, spotify_dl.TransientDownloadError),
+    (503, spotify_dl.TransientDownloadError),
+    (404, spotify_dl.PermanentDownloadError),
+    (400, spotify_dl.PermanentDownloadError),
+])
+def test_bad_responses(status_code, error_type):
+    with pytest.raises(error_type):
+        spotify_dl._check_download_response(FakeResponse(status_code), "https://example.com/t.mp3")
+
+
+@pytest.mark.parametrize("exc, error_type", [
+    (requests.ConnectionError("reset"), spotify_dl.TransientDownloadError),
+    (requests.exceptions.ChunkedEncodingError("short"), spotify_dl.TransientDownloadError),
+    (TimeoutError("timed out"), spotify_dl.TransientDownloadError),
+    (spotify_dl.TransferStalledError("stalled"), spotify_dl.TransientDownloadError),
+    (spotify_dl.LinkExpiredError("expired"), spotify_dl.TransientDownloadError),
+    (OSError(28, "No space left on device"), spotify_dl.PermanentDownloadError),
+    (spotify_dl.PermanentDownloadError("404"), spotify_dl.PermanentDownloadError),
+    (ValueError("can't encode tag"), spotify_dl.PermanentDownloadError),
+])
+def test_download_error_types(exc, error_type):
+    assert spotify_dl._download_error_type(exc) is error_type
@@ -0,0 +1,78 @@
+import threading
+
+import spotify_dl
+
+
+class FailingJournal:
+    # Can't write its records, e.g. the disk filled up
+
+    def track_complete(self, track_id, output_dir) -> bool:
+        return False
+
+    def record_track(self, track_id, output_dir, state, title=None) -> None:
+        if state != 'resolved':
+            raise OSError(28, "No space left on device")
+
+
+def test_unexpected_worker_error_fails_the_run_instead_of_hanging(tmp_path):
+    outcome = {}
+
+    def run():
+        try:
+            spotify_dl._download_tracks(
+                [("track1", ((tmp_path, "Track 1", True),))],
+                "  1",
+                interactive=False,
+                journal=FailingJournal(),
+                prefetch_links=False
+            )
+        except BaseException as exc:
+            outcome['error'] = exc
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    runner.join(timeout=10)
+
+    assert not runner.is_alive(), "_download_tracks hung on a failed track"
+    assert isinstance(outcome.get('error'), OSError)
+
+
+def test_tracks_with_the_same_filename_do_not_share_a_part_file(stand_in, tmp_path):
+    # Slow enough for the two downloads to overlap without the path lock
+    stand_in.audio_size = 64 * 1024
+    stand_in.bandwidth = 128 * 1024
+    destination = (tmp_path, "Song 1 - Stand-in Artist", True)
+
+    broken_tracks = spotify_dl._download_tracks(
+        [("pl3t1", (destination,)), ("al3t1", (destination,))],
+        "  2",
+        interactive=False,
+        jobs=2
+    )
+
+    assert broken_tracks == []
+    assert [path.name for path in tmp_path.iterdir() if path.suffix != '.jsonl'] == ["Song 1 - Stand-in Artist.mp3"]
+
+    sha256 = spotify_dl._file_sha256(tmp_path/"Song 1 - Stand-in Artist.mp3").hexdigest()
+    manifest = spotify_dl.get_manifest(tmp_path)
+    assert manifest.get("pl3t1")['sha256'] == manifest.get("al3t1")['sha256'] == sha256
+
+
+def test_a_track_already_in_one_destination_is_copied_to_the_others(stand_in, tmp_path):
+    have_dir, want_dir = tmp_path/"have", tmp_path/"want"
+    have_dir.mkdir()
+    want_dir.mkdir()
+    spotify_dl._download_tracks([("pl3t1", ((have_dir, "Song 1", True),))], "  1", interactive=False)
+    stand_in.reset_counts()
+
+    # The destination that has it comes second, but is checked first
+    broken_tracks = spotify_dl._download_tracks(
+        [("pl3t1", ((want_dir, "Song 1", True), (have_dir, "Song 1", True)))],
+        "  1",
+        interactive=False
+    )
+
+    assert broken_tracks == []
+    assert stand_in.request_counts['download'] == stand_in.request_counts['cdn'] == 0
+    assert (want_dir/"Song 1.mp3").read_bytes() == (have_dir/"Song 1.mp3").read_bytes()
+    assert spotify_dl.get_manifest(want_dir).get("pl3t1")['sha256'] == spotify_dl.get_manifest(have_dir).get("pl3t1")['sha256']
@@ -0,0 +1,41 @@
+import spotify_dl
+
+
+def test_entries_are_recognised_after_the_config_is_reordered(tmp_path):
+    first = {'url': "https://open.spotify.com/album/a", 'output_dir': str(tmp_path/"a")}
+    second = {'url': "https://open.spotify.com/album/b", 'output_dir': str(tmp_path/"b")}
+
+    journal = spotify_dl.JobJournal(tmp_path/"journal.jsonl")
+    journal.record_entry(first, 'done')
+    journal.record_entry(second, 'failed')
+    journal.close()
+
+    # An entry inserted at the top shifts every index
+    inserted = {'url': "https://open.spotify.com/album/new", 'output_dir': str(tmp_path/"a")}
+    journal = spotify_dl.JobJournal(tmp_path/"journal.jsonl", resume=True)
+    assert [journal.entry_complete(entry) for entry in (inserted, first, second)] == [False, True, False]
+    journal.close()
+
+
+def test_same_url_in_another_directory_or_template_is_another_entry(tmp_path):
+    entry = {'url': "https://open.spotify.com/album/a", 'output_dir': str(tmp_path/"a")}
+
+    journal = spotify_dl.JobJournal(tmp_path/"journal.jsonl")
+    journal.record_entry(entry, 'done')
+
+    assert journal.entry_complete(dict(entry))
+    assert not journal.entry_complete({**entry, 'output_dir': str(tmp_path/"b")})
+    assert not journal.entry_complete({**entry, 'filename_template': "{title}"})
+    journal.close()
+
+
+def test_skipped_and_tagged_tracks_are_complete(tmp_path):
+    journal = spotify_dl.JobJournal(tmp_path/"journal.jsonl")
+    journal.record_track("t1", tmp_path, 'skipped')
+    journal.record_track("t2", tmp_path, 'tagged')
+    journal.record_track("t3", tmp_path, 'downloading')
+    journal.close()
+
+    journal = spotify_dl.JobJournal(tmp_path/"journal.jsonl", resume=True)
+    assert [journal.track_complete(track_id, tmp_path) for track_id in ("t1", "t2", "t3")] == [True, True, False]
+    journal.close()
@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+
+import spotify_dl
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Lease times go by this rather than the wall clock
+    now = [1000.0]
+    monkeypatch.setattr(spotify_dl, 'time', lambda: now[0])
+    return now
+
+
+def queued_jobs(tmp_path, num_tracks: int, dirs: tuple = ("a",)) -> list:
+    return [(f"t{num}", f"Track {num}", tmp_path/dir_name) for num in range(num_tracks) for dir_name in dirs]
+
+
+def test_claims_all_of_a_tracks_jobs_together(tmp_path, clock):
+    queue = spotify_dl.JobQueue(None)
+    assert queue.enqueue(queued_jobs(tmp_path, 3, dirs=("a", "b"))) == 6
+
+    claimed = queue.claim("w1", max_tracks=2)
+
+    assert [(track_id, output_dir.name) for _, track_id, _, output_dir in claimed] == [
+        ("t0", "a"), ("t0", "b"), ("t1", "a"), ("t1", "b")
+    ]
+    assert [track_id for _, track_id, _, _ in queue.claim("w2", max_tracks=2)] == ["t2", "t2"]
+    assert queue.claim("w3", max_tracks=2) == []
+    assert queue.counts() == {'leased': 6}
+
+
+def test_enqueue_leaves_live_jobs_alone_and_requeues_failed_ones(tmp_path, clock):
+    queue = spotify_dl.JobQueue(None)
+    queue.enqueue(queued_jobs(tmp_path, 3))
+    (done_id, *_), (failed_id, *_) = queue.claim("w1", max_tracks=2)
+    queue.finish([done_id], 'done')
+    queue.finish([failed_id], 'failed')
+
+    assert queue.enqueue(queued_jobs(tmp_path, 3)) == 1
+    assert queue.counts() == {'done': 1, 'queued': 2}
+
+
+def test_expired_leases_go_back_to_the_queue(tmp_path, clock):
+    queue = spotify_dl.JobQueue(None)
+    queue.enqueue(queued_jobs(tmp_path, 1))
+    queue.claim("dead", max_tracks=1)
+
+    clock[0] += spotify_dl.QUEUE_LEASE - 1
+    assert queue.claim("w2", max_tracks=1) == []
+
+    clock[0] += 2
+    assert [track_id for _, track_id, _, _ in queue.claim("w2", max_tracks=1)] == ["t0"]
+
+
+def test_heartbeat_keeps_a_lease(tmp_path, clock):
+    queue = spotify_dl.JobQueue(None)
+    queue.enqueue(queued_jobs(tmp_path, 1))
+    queue.claim("w1", max_tracks=1)
+
+    for _ in range(5):
+        clock[0] += spotify_dl.QUEUE_HEARTBEAT
+        queue.heartbeat("w1")
+
+    assert queue.claim("w2", max_tracks=1) == []
+    assert queue.leased_elsewhere("w2") == 1
+
+
+def test_job_fails_after_max_leases(tmp_path, clock):
+    queue = spotify_dl.JobQueue(None)
+    queue.enqueue(queued_jobs(tmp_path, 1))
+
+    for lease in range(spotify_dl.QUEUE_MAX_LEASES):
+        assert len(queue.claim(f"w{lease}", max_tracks=1)) == 1
+        clock[0] += spotify_dl.QUEUE_LEASE + 1
+
+    assert queue.claim("last", max_tracks=1) == []
+    assert queue.counts() == {'failed': 1}
+
+
+def test_release_hands_jobs_back_without_using_up_a_lease(tmp_path, clock):
+    queue = spotify_dl.JobQueue(None)
+    queue.enqueue(queued_jobs(tmp_path, 1))
+
+    # Stopped with Ctrl+C far more often than a job may be lost
+    for _ in range(spotify_dl.QUEUE_MAX_LEASES * 2):
+        assert len(queue.claim("w1", max_tracks=1)) == 1
+        queue.release("w1")
+
+    assert queue.counts() == {'queued': 1}
+    queue.claim("dead", max_tracks=1)
+    clock[0] += spotify_dl.QUEUE_LEASE + 1
+    assert len(queue.claim("w2", max_tracks=1)) == 1
+
+
+@pytest.mark.parametrize("shared_file", [False, True])
+def test_concurrent_claims_never_share_a_job(tmp_path, shared_file):
+    path = tmp_path/"queue.sqlite3" if shared_file else None
+    queue = spotify_dl.JobQueue(path)
+    queue.enqueue(queued_jobs(tmp_path, 200))
+    claimed = {}
+
+    def work(worker: str) -> None:
+        # Separate connections to one file, like workers on different hosts
+        worker_queue = spotify_dl.JobQueue(path) if shared_file else queue
+        claimed[worker] = []
+        while jobs := worker_queue.claim(worker, max_tracks=3):
+            claimed[worker].extend(job_id for job_id, _, _, _ in jobs)
+
+    workers = [threading.Thread(target=work, args=(f"w{num}",)) for num in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    job_ids = [job_id for worker_jobs in claimed.values() for job_id in worker_jobs]
+    assert len(job_ids) == len(set(job_ids)) == 200
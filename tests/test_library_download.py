@@ -0,0 +1,75 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import spotify_dl
+
+SRC_DIR = Path(__file__).resolve().parent.parent/"src"
+
+
+def test_one_bad_url_does_not_stop_the_others(tmp_path, monkeypatch, capsys):
+    def iter_input_url(url, filename_template, interactive, stream=False, quiet=False, on_warning=None):
+        if url == "bad":
+            raise ValueError("Invalid track number indentifer(s) given: '40'")
+        return iter(())
+
+    monkeypatch.setattr(spotify_dl, 'iter_input_url', iter_input_url)
+
+    async def collect() -> list:
+        return [event async for event in spotify_dl.download(["bad", "empty"], tmp_path)]
+
+    assert asyncio.run(collect()) == [
+        spotify_dl.UrlFailed("bad", "Invalid track number indentifer(s) given: '40'"),
+        spotify_dl.UrlFailed("empty", "Nothing found at URL"),
+    ]
+    assert capsys.readouterr().out == ""
+
+
+def test_downloads_print_nothing(stand_in, tmp_path, capsys):
+    async def collect() -> list:
+        return [event async for event in spotify_dl.download(["https://open.spotify.com/album/al2"], tmp_path)]
+
+    events = asyncio.run(collect())
+
+    assert sorted(event.track_id for event in events if isinstance(event, spotify_dl.TrackDone)) == ["al2t0", "al2t1"]
+    assert capsys.readouterr().out == ""
+
+
+def test_download_links_are_fetched_ahead(stand_in, tmp_path, monkeypatch):
+    monkeypatch.setattr(spotify_dl, '_run_metrics', spotify_dl.RunMetrics())
+    monkeypatch.setattr(spotify_dl, '_link_prefetches', {})
+
+    async def collect() -> list:
+        return [event async for event in spotify_dl.download(["https://open.spotify.com/album/al2"], tmp_path)]
+
+    asyncio.run(collect())
+    assert spotify_dl._run_metrics.counters['link_prefetch_hits'] == 2
+
+    # Already downloaded, so the second time round no links are wanted
+    stand_in.reset_counts()
+    events = asyncio.run(collect())
+
+    assert all(event.skipped for event in events if isinstance(event, spotify_dl.TrackDone))
+    assert stand_in.request_counts['download'] == 0
+    assert spotify_dl._link_prefetches == {}
+
+
+def test_import_from_another_thread_leaves_signal_handling_alone():
+    script = (
+        "import signal, threading\n"
+        "handler = signal.getsignal(signal.SIGINT)\n"
+        "errors = []\n"
+        "def load():\n"
+        "    try:\n"
+        "        import spotify_dl\n"
+        "    except Exception as exc:\n"
+        "        errors.append(exc)\n"
+        "thread = threading.Thread(target=load)\n"
+        "thread.start()\n"
+        "thread.join()\n"
+        "assert not errors, errors\n"
+        "assert signal.getsignal(signal.SIGINT) is handler\n"
+    )
+    subprocess.run([sys.executable, '-c', script], env={**os.environ, 'PYTHONPATH': str(SRC_DIR)}, check=True)
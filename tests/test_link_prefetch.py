@@ -0,0 +1,23 @@
+from time import time
+
+import spotify_dl
+
+
+def test_prefetched_link_ages_from_when_it_was_cached(monkeypatch):
+    cache = spotify_dl.MetadataCache(None)
+    monkeypatch.setattr(spotify_dl, '_metadata_cache', cache)
+    monkeypatch.setattr(spotify_dl, 'CACHE_LINK_TTL', 60)
+
+    cache.put('track', "t1", {'title': "Track 1"})
+    cache.put('link', "t1", "https://example.com/t1.mp3")
+    # Cached 50s ago: still valid now, but not for another 60s
+    cache._conn.execute("UPDATE entries SET stored_at = ? WHERE kind = 'link'", (time() - 50,))
+
+    resp_json, issued_at = spotify_dl._get_track_data("t1")
+    assert resp_json['link'] == "https://example.com/t1.mp3"
+    assert time() - issued_at >= 50
+
+    spotify_dl.prefetch_link("t1")
+    spotify_dl._link_prefetches["t1"].result()
+    monkeypatch.setattr(spotify_dl, 'time', lambda: issued_at + 61)
+    assert spotify_dl._take_prefetched_link("t1") is None
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import spotify_dl
+
+
+def test_deleted_track_is_no_longer_a_duplicate(tmp_path, monkeypatch):
+    monkeypatch.setattr(spotify_dl, '_manifests', {})
+    track_path = tmp_path/"Track 1 - Artist.mp3"
+    track_path.write_bytes(b"audio")
+    spotify_dl.get_manifest(tmp_path).record("t1", track_path, "ab" * 32)
+
+    # Renamed by a different title template since: the manifest still finds it
+    assert spotify_dl._existing_track_path("t1", "Track 1 (Remastered) - Artist", tmp_path) == track_path
+
+    track_path.unlink()
+    assert spotify_dl._existing_track_path("t1", "Track 1 - Artist", tmp_path) is None
+
+
+def test_needs_fetch_stays_off_the_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(spotify_dl, '_manifests', {})
+    track_path = tmp_path/"Track 1 - Artist.mp3"
+    track_path.write_bytes(b"audio")
+    spotify_dl.get_manifest(tmp_path).record("t1", track_path, "ab" * 32)
+
+    def no_stat(*args, **kwargs):
+        raise AssertionError("stat() on the prefetch side")
+
+    with monkeypatch.context() as patched:
+        for name in ('stat', 'exists', 'is_file'):
+            patched.setattr(Path, name, no_stat)
+
+        # Goes by the manifest; whether the file is still there is for the worker to find out
+        assert not spotify_dl._needs_fetch("t1", [(tmp_path, "Track 1 - Artist", True)])
+        assert spotify_dl._needs_fetch("t2", [(tmp_path, "Track 2 - Artist", True)])
@@ -0,0 +1,88 @@
+import pytest
+
+import spotify_dl
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(spotify_dl, 'time', lambda: now[0])
+    return now
+
+
+def keys(cache) -> list:
+    return sorted(key for (key,) in cache._conn.execute("SELECT key FROM entries"))
+
+
+def test_entries_expire_after_their_ttl(clock):
+    cache = spotify_dl.MetadataCache(None)
+    cache.put('track', "t1", {'title': "Track 1"})
+
+    clock[0] += 59
+    assert cache.get('track', "t1", ttl=60) == {'title': "Track 1"}
+    assert cache.get_stored('track', "t1", ttl=60) == ({'title': "Track 1"}, 1000.0)
+
+    clock[0] += 2
+    assert cache.get('track', "t1", ttl=60) is None
+    # Each kind of data has its own TTL
+    assert cache.get('track', "t1", ttl=3600) == {'title': "Track 1"}
+
+
+def test_kinds_are_kept_apart(clock):
+    cache = spotify_dl.MetadataCache(None)
+    cache.put('track', "t1", {'title': "Track 1"})
+    cache.put('link', "t1", "https://example.com/t1.mp3")
+    cache.delete('link', "t1")
+
+    assert cache.get('link', "t1", ttl=60) is None
+    assert cache.get('track', "t1", ttl=60) == {'title': "Track 1"}
+
+
+def test_refresh_ignores_what_earlier_runs_stored(tmp_path, clock):
+    cache = spotify_dl.MetadataCache(tmp_path/"cache.sqlite3")
+    cache.put('track', "t1", {'title': "Track 1"})
+    cache.close()
+
+    clock[0] += 10
+    cache = spotify_dl.MetadataCache(tmp_path/"cache.sqlite3", refresh=True)
+    assert cache.get('track', "t1", ttl=3600) is None
+
+    # What this run stores is used again
+    clock[0] += 1
+    cache.put('track', "t1", {'title': "Track 1 (Remastered)"})
+    assert cache.get('track', "t1", ttl=3600) == {'title': "Track 1 (Remastered)"}
+    cache.close()
+
+    cache = spotify_dl.MetadataCache(tmp_path/"cache.sqlite3")
+    assert cache.get('track', "t1", ttl=3600) == {'title': "Track 1 (Remastered)"}
+    cache.close()
+
+
+def test_least_recently_used_are_evicted(monkeypatch, clock):
+    monkeypatch.setattr(spotify_dl.MetadataCache, '_EVICT_EVERY', 5)
+    cache = spotify_dl.MetadataCache(None, max_entries=3)
+
+    for num in range(4):
+        clock[0] += 1
+        cache.put('track', f"t{num}", num)
+
+    # Read, so more recently used than t1-t3
+    clock[0] += 1
+    assert cache.get('track', "t0", ttl=60) == 0
+
+    # The fifth put evicts down to max_entries
+    clock[0] += 1
+    cache.put('track', "t4", 4)
+    assert keys(cache) == ["t0", "t3", "t4"]
+
+
+def test_close_evicts_too(tmp_path, clock):
+    cache = spotify_dl.MetadataCache(tmp_path/"cache.sqlite3", max_entries=2)
+    for num in range(5):
+        clock[0] += 1
+        cache.put('track', f"t{num}", num)
+    cache.close()
+
+    cache = spotify_dl.MetadataCache(tmp_path/"cache.sqlite3", max_entries=2)
+    assert keys(cache) == ["t3", "t4"]
+    cache.close()
@@ -0,0 +1,19 @@
+import pstats
+import threading
+
+import spotify_dl
+
+
+def busy_worker() -> int:
+    return sum(num * num for num in range(10_000))
+
+
+def test_profile_covers_worker_threads(tmp_path):
+    profilers = spotify_dl._start_profiling()
+    worker = threading.Thread(target=busy_worker)
+    worker.start()
+    worker.join()
+    spotify_dl._dump_profile(profilers, tmp_path/"run.prof")
+
+    profiled = {function for _, _, function in pstats.Stats(str(tmp_path/"run.prof")).stats}
+    assert 'busy_worker' in profiled
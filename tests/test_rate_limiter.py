@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+import spotify_dl
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(spotify_dl, 'monotonic', clock)
+    monkeypatch.setattr(spotify_dl, 'sleep', clock.sleep)
+    return clock
+
+
+class FakeResponse:
+
+    def __init__(self, headers: dict):
+        self.headers = headers
+
+
+def test_burst_then_token_debt(monkeypatch, clock):
+    # Concurrent callers reserve tokens before any of them has slept
+    monkeypatch.setattr(spotify_dl, 'sleep', lambda seconds: None)
+    limiter = spotify_dl.RateLimiter(10)
+
+    assert [limiter.acquire() for _ in range(10)] == [0.0] * 10
+    assert [limiter.acquire() for _ in range(3)] == pytest.approx([0.1, 0.2, 0.3])
+    assert limiter.wait_time == pytest.approx(0.6)
+
+
+def test_steady_rate_once_the_burst_is_spent(clock):
+    limiter = spotify_dl.RateLimiter(10)
+    for _ in range(10):
+        limiter.acquire()
+
+    for _ in range(5):
+        assert limiter.acquire() == pytest.approx(0.1)
+
+
+def test_retry_after_blocks_every_request(clock):
+    limiter = spotify_dl.RateLimiter(10)
+    limiter.record_response(429, retry_after=5.0)
+
+    assert limiter.acquire() == pytest.approx(5.0)
+    assert limiter.throttled == 1
+
+
+def test_throttling_halves_the_rate_and_success_recovers_it(clock):
+    limiter = spotify_dl.RateLimiter(10, min_rate=1.0)
+
+    for rate in (5.0, 2.5, 1.25, 1.0, 1.0):
+        limiter.record_response(503)
+        assert limiter.rate == pytest.approx(rate)
+
+    for rate in (1.5, 2.0, 2.5):
+        limiter.record_response(200)
+        assert limiter.rate == pytest.approx(rate)
+
+    for _ in range(100):
+        limiter.record_response(200)
+    assert limiter.rate == 10
+
+
+@pytest.mark.parametrize("retry_after, expected", [
+    (None, None),
+    ("3", 3.0),
+    ("1.5", 1.5),
+    ("-2", 0.0),
+    ("soon", None),
+])
+def test_parse_retry_after_seconds(retry_after, expected):
+    headers = {'Retry-After': retry_after} if retry_after else {}
+
+    assert spotify_dl._parse_retry_after(FakeResponse(headers)) == expected
+
+
+def test_parse_retry_after_http_date():
+    in_30s = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    an_hour_ago = format_datetime(datetime.now(timezone.utc) - timedelta(hours=1), usegmt=True)
+
+    assert spotify_dl._parse_retry_after(FakeResponse({'Retry-After': in_30s})) == pytest.approx(30, abs=2)
+    assert spotify_dl._parse_retry_after(FakeResponse({'Retry-After': an_hour_ago})) == 0.0
+
+
+def test_http_request_waits_out_429s(stand_in, clock):
+    throttled = iter([True, True])
+    stand_in.throttled = lambda: next(throttled, False)
+    stand_in.retry_after = 7
+
+    resp = spotify_dl._http_request('GET', f"{stand_in.api_url}/download/t1", profile='api')
+
+    assert resp.status_code == 200
+    assert stand_in.request_counts['429'] == 2
+    # Both Retry-Afters waited out before the next request went out
+    assert clock.sleeps.count(7.0) == 2
+    limiter = spotify_dl._rate_limiter(stand_in.api_url)
+    assert limiter.throttled == 2
+    # Halved twice, then back up a step for the success
+    assert limiter.rate == pytest.approx(spotify_dl.API_RATE_LIMIT / 4 + spotify_dl.API_RATE_LIMIT / 20)
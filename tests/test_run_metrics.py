@@ -0,0 +1,10 @@
+import spotify_dl
+
+
+def test_run_metrics_keep_at_most_max_tracks():
+    metrics = spotify_dl.RunMetrics(max_tracks=3)
+    for num in range(10):
+        metrics.track_status(f"t{num}", 'downloaded')
+
+    assert list(metrics.tracks) == ['t7', 't8', 't9']
+    assert metrics.counters['tracks_downloaded'] == 10
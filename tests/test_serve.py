@@ -0,0 +1,56 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import spotify_dl
+
+
+@pytest.fixture(scope='module')
+def server():
+    daemon = spotify_dl.DownloadDaemon(max_transfers=1)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), spotify_dl._make_serve_handler(daemon))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    yield httpd
+
+    httpd.shutdown()
+    httpd.server_close()
+    daemon.close()
+
+
+def request(httpd, method: str, path: str, body: bytes = None, headers: dict = None) -> tuple:
+    conn = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=5)
+    conn.request(method, path, body, headers or {})
+    resp = conn.getresponse()
+    result = resp.status, json.loads(resp.read())
+    conn.close()
+    return result
+
+
+def test_lists_jobs(server):
+    assert request(server, 'GET', '/jobs') == (200, {'jobs': []})
+
+
+def test_rejects_jobs_not_posted_as_json(server):
+    body = json.dumps({'urls': ["https://open.spotify.com/track/x"]}).encode()
+    status, _ = request(server, 'POST', '/jobs', body, {'Content-Type': 'text/plain'})
+
+    assert status == 415
+
+
+def test_rejects_foreign_origin(server):
+    body = json.dumps({'urls': ["https://open.spotify.com/track/x"]}).encode()
+    status, _ = request(server, 'POST', '/jobs', body, {'Content-Type': 'application/json', 'Origin': "https://example.com"})
+
+    assert status == 403
+
+
+def test_rejects_foreign_host(server):
+    # A DNS rebinding page: its own name, pointed at 127.0.0.1
+    status, _ = request(server, 'GET', '/jobs', headers={'Host': f"evil.example:{server.server_address[1]}"})
+
+    assert status == 403
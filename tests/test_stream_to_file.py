@@ -0,0 +1,85 @@
+import hashlib
+
+import pytest
+
+import spotify_dl
+
+# The tag a download is written with, in place of the source's
+HEADER = b'ID3\x04\x00\x00\x00\x00\x00\x05' + b'ours!'
+
+
+def source_tag(size: int) -> bytes:
+    # An ID3v2 tag of size bytes in all, header included
+    payload_size = size - 10
+    syncsafe = bytes((payload_size >> shift) & 0x7f for shift in (21, 14, 7, 0))
+    return b'ID3\x04\x00\x00' + syncsafe + b'\x00' * payload_size
+
+
+@pytest.fixture
+def source(stand_in):
+    # Audio the CDN serves behind a 31 byte tag of its own
+    audio = stand_in.audio("t1")
+    tagged = source_tag(31) + audio
+    stand_in.audio = lambda track_id: tagged
+
+    return f"{stand_in.cdn_url}/cdn/t1.mp3", audio
+
+
+def check_result(dest_path, sha256: str, audio: bytes) -> None:
+    expected = HEADER + audio
+    assert dest_path.read_bytes() == expected
+    assert sha256 == hashlib.sha256(expected).hexdigest()
+    assert not dest_path.with_name(dest_path.name + '.part').exists()
+
+
+def test_fresh_download_swaps_the_source_tag_for_ours(source, tmp_path):
+    url, audio = source
+    sha256 = spotify_dl._stream_to_file(url, tmp_path/"t1.mp3", HEADER)
+
+    check_result(tmp_path/"t1.mp3", sha256, audio)
+
+
+@pytest.mark.parametrize("cut", [1, 5000, -1, 0])
+def test_resumes_a_part_file(stand_in, source, tmp_path, cut):
+    url, audio = source
+    cut = cut if cut > 0 else len(audio) + cut
+    (tmp_path/"t1.mp3.part").write_bytes(HEADER + audio[:cut])
+    stand_in.reset_counts()
+
+    sha256 = spotify_dl._stream_to_file(url, tmp_path/"t1.mp3", HEADER)
+
+    check_result(tmp_path/"t1.mp3", sha256, audio)
+    # A probe for the source tag's size, then the rest (a 416 if there's none left)
+    assert stand_in.reset_counts()['cdn'] == 2
+
+
+def test_starts_over_if_range_is_ignored(stand_in, source, tmp_path):
+    url, audio = source
+    stand_in.range_requests = False
+    (tmp_path/"t1.mp3.part").write_bytes(HEADER + audio[:5000])
+
+    sha256 = spotify_dl._stream_to_file(url, tmp_path/"t1.mp3", HEADER)
+
+    check_result(tmp_path/"t1.mp3", sha256, audio)
+
+
+def test_starts_over_if_the_part_file_has_another_tag(stand_in, source, tmp_path):
+    url, audio = source
+    (tmp_path/"t1.mp3.part").write_bytes(HEADER.replace(b'ours!', b'old!!') + audio[:5000])
+    stand_in.reset_counts()
+
+    sha256 = spotify_dl._stream_to_file(url, tmp_path/"t1.mp3", HEADER)
+
+    check_result(tmp_path/"t1.mp3", sha256, audio)
+    # No probe: nothing in the .part was kept
+    assert stand_in.reset_counts()['cdn'] == 1
+
+
+def test_resumes_audio_without_a_source_tag(stand_in, tmp_path):
+    url = f"{stand_in.cdn_url}/cdn/t1.mp3"
+    audio = stand_in.audio("t1")
+    (tmp_path/"t1.mp3.part").write_bytes(HEADER + audio[:5000])
+
+    sha256 = spotify_dl._stream_to_file(url, tmp_path/"t1.mp3", HEADER)
+
+    check_result(tmp_path/"t1.mp3", sha256, audio)
@@ -0,0 +1,102 @@
+import json
+
+import spotify_dl
+
+PLAYLIST_URL = "https://open.spotify.com/playlist/synced"
+
+
+def set_playlist(stand_in, tracks: list) -> None:
+    # tracks are (track id, title) pairs, all on one page
+    def track_list(entity_type, entity_id, offset):
+        return {
+            'trackList': [
+                {'id': track_id, 'title': title, 'artists': "Stand-in Artist", 'album': "Stand-in Album"}
+                for track_id, title in tracks
+            ],
+            'nextOffset': None
+        }
+
+    stand_in.track_list = track_list
+
+
+def sync(output_dir, removed_action: str = None, removed_dir=None) -> list:
+    spotify_dl._manifests.clear()
+    spotify_dl._sync_states.clear()
+
+    return spotify_dl.download_config_entries(
+        [{'url': PLAYLIST_URL, 'output_dir': str(output_dir)}],
+        jobs=2,
+        sync=True,
+        removed_action=removed_action,
+        removed_dir=removed_dir
+    )
+
+
+def filenames(directory) -> list:
+    return sorted(path.name for path in directory.glob('*.mp3'))
+
+
+def test_delta_downloads_added_tracks_only(stand_in, tmp_path):
+    set_playlist(stand_in, [(f"t{num}", f"Song {num}") for num in range(4)])
+    assert sync(tmp_path) == []
+    stand_in.reset_counts()
+
+    set_playlist(stand_in, [("t0", "Song 0"), ("t2", "Song 2"), ("t4", "Song 4"), ("t3", "Song 3")])
+    tracks, sync_key, synced_tracks, removed = spotify_dl.resolve_sync(PLAYLIST_URL, tmp_path, r"{title} - {artist}")
+
+    assert tracks == [("t4", "Song 4 - Stand-in Artist")]
+    assert sync_key == "playlist/synced"
+    assert [track_id for track_id, _ in synced_tracks] == ["t0", "t2", "t4", "t3"]
+    assert removed == ["t1"]
+
+    assert sync(tmp_path) == []
+    assert stand_in.reset_counts()['cdn'] == 1
+    # Without --prune/--move, removed tracks stay
+    assert len(filenames(tmp_path)) == 5
+
+
+def test_removed_tracks_are_pruned_in_playlist_order(stand_in, tmp_path, capsys):
+    set_playlist(stand_in, [(f"t{num}", f"Song {num}") for num in range(5)])
+    sync(tmp_path)
+
+    set_playlist(stand_in, [("t2", "Song 2")])
+    capsys.readouterr()
+    sync(tmp_path, removed_action='prune')
+
+    assert filenames(tmp_path) == ["Song 2 - Stand-in Artist.mp3"]
+    removals = [line for line in capsys.readouterr().out.splitlines() if line.startswith("Removed '")]
+    assert removals == [f"Removed 'Song {num} - Stand-in Artist.mp3'." for num in (0, 1, 3, 4)]
+    assert all(spotify_dl.get_manifest(tmp_path).get(f"t{num}") is None for num in (0, 1, 3, 4))
+
+
+def test_removed_tracks_are_moved(stand_in, tmp_path):
+    output_dir = tmp_path/"music"
+    removed_dir = tmp_path/"removed"
+    output_dir.mkdir()
+    set_playlist(stand_in, [("t0", "Song 0"), ("t1", "Song 1")])
+    sync(output_dir)
+
+    set_playlist(stand_in, [("t0", "Song 0")])
+    sync(output_dir, removed_action='move', removed_dir=removed_dir)
+
+    assert filenames(output_dir) == ["Song 0 - Stand-in Artist.mp3"]
+    assert filenames(removed_dir) == ["Song 1 - Stand-in Artist.mp3"]
+    assert spotify_dl.get_manifest(removed_dir).get("t1")['path'] == "Song 1 - Stand-in Artist.mp3"
+
+
+def test_prune_keeps_files_of_new_tracks_with_the_same_name(stand_in, tmp_path):
+    # Re-releases swapped in under new ids, with the same titles
+    set_playlist(stand_in, [(f"old{num}", f"Song {num}") for num in range(6)])
+    sync(tmp_path)
+
+    set_playlist(stand_in, [(f"new{num}", f"Song {num}") for num in range(4)])
+    assert sync(tmp_path, removed_action='prune') == []
+
+    assert filenames(tmp_path) == [f"Song {num} - Stand-in Artist.mp3" for num in range(4)]
+    sync_state = json.loads((tmp_path/spotify_dl.SYNC_STATE_FILENAME).read_text())
+    assert sync_state["playlist/synced"]['tracks'] == [f"new{num}" for num in range(4)]
+    assert sync_state["playlist/synced"]['pending'] == []
+
+    manifest = spotify_dl.get_manifest(tmp_path)
+    assert [manifest.get(f"new{num}")['path'] for num in range(4)] == filenames(tmp_path)
+    assert all(manifest.get(f"old{num}") is None for num in range(6))
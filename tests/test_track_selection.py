@@ -0,0 +1,58 @@
+import pytest
+
+from spotify_dl import TrackSelection
+
+
+@pytest.mark.parametrize("given_inp, ranges", [
+    ("*", [(0, 10)]),
+    ("1, 4, 15-", [(0, 1), (3, 4)]),
+    ("4-9", [(3, 9)]),
+    ("8-", [(7, 10)]),
+    ("-3", [(0, 3)]),
+    ("-3-", [(7, 10)]),
+    ("-5--2", [(5, 9)]),
+    ("1-3, 2-5, 7", [(0, 5), (6, 7)]),
+    ("8-15", [(7, 10)]),
+    (" 2 ,  3 ", [(1, 3)]),
+])
+def test_ranges(given_inp, ranges):
+    selection = TrackSelection.parse(given_inp, list_len=10)
+
+    assert selection.ranges == ranges
+    assert len(selection) == sum(end - start for start, end in ranges)
+
+
+@pytest.mark.parametrize("given_inp", ["-0", "0-", "0-3", "2-0", "3-1", "12-15", "-", "1-2-3", "x", "--2"])
+def test_invalid_ranges_are_dropped_with_a_warning(given_inp):
+    selection = TrackSelection.parse(f"5, {given_inp}", list_len=10)
+
+    assert selection.ranges == [(4, 5)]
+    assert selection.warnings == [f"[!] Invalid input: {given_inp}"]
+
+
+def test_out_of_range_track_number():
+    selection = TrackSelection.parse("0, 11", list_len=10)
+
+    assert not selection
+    assert selection.warnings == [
+        "Track number 0 does not exist.  Valid numbers are 1 - 10",
+        "Track number 11 does not exist.  Valid numbers are 1 - 10",
+        "[!] No valid input received: '0, 11'. Try again.",
+    ]
+
+
+def test_apply_yields_track_numbers_in_order():
+    tracks = [f"t{num}" for num in range(1, 11)]
+
+    assert list(TrackSelection.parse("9-, 2", list_len=10).apply(tracks)) == [(2, "t2"), (9, "t9"), (10, "t10")]
+
+
+def test_warnings_are_returned_not_printed(capsys):
+    selection = TrackSelection.parse("1, 40, x", list_len=10)
+
+    assert selection.ranges == [(0, 1)]
+    assert selection.warnings == [
+        "Track number 40 does not exist.  Valid numbers are 1 - 10",
+        "[!] Invalid input: x",
+    ]
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,63 @@
+import os
+from time import time
+
+import spotify_dl
+
+
+def no_hardlinks(monkeypatch):
+    # As if the store were on another filesystem than the output directory
+    def link(source_path, dest_path):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(spotify_dl.os, 'link', link)
+
+
+def test_gc_keeps_blobs_copied_out(tmp_path, monkeypatch):
+    no_hardlinks(monkeypatch)
+    store = spotify_dl.TrackStore(tmp_path/"store")
+
+    track_path = tmp_path/"out"/"a.mp3"
+    track_path.parent.mkdir()
+    track_path.write_bytes(b"audio")
+    store.add("t1", track_path, "ab" * 32)
+    placed_path = tmp_path/"out"/"b.mp3"
+    assert store.place("t1", placed_path) == "ab" * 32
+
+    assert store.gc() == (0, 0)
+
+    track_path.unlink()
+    assert store.gc() == (0, 0)
+
+    placed_path.unlink()
+    assert store.gc() == (1, 5)
+    assert store.get("t1") is None
+    store.close()
+
+
+def test_gc_keeps_blobs_hardlinked_out(tmp_path):
+    store = spotify_dl.TrackStore(tmp_path/"store")
+
+    track_path = tmp_path/"a.mp3"
+    track_path.write_bytes(b"audio")
+    store.add("t1", track_path, "ab" * 32)
+
+    assert store.gc() == (0, 0)
+
+    track_path.unlink()
+    assert store.gc() == (1, 5)
+    store.close()
+
+
+def test_gc_leaves_recent_tmp_files(tmp_path):
+    store = spotify_dl.TrackStore(tmp_path/"store")
+    (tmp_path/"store"/"objects"/"ab").mkdir()
+    recent_path = tmp_path/"store"/"objects"/"ab"/"x.mp3.1.2.tmp"
+    recent_path.write_bytes(b"half")
+    stale_path = tmp_path/"store"/"objects"/"ab"/"y.mp3.1.2.tmp"
+    stale_path.write_bytes(b"stale")
+    stale_time = time() - spotify_dl.STORE_TMP_GRACE - 60
+    os.utime(stale_path, (stale_time, stale_time))
+
+    assert store.gc() == (1, 5)
+    assert recent_path.exists()
+    store.close()
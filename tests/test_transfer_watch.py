@@ -0,0 +1,53 @@
+import pytest
+
+import spotify_dl
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FakeLimiter:
+    # Token bucket shared by `transfers` transfers, moving the clock on instead of sleeping
+
+    def __init__(self, clock: FakeClock, rate: float, transfers: int):
+        self.clock = clock
+        self.rate = rate
+        self.transfers = transfers
+
+    def acquire(self, tokens: float = 1) -> float:
+        wait = tokens * self.transfers / self.rate
+        self.clock.now += wait
+        return wait
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(spotify_dl, 'monotonic', clock)
+    return clock
+
+
+def test_bandwidth_cap_below_stall_floor_is_not_a_stall(monkeypatch, clock):
+    # 40 KB/s over 4 transfers is ~10 KiB/s each, under STALL_MIN_BYTES_PER_SEC
+    monkeypatch.setattr(spotify_dl, '_get_bandwidth_limiter', lambda: FakeLimiter(clock, 40_000, 4))
+    watch = spotify_dl.TransferWatch()
+
+    for _ in range(100):
+        watch.chunk(16 * 1024)
+        clock.now += 0.001
+
+
+def test_slow_network_is_still_a_stall(monkeypatch, clock):
+    monkeypatch.setattr(spotify_dl, '_get_bandwidth_limiter', lambda: None)
+    watch = spotify_dl.TransferWatch()
+
+    with pytest.raises(spotify_dl.TransferStalledError):
+        for _ in range(100):
+            clock.now += 1.0
+            watch.chunk(1024)